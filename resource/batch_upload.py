@@ -0,0 +1,128 @@
+"""
+Multi-file uploads as one batch.
+
+All names are checked against the folder with one query before anything is written.
+A name that is taken is handled by the `on_conflict` policy:
+
+    error        reject the whole batch and write nothing (the default)
+    skip         leave the existing file, skip this one
+    rename       store this one as "name (1).ext", "name (2).ext", ...
+    new_version  add this one as a new version of the existing file (owner only)
+
+New files go in with one bulk INSERT inside a single transaction, so a batch is
+either stored completely or not at all, and the caller gets back only the files the
+batch created or changed.
+"""
+import os
+
+from django.db import transaction
+from django.db.models import Q
+
+from . import events, extraction, facets, refdata
+from .blobs import store_blobs
+from .models import UploadedFile
+
+
+ERROR = 'error'
+SKIP = 'skip'
+RENAME = 'rename'
+NEW_VERSION = 'new_version'
+POLICIES = (ERROR, SKIP, RENAME, NEW_VERSION)
+
+# Per-file outcomes
+CREATED = 'created'
+RENAMED = 'renamed'
+VERSIONED = 'new_version'
+SKIPPED = 'skipped'
+CONFLICT = 'conflict'
+
+
+def _numbered(name, number):
+    stem, extension = os.path.splitext(name)
+    return f"{stem} ({number}){extension}"
+
+
+def _taken(folder, names, policy):
+    """ {name: (id, owner id)} of the files in `folder` the batch can collide with, in one query. """
+    condition = Q(name__in=names)
+    if policy == RENAME:
+        # Also the numbered names a rename could pick
+        for name in set(names):
+            stem, extension = os.path.splitext(name)
+            condition |= Q(name__startswith=f"{stem} (", name__endswith=f"){extension}")
+    rows = UploadedFile.objects.filter(folder=folder).filter(condition).values_list('name', 'id', 'owner_id')
+    return {name: (pk, owner_id) for name, pk, owner_id in rows}
+
+
+def plan(folder, names, policy, user):
+    """ One {"name", "status", "stored_as", "id"} decision per name, in order. Runs one query. """
+    existing = _taken(folder, names, policy)
+    taken = set(existing)
+    decisions = []
+    for name in names:
+        decision = {"name": name, "status": CREATED, "stored_as": name, "id": None}
+        if name in taken:
+            if policy == RENAME:
+                number = 1
+                while _numbered(name, number) in taken:
+                    number += 1
+                decision.update(status=RENAMED, stored_as=_numbered(name, number))
+            elif policy == NEW_VERSION and name in existing and existing[name][1] == user.pk:
+                decision.update(status=VERSIONED, id=existing[name][0])
+            elif policy == SKIP or (policy == NEW_VERSION and name not in existing):
+                # A second copy of a name within the same batch has nothing to be a version of
+                decision.update(status=SKIPPED, stored_as=None, id=existing.get(name, (None,))[0])
+            else:
+                decision.update(status=CONFLICT, stored_as=None, id=existing.get(name, (None,))[0])
+        taken.add(decision["stored_as"])
+        decisions.append(decision)
+    return decisions
+
+
+def upload(user, folder, uploads, policy=ERROR, category_id=None, is_public=False):
+    """
+    Store `uploads` (UploadedFile objects from request.FILES) in `folder`.
+    Returns (decisions, changed files); nothing is written if any decision is a conflict.
+    """
+    decisions = plan(folder, [upload.name for upload in uploads], policy, user)
+    if any(decision["status"] == CONFLICT for decision in decisions):
+        return decisions, []
+
+    to_store = [
+        (decision, content) for decision, content in zip(decisions, uploads)
+        if decision["status"] in (CREATED, RENAMED, VERSIONED)
+    ]
+    blobs = store_blobs([content for _, content in to_store])
+    category = refdata.category(category_id or refdata.default_category_id())
+
+    new_files, versions = [], []
+    for (decision, content), blob in zip(to_store, blobs):
+        if decision["status"] == VERSIONED:
+            versions.append((decision, blob))
+            continue
+        uploaded_file = UploadedFile(
+            name=decision["stored_as"],
+            category=category,
+            folder=folder,
+            owner=user,
+            is_public=is_public,
+        )
+        uploaded_file.use_blob(blob)
+        new_files.append((decision, uploaded_file))
+
+    with transaction.atomic():
+        UploadedFile.objects.bulk_add([uploaded_file for _, uploaded_file in new_files])
+        targets = UploadedFile.objects.select_related('owner', 'category').in_bulk([d["id"] for d, _ in versions])
+        for decision, blob in versions:
+            targets[decision["id"]].add_version(blob, file_name=decision["name"], uploaded_by=user)
+
+        # What post_save does for files saved one at a time
+        created = [uploaded_file for _, uploaded_file in new_files]
+        extraction.queue_blobs((f.blob_id, f.file_type) for f in created)
+        events.files_changed([(f.pk, f.folder_id) for f in created], 'created')
+        if created:
+            facets.changed()
+
+    for decision, uploaded_file in new_files:
+        decision["id"] = uploaded_file.pk
+    return decisions, created + [targets[decision["id"]] for decision, _ in versions]
@@ -0,0 +1,132 @@
+"""
+Content-addressed blob storage.
+
+Every distinct content is stored once under blobs/<aa>/<bb>/<sha256> and shared by
+all UploadedFile and FileVersion rows with the same bytes. The SHA-256 is computed
+by the upload handlers below while the request body streams in, so a duplicate
+upload is recognised without re-reading it and is never written to storage.
+
+Content without a Blob row is always written, never matched to a file already at
+its name: that file may belong to a blob being collected, and storage gives the new
+copy a name of its own. Bytes stored by a request that then failed are left as
+unreferenced rows or files without a row; `manage.py collect_blobs` sweeps both.
+"""
+import hashlib
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+
+from .models import Blob
+
+
+class HashingUploadHandlerMixin:
+    """ Feed every received chunk into a SHA-256 and attach the digest to the finished file. """
+
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        # The memory handler passes large files through to the next handler, which hashes them
+        if getattr(self, 'activated', True):
+            self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def blob_name(digest):
+    return f"blobs/{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+def file_digest(content):
+    """ SHA-256 of `content`, taken from the upload handler when it already computed one. """
+    digest = getattr(content, 'sha256', None)
+    if digest:
+        return digest
+    sha256 = hashlib.sha256()
+    for chunk in content.chunks():
+        sha256.update(chunk)
+    content.seek(0)
+    return sha256.hexdigest()
+
+
+def store_blob(content):
+    """
+    Return the Blob holding `content`, writing the bytes only if no blob has them yet.
+
+    The returned blob is not referenced yet; assigning it to a row with use_blob()
+    and saving takes the reference.
+    """
+    digest = file_digest(content)
+    blob = Blob.objects.filter(sha256=digest).first()
+    if blob is not None:
+        return blob
+
+    name = default_storage.save(blob_name(digest), content)
+    try:
+        with transaction.atomic():
+            return Blob.objects.create(sha256=digest, file=name, size=content.size)
+    except IntegrityError:
+        # Another request stored the same content first; drop our copy
+        blob = Blob.objects.get(sha256=digest)
+        if blob.file.name != name:
+            default_storage.delete(name)
+        return blob
+
+
+def store_blobs(contents):
+    """
+    store_blob for a batch of uploads: one lookup for all digests and one INSERT for the
+    contents not stored yet. Returns the blobs in the order of `contents`.
+    """
+    digests = [file_digest(content) for content in contents]
+    blobs = Blob.objects.in_bulk(set(digests), field_name='sha256')
+    new = {}
+    for digest, content in zip(digests, contents):
+        if digest in blobs or digest in new:
+            continue
+        name = default_storage.save(blob_name(digest), content)
+        new[digest] = Blob(sha256=digest, file=name, size=content.size)
+
+    if new:
+        Blob.objects.bulk_create(new.values(), ignore_conflicts=True)
+        blobs.update(Blob.objects.in_bulk(new.keys(), field_name='sha256'))
+        for digest, blob in new.items():
+            # Another request stored the same content first; drop our copy
+            if blob.file.name != blobs[digest].file.name:
+                default_storage.delete(blob.file.name)
+    return [blobs[digest] for digest in digests]
+
+
+def sweep_files(before):
+    """
+    Delete files under blobs/ that no Blob row points at and that were written before
+    `before`, one query per directory. Returns how many went.
+    """
+    deleted = 0
+    if not default_storage.exists('blobs'):
+        return deleted
+    for top in default_storage.listdir('blobs')[0]:
+        for sub in default_storage.listdir(f'blobs/{top}')[0]:
+            directory = f'blobs/{top}/{sub}'
+            names = [f'{directory}/{name}' for name in default_storage.listdir(directory)[1]]
+            known = set(Blob.objects.filter(file__in=names).values_list('file', flat=True))
+            for name in names:
+                if name not in known and default_storage.get_modified_time(name) < before:
+                    default_storage.delete(name)
+                    deleted += 1
+    return deleted
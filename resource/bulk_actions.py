@@ -0,0 +1,162 @@
+"""
+Star, archive, move and delete many files and folders in one request.
+
+Each action is one conditional UPDATE or DELETE per model, filtered on the ids and on
+`owner = user`, so ids the user doesn't own are never touched and two clients can't
+overwrite each other's flags with stale copies. The rows are read back afterwards to
+report their new state; ids missing from the result were skipped (not found, not the
+user's, or not applicable, e.g. archiving a folder).
+
+Folder moves go through Folder.save() one folder at a time, because each one
+re-roots its subtree's paths, access grants and storage totals.
+"""
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from . import events, facets, search
+from .models import BULK_ACCOUNTED, AccessGrant, Blob, FileVersion, Folder, StorageUsage, UploadedFile
+
+
+STAR = 'star'
+UNSTAR = 'unstar'
+ARCHIVE = 'archive'
+UNARCHIVE = 'unarchive'
+MOVE = 'move'
+DELETE = 'delete'
+ACTIONS = (STAR, UNSTAR, ARCHIVE, UNARCHIVE, MOVE, DELETE)
+
+
+def _result(files, folders, file_ids, folder_ids):
+    done_files = {entry["id"] for entry in files}
+    done_folders = {entry["id"] for entry in folders}
+    return {
+        "files": files,
+        "folders": folders,
+        "skipped": {
+            "files": [pk for pk in file_ids if pk not in done_files],
+            "folders": [pk for pk in folder_ids if pk not in done_folders],
+        },
+    }
+
+
+def _set_flag(user, field, value, file_ids, folder_ids):
+    files, folders = [], []
+    with transaction.atomic():
+        if file_ids:
+            owned = UploadedFile.objects.filter(pk__in=file_ids, owner=user)
+            owned.update(**{field: value})
+            rows = list(owned.values_list('pk', 'folder_id', field))
+            files = [{"id": pk, field: state} for pk, _, state in rows]
+            transaction.on_commit(lambda: events.files_changed([(pk, folder_id) for pk, folder_id, _ in rows], 'updated'))
+            if field == 'is_archived' and rows:
+                facets.changed()
+        if folder_ids:
+            owned = Folder.objects.filter(pk__in=folder_ids, owner=user)
+            owned.update(**{field: value})
+            folders = [{"id": pk, field: state} for pk, state in owned.values_list('pk', field)]
+    return files, folders
+
+
+def _move(user, file_ids, folder_ids, target):
+    files, folders = [], []
+    target_id = target.pk if target else None
+    with transaction.atomic():
+        if file_ids:
+            rows = list(
+                UploadedFile.objects.select_for_update().filter(pk__in=file_ids, owner=user)
+                .exclude(folder_id=target_id).values_list('pk', 'name', 'folder_id', 'file_size')
+            )
+            # Names stay unique per folder, as uploads require
+            taken = set(UploadedFile.objects.filter(folder_id=target_id, name__in=[name for _, name, _, _ in rows]).values_list('name', flat=True))
+            movable = []
+            for row in rows:
+                if row[1] not in taken:
+                    taken.add(row[1])
+                    movable.append(row)
+            ids = [pk for pk, _, _, _ in movable]
+            if ids:
+                UploadedFile.objects.filter(pk__in=ids, owner=user).update(folder_id=target_id)
+                AccessGrant.objects.move_files(ids, target)
+                versions = dict(
+                    FileVersion.objects.filter(uploaded_file_id__in=ids).values_list('uploaded_file_id')
+                    .annotate(total=Sum('file_size')).order_by()
+                )
+                entries = []
+                for pk, _, folder_id, size in movable:
+                    entries.append((user.pk, folder_id, -(size or 0), -versions.get(pk, 0), -1))
+                    entries.append((user.pk, target_id, size or 0, versions.get(pk, 0), 1))
+                StorageUsage.objects.charge(entries, paths={target_id: target.path} if target else None)
+                facets.changed()
+                transaction.on_commit(lambda: events.files_changed([(pk, target_id) for pk in ids], 'updated'))
+            files = [{"id": pk, "folder": target_id} for pk in ids]
+
+        for folder in Folder.objects.filter(pk__in=folder_ids, owner=user).exclude(pk=target_id):
+            if target and (target.pk == folder.pk or target.is_inside(folder)):
+                continue
+            if folder.parent_id != target_id:
+                folder.parent = target
+                folder.save()
+            folders.append({"id": folder.pk, "parent": target_id})
+    return files, folders
+
+
+def _delete(user, file_ids, folder_ids):
+    """ Delete the user's files and folders (with everything inside) with one DELETE per table. """
+    with transaction.atomic():
+        owned_folders = Folder.objects.filter(pk__in=folder_ids, owner=user)
+        folder_rows = list(owned_folders.values_list('pk', 'path'))
+        subtrees = Q(pk__in=[])
+        for _, path in folder_rows:
+            subtrees |= Q(folder__path__startswith=path)
+        doomed = UploadedFile.objects.filter(Q(pk__in=file_ids, owner=user) | subtrees)
+        deleted_files = list(doomed.values_list('pk', 'folder_id', 'blob_id'))
+        explicit = {pk for pk, _, _ in deleted_files} & set(file_ids)
+        if not deleted_files and not folder_rows:
+            return [], []
+
+        # What the per-row delete signals would do, in bulk
+        ids = [pk for pk, _, _ in deleted_files]
+        grantees = events.file_grantees(ids)
+        StorageUsage.objects.discharge(doomed)
+        Blob.objects.release_many(
+            [blob_id for _, _, blob_id in deleted_files]
+            + list(FileVersion.objects.filter(uploaded_file_id__in=ids).values_list('blob_id', flat=True))
+        )
+        search.remove_files(ids)
+        if ids:
+            facets.changed()
+
+        files = UploadedFile.objects.filter(pk__in=ids)
+        setattr(files, BULK_ACCOUNTED, True)
+        files.delete()
+        owned_folders = Folder.objects.filter(pk__in=[pk for pk, _ in folder_rows])
+        setattr(owned_folders, BULK_ACCOUNTED, True)
+        owned_folders.delete()
+
+        changed = [(pk, folder_id) for pk, folder_id, _ in deleted_files]
+        transaction.on_commit(lambda: events.files_changed(changed, 'deleted', grantees))
+    return (
+        [{"id": pk, "deleted": True} for pk in sorted(explicit)],
+        [{"id": pk, "deleted": True} for pk, _ in folder_rows],
+    )
+
+
+def apply(user, action, file_ids=(), folder_ids=(), target=None):
+    """
+    Run `action` on the files and folders among `file_ids` and `folder_ids` that `user`
+    owns. `target` is the destination Folder of a move (None for the root).
+    Returns {"files": [...], "folders": [...], "skipped": {"files": [...], "folders": [...]}}.
+    """
+    file_ids, folder_ids = list(dict.fromkeys(file_ids)), list(dict.fromkeys(folder_ids))
+    if action in (STAR, UNSTAR):
+        files, folders = _set_flag(user, 'is_starred', action == STAR, file_ids, folder_ids)
+    elif action in (ARCHIVE, UNARCHIVE):
+        # Folders can't be archived
+        files, folders = _set_flag(user, 'is_archived', action == ARCHIVE, file_ids, [])
+    elif action == MOVE:
+        files, folders = _move(user, file_ids, folder_ids, target)
+    elif action == DELETE:
+        files, folders = _delete(user, file_ids, folder_ids)
+    else:
+        raise ValueError(f"Unknown bulk action {action!r}")
+    return _result(files, folders, file_ids, folder_ids)
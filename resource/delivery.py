@@ -0,0 +1,236 @@
+"""
+File delivery for download_file and view_file.
+
+Adds strong ETags, Last-Modified, conditional GET (304/412) and byte-range
+requests (206, single and multipart/byteranges) on top of plain streaming.
+
+With FILE_DELIVERY_MODE set to "x-accel-redirect" (nginx) or "x-sendfile"
+(Apache mod_xsendfile, lighttpd), Django only looks the file up, authorizes
+and validates the request, then hands the transfer to the front proxy, which
+also takes care of Range. nginx needs an internal location matching
+FILE_DELIVERY_INTERNAL_PREFIX, for example:
+
+    location /protected-media/ {
+        internal;
+        alias /app/media/;
+    }
+
+Responses are StreamedResponse / StreamedFileResponse rather than Django's own:
+under ASGI, Django reads a synchronous iterator into a list before sending any of
+it, which would hold a whole download in the worker's memory. These pull one
+chunk at a time instead.
+"""
+import mimetypes
+import os
+import re
+import secrets
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+
+
+DIRECT = "direct"
+X_ACCEL_REDIRECT = "x-accel-redirect"
+X_SENDFILE = "x-sendfile"
+MODES = (DIRECT, X_ACCEL_REDIRECT, X_SENDFILE)
+
+BLOCK_SIZE = 64 * 1024
+MAX_RANGES = 16
+
+_RANGE_RE = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+_END = object()
+
+
+def _next_chunk(iterator):
+    return next(iterator, _END)
+
+
+class _ChunkedAsyncIteration:
+    """ Serve a synchronous iterator to ASGI one chunk at a time instead of as one list. """
+
+    async def __aiter__(self):
+        if self.is_async:
+            async for part in self.streaming_content:
+                yield part
+            return
+        iterator = iter(self.streaming_content)
+        # Reading files doesn't touch the database, so it needn't wait for the request thread
+        pull = sync_to_async(_next_chunk, thread_sensitive=False)
+        while (part := await pull(iterator)) is not _END:
+            yield part
+
+
+class StreamedResponse(_ChunkedAsyncIteration, StreamingHttpResponse):
+    pass
+
+
+class StreamedFileResponse(_ChunkedAsyncIteration, FileResponse):
+    block_size = BLOCK_SIZE
+
+
+def delivery_mode():
+    """ FILE_DELIVERY_MODE; a typo must not quietly hand files to a proxy that won't send them. """
+    mode = getattr(settings, "FILE_DELIVERY_MODE", DIRECT)
+    if mode not in MODES:
+        raise ImproperlyConfigured(f"FILE_DELIVERY_MODE must be one of {', '.join(MODES)}, not {mode!r}.")
+    return mode
+
+
+def file_etag(uploaded_file, stat):
+    """ Strong validator: the content hash for blob-backed files, size and mtime for older ones. """
+    if uploaded_file.blob_id:
+        return quote_etag(uploaded_file.blob.sha256)
+    return quote_etag(f"{uploaded_file.pk}-{stat.st_size}-{stat.st_mtime_ns}")
+
+
+def file_last_modified(uploaded_file, stat):
+    """ When the bytes were stored: the blob's creation, or the file's mtime for older files. Renames and other edits don't count. """
+    if uploaded_file.blob_id:
+        return uploaded_file.blob.created_at.timestamp()
+    return stat.st_mtime
+
+
+def parse_ranges(header, size):
+    """
+    Parse a `Range: bytes=...` header into sorted, merged (start, end) pairs, end inclusive.
+
+    Returns None when the header should be ignored (missing, malformed, or too many
+    ranges) and [] when no range overlaps the file, which is a 416.
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    specs = header[len("bytes="):].split(",")
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        match = _RANGE_RE.match(spec)
+        if not match or match.groups() == ("", ""):
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+        else:
+            # Suffix range: the final N bytes
+            start, end = max(size - int(last), 0), size - 1
+        if start <= end and start < size:
+            ranges.append((start, end))
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _read_range(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(BLOCK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def _multipart_ranges(path, ranges, size, content_type, boundary):
+    for start, end in ranges:
+        yield (
+            f"--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode()
+        yield from _read_range(path, start, end)
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+
+def _multipart_length(ranges, size, content_type, boundary):
+    length = len(f"--{boundary}--\r\n")
+    for start, end in ranges:
+        length += len(
+            f"--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        )
+        length += end - start + 1 + 2
+    return length
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    # A date only validates a strong Last-Modified, so it must match exactly
+    return parse_http_date_safe(if_range) == int(last_modified)
+
+
+def _offload_response(uploaded_file, mode, content_type):
+    """ Empty response telling the proxy which file to send in Django's place. """
+    response = HttpResponse(content_type=content_type)
+    if mode == X_ACCEL_REDIRECT:
+        prefix = getattr(settings, "FILE_DELIVERY_INTERNAL_PREFIX", "/protected-media/")
+        response["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + quote(uploaded_file.file.name)
+    else:
+        response["X-Sendfile"] = uploaded_file.file.path
+    return response
+
+
+def serve_file(request, uploaded_file, as_attachment=False):
+    """ Respond with the file's bytes, honouring validators and Range. Raises FileNotFoundError. """
+    mode = delivery_mode()
+    path = uploaded_file.file.path
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = file_etag(uploaded_file, stat)
+    last_modified = file_last_modified(uploaded_file, stat)
+    content_type = mimetypes.guess_type(uploaded_file.name)[0] or "application/octet-stream"
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if response is None and mode != DIRECT:
+        response = _offload_response(uploaded_file, mode, content_type)
+    elif response is None:
+        ranges = None
+        if request.method == "GET" and _if_range_matches(request, etag, last_modified):
+            ranges = parse_ranges(request.headers.get("Range"), size)
+
+        if ranges == []:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+        elif ranges and len(ranges) == 1:
+            start, end = ranges[0]
+            response = StreamedResponse(_read_range(path, start, end), status=206, content_type=content_type)
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+            response["Content-Length"] = str(end - start + 1)
+        elif ranges:
+            boundary = secrets.token_hex(16)
+            response = StreamedResponse(
+                _multipart_ranges(path, ranges, size, content_type, boundary),
+                status=206,
+                content_type=f"multipart/byteranges; boundary={boundary}",
+            )
+            response["Content-Length"] = str(_multipart_length(ranges, size, content_type, boundary))
+        else:
+            response = StreamedFileResponse(open(path, "rb"), as_attachment=as_attachment, filename=uploaded_file.name)
+
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    if response.status_code in (200, 206):
+        response["Content-Disposition"] = content_disposition_header(as_attachment, uploaded_file.name)
+    return response
@@ -0,0 +1,40 @@
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+
+from . import events
+from .models import AccessGrant
+
+# Milliseconds the browser waits before reconnecting a dropped stream
+RETRY_MS = 5000
+
+
+async def _stream(user_id):
+    # Subscribe here rather than in the view: the view may run on a worker thread's loop,
+    # the response is always iterated on the server's
+    subscription = events.broker.subscribe([user_id, AccessGrant.EVERYONE])
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        while True:
+            message = await subscription.get(events.HEARTBEAT)
+            yield message if message is not None else ": keepalive\n\n"
+    finally:
+        subscription.close()
+
+
+async def event_stream(request):
+    """
+    Server-sent events for the signed-in user: `share`, `reminder`, `file` and `resync`.
+    Only served by the ASGI app; under WSGI a long-lived response would tie up a worker, so
+    the browser is told (204) to stop reconnecting and fall back to polling.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+
+    response = StreamingHttpResponse(_stream(user.id), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Don't let nginx buffer the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
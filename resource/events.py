@@ -0,0 +1,232 @@
+"""
+Server-push events.
+
+Browsers keep one EventSource open on /events/ (served by the ASGI app) instead of
+polling the unseen-share count and the reminder list. The stream authenticates once
+when it connects and then waits on an in-memory queue, so an idle tab costs a
+keepalive comment every EVENTS_HEARTBEAT seconds and no queries.
+
+Every web worker holds a Broker mapping user ids to the queues of their open streams.
+publish() hands an event to the broker once the current transaction commits. With
+EVENTS_BROKER = "postgres" events go through NOTIFY instead and every worker LISTENs
+on one connection, so events raised in other processes (`manage.py run_reminders`)
+reach the browsers too; with "local" they only reach streams in the same process.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, connections, transaction
+
+from .models import AccessGrant
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'resource_events'
+HEARTBEAT = getattr(settings, 'EVENTS_HEARTBEAT', 25)
+# Events a slow stream may fall behind by before it is told to reload everything
+MAX_QUEUED = 100
+# NOTIFY payloads are capped at 8000 bytes
+MAX_PAYLOAD = 7500
+
+SHARE = 'share'
+REMINDER = 'reminder'
+FILE = 'file'
+RESYNC = 'resync'
+
+
+def frame(event, data):
+    """ One text/event-stream message. """
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+class Subscription:
+    def __init__(self, broker, user_ids):
+        self.broker = broker
+        self.user_ids = user_ids
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(MAX_QUEUED)
+
+    def put(self, message):
+        """ Called on the subscription's event loop. """
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Whatever was missed, the client has to refetch; one resync replaces the backlog
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(frame(RESYNC, {}))
+
+    async def get(self, timeout):
+        """ The next message, or None if nothing arrived within `timeout` seconds. """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """ The open streams of this process, by user id. Safe to publish to from any thread. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, user_ids):
+        """ A Subscription to events for `user_ids`; must be called on the stream's event loop. """
+        subscription = Subscription(self, tuple(user_ids))
+        with self._lock:
+            for user_id in subscription.user_ids:
+                self._subscriptions[user_id].add(subscription)
+        start_listener()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for user_id in subscription.user_ids:
+                subscribers = self._subscriptions.get(user_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscriptions[user_id]
+
+    def deliver(self, user_ids, message):
+        with self._lock:
+            targets = set().union(*(self._subscriptions.get(user_id, ()) for user_id in user_ids))
+        for subscription in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, message)
+            except RuntimeError:
+                # The stream's loop closed while we were delivering
+                pass
+
+    def deliver_payload(self, payload):
+        for user_ids, event, data in json.loads(payload):
+            self.deliver(user_ids, frame(event, data))
+
+
+broker = Broker()
+
+
+def backend():
+    return getattr(settings, 'EVENTS_BROKER', None) or ('postgres' if connection.vendor == 'postgresql' else 'local')
+
+
+def _payloads(messages):
+    """ `messages` JSON-encoded into as few NOTIFY-sized payloads as possible. """
+    chunk, size = [], 2
+    for message in messages:
+        encoded = json.dumps(message, cls=DjangoJSONEncoder)
+        if chunk and size + len(encoded) + 1 > MAX_PAYLOAD:
+            yield '[' + ','.join(chunk) + ']'
+            chunk, size = [], 2
+        chunk.append(encoded)
+        size += len(encoded) + 1
+    if chunk:
+        yield '[' + ','.join(chunk) + ']'
+
+
+def publish_many(messages):
+    """
+    Push (user_ids, event, data) messages once the current transaction commits.
+    Keep `data` to ids and short labels; clients fetch anything bigger.
+    """
+    messages = [(sorted(set(user_ids)), event, data) for user_ids, event, data in messages if user_ids]
+    if not messages:
+        return
+    if backend() == 'postgres':
+        # NOTIFY is itself transactional: listeners only hear it if we commit
+        with connection.cursor() as cursor:
+            for payload in _payloads(messages):
+                cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, payload])
+    else:
+        transaction.on_commit(lambda: [broker.deliver_payload(payload) for payload in _payloads(messages)])
+
+
+def publish(user_ids, event, data):
+    publish_many([(user_ids, event, data)])
+
+
+def shares_created(shares):
+    """ Tell each recipient of the new FileSharing rows `shares` to refresh their shared count. """
+    by_recipient = defaultdict(int)
+    for share in shares:
+        by_recipient[share.shared_to_id] += 1
+    publish_many([([user_id], SHARE, {'new': count}) for user_id, count in by_recipient.items()])
+
+
+def file_grantees(file_ids):
+    """ {file id: grantee ids} from the access index; EVERYONE stands for every open stream. """
+    grantees = defaultdict(set)
+    for file_id, grantee in AccessGrant.objects.filter(file_id__in=file_ids).values_list('file_id', 'grantee'):
+        grantees[file_id].add(grantee)
+    return grantees
+
+
+def files_changed(files, action, grantees=None):
+    """
+    Tell everyone who can see them that `files` (file id, folder id) pairs were created,
+    updated or deleted. Deleted files have lost their grants by the time this commits, so
+    callers pass the `grantees` they looked up beforehand.
+    """
+    if grantees is None:
+        grantees = file_grantees([file_id for file_id, _ in files])
+    publish_many([
+        (grantees.get(file_id, ()), FILE, {'id': file_id, 'folder': folder_id, 'action': action})
+        for file_id, folder_id in files
+    ])
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def start_listener():
+    """ Start this process's LISTEN thread when the postgres backend is in use. """
+    global _listener
+    if _listener is not None or backend() != 'postgres':
+        return
+    with _listener_lock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, name='resource-events', daemon=True)
+            _listener.start()
+
+
+def _listen():
+    delay = 1
+    reconnecting = False
+    while True:
+        db = connections.create_connection('default')
+        try:
+            db.ensure_connection()
+            raw = db.connection
+            raw.autocommit = True
+            with raw.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            delay = 1
+            if reconnecting:
+                # Anything published while we were disconnected is lost; connected clients reload
+                broker.deliver([AccessGrant.EVERYONE], frame(RESYNC, {}))
+            while True:
+                if select.select([raw], [], [], HEARTBEAT) == ([], [], []):
+                    continue
+                raw.poll()
+                while raw.notifies:
+                    broker.deliver_payload(raw.notifies.pop(0).payload)
+        except Exception:
+            logger.exception("Event listener lost its connection; reconnecting in %ss", delay)
+        finally:
+            db.close()
+        reconnecting = True
+        time.sleep(delay)
+        delay = min(delay * 2, 60)
@@ -0,0 +1,117 @@
+"""
+Background text extraction for search and previews.
+
+Saving a file or version whose type has an extractor queues its blob as a PENDING
+ExtractedText row; nothing is read during the upload request. `manage.py extract_text`
+drains the queue in a pool of worker processes, each with a per-file timeout and an
+address-space cap, and stores the text and metadata. The text then becomes the
+search body of every file whose current content is that blob.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import search
+from .extractors import EXTRACTORS, limit_memory, run_extraction
+from .models import ExtractedText, UploadedFile
+
+
+DEFAULT_WORKERS = getattr(settings, 'EXTRACTION_WORKERS', 2)
+DEFAULT_TIMEOUT = getattr(settings, 'EXTRACTION_TIMEOUT', 60)
+DEFAULT_MEMORY_MB = getattr(settings, 'EXTRACTION_MEMORY_MB', 1024)
+MAX_ATTEMPTS = 3
+BATCH_SIZE = 200
+
+
+def queue_blob(blob_id, file_type):
+    """ Queue `blob_id` for extraction unless it is queued or done already. """
+    if not blob_id or file_type not in EXTRACTORS:
+        return
+    ExtractedText.objects.bulk_create(
+        [ExtractedText(blob_id=blob_id, file_type=file_type)],
+        ignore_conflicts=True,
+    )
+
+
+def queue_blobs(blobs):
+    """ queue_blob for many (blob id, file type) pairs in one INSERT. """
+    rows = {blob_id: file_type for blob_id, file_type in blobs if blob_id and file_type in EXTRACTORS}
+    ExtractedText.objects.bulk_create(
+        [ExtractedText(blob_id=blob_id, file_type=file_type) for blob_id, file_type in rows.items()],
+        ignore_conflicts=True,
+    )
+
+
+def queued(retry_failed=False, everything=False):
+    rows = ExtractedText.objects.select_related('blob').order_by('created_at')
+    if everything:
+        return rows
+    if retry_failed:
+        return rows.filter(status__in=[ExtractedText.PENDING, ExtractedText.FAILED], attempts__lt=MAX_ATTEMPTS)
+    return rows.filter(status=ExtractedText.PENDING)
+
+
+def save_result(row, outcome, result):
+    row.attempts += 1
+    row.extracted_at = timezone.now()
+    if outcome == 'done':
+        row.status = ExtractedText.DONE
+        row.text = result['text']
+        row.title = result['title']
+        row.author = result['author']
+        row.page_count = result['page_count']
+        row.error = ''
+    else:
+        row.status = ExtractedText.FAILED
+        row.error = result
+    row.save()
+
+    if row.status == ExtractedText.DONE:
+        for file_id in UploadedFile.objects.filter(blob_id=row.blob_id).values_list('pk', flat=True):
+            search.index_file(file_id)
+
+
+def _path(row):
+    try:
+        return row.blob.file.path
+    except (NotImplementedError, ValueError):
+        return None
+
+
+def _run_batch(rows, workers, timeout, memory_mb):
+    """ Yield (row, outcome, result) for each row as its extraction finishes. """
+    if workers < 1:
+        # Inline, for debugging and tests
+        for row in rows:
+            yield (row, *run_extraction(_path(row), row.file_type, timeout))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=limit_memory, initargs=(memory_mb,)) as pool:
+        futures = {pool.submit(run_extraction, _path(row), row.file_type, timeout): row for row in rows}
+        for future in as_completed(futures):
+            try:
+                outcome, result = future.result()
+            except BrokenProcessPool:
+                # A worker was killed (OOM killer, parser crash); --retry-failed picks these up again
+                outcome, result = 'failed', "The extraction worker died"
+            yield futures[future], outcome, result
+
+
+def extract_queued(rows, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, memory_mb=DEFAULT_MEMORY_MB, progress=None):
+    """
+    Extract every row of `rows`, BATCH_SIZE at a time so the queue is never held in memory.
+    `progress(done, total, row)` is called after each row. Returns the number processed.
+    """
+    ids = list(rows.values_list('pk', flat=True))
+    total = len(ids)
+    done = 0
+    for start in range(0, total, BATCH_SIZE):
+        batch = list(ExtractedText.objects.select_related('blob').filter(pk__in=ids[start:start + BATCH_SIZE]))
+        for row, outcome, result in _run_batch(batch, workers, timeout, memory_mb):
+            save_result(row, outcome, result)
+            done += 1
+            if progress:
+                progress(done, total, row)
+    return done
@@ -0,0 +1,221 @@
+"""
+Text and metadata extractors, one per supported file type.
+
+This module runs inside the extraction worker processes, so it must not import
+Django models. DOCX, XLSX and PPTX are read straight from their Office Open XML
+parts; PDF goes through PyPDF2.
+"""
+import csv
+import importlib.machinery
+import importlib.util
+import io
+import re
+import signal
+import sysconfig
+import zipfile
+
+try:
+    from defusedxml.ElementTree import fromstring as parse_xml
+except ImportError:
+    from xml.etree.ElementTree import fromstring as parse_xml
+
+
+# Text kept per document; the rest of a huge document adds little to search
+MAX_TEXT_LENGTH = 1_000_000
+# Largest single XML part read out of an Office document
+MAX_PART_SIZE = 64 * 1024 * 1024
+
+_NS = {
+    "w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main",
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+    "s": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+    "cp": "http://schemas.openxmlformats.org/package/2006/metadata/core-properties",
+    "dc": "http://purl.org/dc/elements/1.1/",
+    "ep": "http://schemas.openxmlformats.org/officeDocument/2006/extended-properties",
+}
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+def _result(text="", title="", author="", page_count=None):
+    return {
+        # PostgreSQL text columns reject NUL bytes
+        "text": text[:MAX_TEXT_LENGTH].replace("\x00", ""),
+        "title": (title or "")[:255],
+        "author": (author or "")[:255],
+        "page_count": page_count,
+    }
+
+
+def _decode(data):
+    for encoding in ("utf-8-sig", "cp1252"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("latin-1")
+
+
+def _read_part(archive, name):
+    try:
+        info = archive.getinfo(name)
+    except KeyError:
+        return None
+    if info.file_size > MAX_PART_SIZE:
+        raise ValueError(f"{name} is too large to extract")
+    return parse_xml(archive.read(info))
+
+
+def _core_properties(archive):
+    """ Title and author from docProps/core.xml, and the page or slide count from docProps/app.xml. """
+    title = author = ""
+    core = _read_part(archive, "docProps/core.xml")
+    if core is not None:
+        title = core.findtext("dc:title", "", _NS)
+        author = core.findtext("dc:creator", "", _NS)
+
+    pages = None
+    app = _read_part(archive, "docProps/app.xml")
+    if app is not None:
+        count = app.findtext("ep:Pages", None, _NS) or app.findtext("ep:Slides", None, _NS)
+        pages = int(count) if count and count.isdigit() else None
+    return title, author, pages
+
+
+def _part_names(archive, pattern):
+    def number(name):
+        match = re.search(r"(\d+)\.xml$", name)
+        return int(match.group(1)) if match else 0
+    return sorted((n for n in archive.namelist() if re.fullmatch(pattern, n)), key=number)
+
+
+def extract_pdf(path):
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(path)
+    pages, length = [], 0
+    for page in reader.pages:
+        text = page.extract_text() or ""
+        pages.append(text)
+        length += len(text)
+        if length >= MAX_TEXT_LENGTH:
+            break
+    info = reader.metadata or {}
+    return _result("\n".join(pages), info.get("/Title"), info.get("/Author"), len(reader.pages))
+
+
+def extract_docx(path):
+    with zipfile.ZipFile(path) as archive:
+        title, author, pages = _core_properties(archive)
+        document = _read_part(archive, "word/document.xml")
+        paragraphs = []
+        if document is not None:
+            for paragraph in document.iter(f"{{{_NS['w']}}}p"):
+                paragraphs.append("".join(t.text or "" for t in paragraph.iter(f"{{{_NS['w']}}}t")))
+    return _result("\n".join(p for p in paragraphs if p), title, author, pages)
+
+
+def extract_pptx(path):
+    with zipfile.ZipFile(path) as archive:
+        title, author, slides = _core_properties(archive)
+        lines = []
+        for name in _part_names(archive, r"ppt/slides/slide\d+\.xml"):
+            slide = _read_part(archive, name)
+            for paragraph in slide.iter(f"{{{_NS['a']}}}p"):
+                line = "".join(t.text or "" for t in paragraph.iter(f"{{{_NS['a']}}}t"))
+                if line:
+                    lines.append(line)
+    return _result("\n".join(lines), title, author, slides)
+
+
+def extract_xlsx(path):
+    with zipfile.ZipFile(path) as archive:
+        title, author, _ = _core_properties(archive)
+        shared = []
+        strings = _read_part(archive, "xl/sharedStrings.xml")
+        if strings is not None:
+            for item in strings.iterfind("s:si", _NS):
+                shared.append("".join(t.text or "" for t in item.iter(f"{{{_NS['s']}}}t")))
+
+        sheets = _part_names(archive, r"xl/worksheets/sheet\d+\.xml")
+        rows = []
+        for name in sheets:
+            sheet = _read_part(archive, name)
+            for row in sheet.iter(f"{{{_NS['s']}}}row"):
+                cells = []
+                for cell in row.iterfind("s:c", _NS):
+                    value = cell.findtext("s:v", None, _NS)
+                    if cell.get("t") == "s" and value is not None:
+                        value = shared[int(value)] if int(value) < len(shared) else ""
+                    elif cell.get("t") == "inlineStr":
+                        value = "".join(t.text or "" for t in cell.iter(f"{{{_NS['s']}}}t"))
+                    if value:
+                        cells.append(value)
+                if cells:
+                    rows.append("\t".join(cells))
+    return _result("\n".join(rows), title, author, len(sheets))
+
+
+def extract_txt(path):
+    with open(path, "rb") as f:
+        return _result(_decode(f.read(MAX_TEXT_LENGTH * 4)))
+
+
+def extract_csv(path):
+    with open(path, "rb") as f:
+        data = _decode(f.read(MAX_TEXT_LENGTH * 4))
+    rows = csv.reader(io.StringIO(data, newline=""))
+    return _result("\n".join(" ".join(cell for cell in row if cell) for row in rows))
+
+
+EXTRACTORS = {
+    "pdf": extract_pdf,
+    "docx": extract_docx,
+    "xlsx": extract_xlsx,
+    "pptx": extract_pptx,
+    "txt": extract_txt,
+    "csv": extract_csv,
+}
+
+
+def limit_memory(memory_mb):
+    """ Worker initializer: cap the address space so one bad document can't exhaust the host. """
+    if not memory_mb:
+        return
+    # The Django app is called `resource` too, so the POSIX module is looked up by path
+    spec = importlib.machinery.PathFinder.find_spec("resource", [sysconfig.get_path("platstdlib") + "/lib-dynload"])
+    if spec is None:
+        return
+    posix_resource = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(posix_resource)
+    limit = memory_mb * 1024 * 1024
+    posix_resource.setrlimit(posix_resource.RLIMIT_AS, (limit, limit))
+
+
+def _alarm(signum, frame):
+    raise ExtractionTimeout()
+
+
+def run_extraction(path, file_type, timeout):
+    """
+    Extract one file in a worker. Returns ("done", result) or ("failed", message);
+    never raises, so one broken document doesn't take the pool down.
+    """
+    extractor = EXTRACTORS[file_type]
+    previous = signal.signal(signal.SIGALRM, _alarm) if timeout else None
+    if timeout:
+        signal.alarm(timeout)
+    try:
+        return "done", extractor(path)
+    except ExtractionTimeout:
+        return "failed", f"Timed out after {timeout}s"
+    except MemoryError:
+        return "failed", "Exceeded the worker memory limit"
+    except Exception as e:
+        return "failed", f"{type(e).__name__}: {e}"
+    finally:
+        if timeout:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, previous)
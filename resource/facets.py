@@ -0,0 +1,87 @@
+"""
+Facet counts (tags, categories, file types, owners) for a folder or a search.
+
+All four groupings come from one UNION ALL aggregate over the files the user can see
+in the scope. Results are cached per user and scope under a data version stamp that
+is replaced whenever the data behind them changes: files are added, deleted, moved,
+re-shared, re-tagged, re-categorized or (un)archived, folders are moved or re-shared,
+tags and categories change. Saves that touch none of that, such as starring a file,
+leave the stamp alone (see UploadedFile._facets_changed).
+"""
+import hashlib
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import CharField, Count, F, Value
+from django.db.models.functions import Cast
+
+from .models import UploadedFile
+from .search import search_filter
+
+
+VERSION_KEY = 'resource:facets-version'
+CACHE_TIMEOUT = 10 * 60
+
+FACETS = {
+    # facet: (key, label)
+    'tags': ('meta_tags__id', 'meta_tags__name'),
+    'categories': ('category_id', 'category__name'),
+    'file_types': ('file_type', 'file_type'),
+    'owners': ('owner_id', 'owner__email'),
+}
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def changed():
+    """ Drop every cached facet count; called by the signals of everything they depend on. """
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+    # Requests that counted before we commit cached old numbers under the new stamp
+    transaction.on_commit(lambda: cache.set(VERSION_KEY, uuid.uuid4().hex, None))
+
+
+def scope_files(user, folder=None, recursive=False, query=None):
+    files = UploadedFile.objects.visible_to(user).filter(is_archived=False)
+    if query:
+        return files.filter(search_filter(query))
+    if folder is None:
+        return files.filter(folder__isnull=True)
+    if recursive:
+        return files.filter(folder__path__startswith=folder.path)
+    return files.filter(folder=folder)
+
+
+def count(files):
+    """ {facet: [{"id", "name", "count"}, ...]} for the UploadedFile queryset `files`, in one query. """
+    groups = [
+        files.order_by()
+        .values(facet=Value(facet), key=Cast(key, CharField()), label=Cast(label, CharField()))
+        .annotate(count=Count('id', distinct=True))
+        .values_list('facet', 'key', 'label', 'count')
+        for facet, (key, label) in FACETS.items()
+    ]
+    result = {facet: [] for facet in FACETS}
+    for facet, key, label, total in groups[0].union(*groups[1:], all=True):
+        if key is None or key == '':
+            continue
+        result[facet].append({"id": key, "name": label, "count": total})
+    for entries in result.values():
+        entries.sort(key=lambda entry: (-entry["count"], entry["name"] or ""))
+    return result
+
+
+def facets_for(user, folder=None, recursive=False, query=None):
+    scope = f"q:{hashlib.sha1(query.encode()).hexdigest()}" if query else f"f:{folder.pk if folder else ''}:{int(recursive)}"
+    key = f"resource:facets:{_version()}:{user.pk}:{scope}"
+    result = cache.get(key)
+    if result is None:
+        result = count(scope_files(user, folder, recursive, query))
+        cache.set(key, result, CACHE_TIMEOUT)
+    return result
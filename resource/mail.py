@@ -0,0 +1,164 @@
+"""
+Outbound email queue.
+
+Views call queue_email(), which only inserts an OutboundEmail row, and answer at once
+with its id. `manage.py send_queued_mail` claims due rows, sends them over one
+connection from the configured EMAIL_BACKEND (reopened every MAIL_MESSAGES_PER_CONNECTION
+messages or after the server drops it), throttles to MAIL_SEND_RATE messages per second
+and reschedules failures with exponential backoff until MAIL_MAX_ATTEMPTS.
+
+A claimed batch is leased for as long as it takes to send at that rate, plus LEASE.
+Each message's lease is checked and renewed right before it is sent, so a message
+another worker has taken over after an expired lease is left to that worker.
+"""
+import logging
+import smtplib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+
+logger = logging.getLogger(__name__)
+
+SEND_RATE = getattr(settings, 'MAIL_SEND_RATE', 5)
+MESSAGES_PER_CONNECTION = getattr(settings, 'MAIL_MESSAGES_PER_CONNECTION', 100)
+MAX_ATTEMPTS = getattr(settings, 'MAIL_MAX_ATTEMPTS', 6)
+BASE_BACKOFF = 60
+MAX_BACKOFF = 6 * 60 * 60
+# A claimed message whose worker died is picked up again this long after its batch should have been sent
+LEASE = timedelta(minutes=10)
+
+
+def queue_email(subject, body, to, from_email=None, reply_to=(), html_body='', created_by=None):
+    email = build_email(subject, body, to, from_email, reply_to, html_body, created_by)
+    email.save()
+    return email
+
+
+def build_email(subject, body, to, from_email=None, reply_to=(), html_body='', created_by=None):
+    """ An unsaved OutboundEmail, for queueing many at once with bulk_create. """
+    return OutboundEmail(
+        subject=subject,
+        body=body,
+        html_body=html_body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(to),
+        reply_to=list(reply_to),
+        created_by=created_by,
+    )
+
+
+def lease_for(count, rate):
+    """ How long a worker may hold `count` claimed messages it sends at `rate` per second. """
+    return LEASE + timedelta(seconds=count / rate if rate else 0)
+
+
+def claim(limit, rate=SEND_RATE):
+    """
+    Lease up to `limit` due messages to this worker; concurrent workers skip each other's rows.
+    Returns (rows, the lease's expiry).
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status__in=[OutboundEmail.QUEUED, OutboundEmail.SENDING], next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:limit]
+        )
+        leased_until = now + lease_for(len(rows), rate)
+        OutboundEmail.objects.filter(pk__in=[row.pk for row in rows]).update(
+            status=OutboundEmail.SENDING, next_attempt_at=leased_until,
+        )
+    return rows, leased_until
+
+
+def renew(row, leased_until):
+    """ Extend this worker's lease on `row` before sending it; False if another worker has taken it over. """
+    return OutboundEmail.objects.filter(
+        pk=row.pk, status=OutboundEmail.SENDING, next_attempt_at=leased_until,
+    ).update(next_attempt_at=timezone.now() + LEASE) == 1
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(BASE_BACKOFF * 2 ** (attempts - 1), MAX_BACKOFF))
+
+
+def _message(row, connection):
+    message = EmailMultiAlternatives(
+        subject=row.subject,
+        body=row.body,
+        from_email=row.from_email,
+        to=row.to,
+        reply_to=row.reply_to,
+        connection=connection,
+    )
+    if row.html_body:
+        message.attach_alternative(row.html_body, "text/html")
+    return message
+
+
+def _record_failure(row, error):
+    row.attempts += 1
+    row.last_error = f"{type(error).__name__}: {error}"
+    if row.attempts >= MAX_ATTEMPTS:
+        row.status = OutboundEmail.FAILED
+    else:
+        row.status = OutboundEmail.QUEUED
+        row.next_attempt_at = timezone.now() + backoff(row.attempts)
+    row.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+    logger.warning("Email %s failed (attempt %s): %s", row.pk, row.attempts, row.last_error)
+
+
+def send_queued(limit=500, rate=SEND_RATE):
+    """ Send up to `limit` due messages. Returns (sent, failed). """
+    rows, leased_until = claim(limit, rate)
+    if not rows:
+        return 0, 0
+
+    sent = failed = 0
+    interval = 1 / rate if rate else 0
+    connection = get_connection()
+    on_connection = 0
+    try:
+        for row in rows:
+            started = time.monotonic()
+            if not renew(row, leased_until):
+                logger.warning("Email %s was taken over by another worker; leaving it", row.pk)
+                continue
+            if on_connection >= MESSAGES_PER_CONNECTION:
+                connection.close()
+                on_connection = 0
+            try:
+                # A no-op while the connection is still open
+                connection.open()
+                _message(row, connection).send()
+                on_connection += 1
+            except smtplib.SMTPServerDisconnected as e:
+                connection.close()
+                on_connection = 0
+                _record_failure(row, e)
+                failed += 1
+            except Exception as e:
+                _record_failure(row, e)
+                failed += 1
+            else:
+                row.status = OutboundEmail.SENT
+                row.attempts += 1
+                row.sent_at = timezone.now()
+                row.last_error = ''
+                row.save(update_fields=['status', 'attempts', 'sent_at', 'last_error'])
+                sent += 1
+
+            # Stay under the provider's sending rate
+            remaining = interval - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+    finally:
+        connection.close()
+    return sent, failed
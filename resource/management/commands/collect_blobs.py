@@ -0,0 +1,31 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from resource.blobs import sweep_files
+from resource.models import Blob
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete blobs nothing references and blob files without a row, "
+        "as left behind by uploads that failed after storing their bytes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--grace-hours", type=int, default=24,
+                            help="Leave anything younger alone; an upload may still be about to reference it.")
+        parser.add_argument("--loop", type=int, metavar="SECONDS",
+                            help="Keep running, sweeping every SECONDS.")
+
+    def handle(self, *args, **options):
+        while True:
+            before = timezone.now() - timedelta(hours=options["grace_hours"])
+            rows = Blob.objects.sweep(before)
+            files = sweep_files(before)
+            self.stdout.write(self.style.SUCCESS(f"Deleted {rows} unreferenced blob(s) and {files} stray file(s)."))
+            if not options["loop"]:
+                break
+            time.sleep(options["loop"])
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from resource.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Delete resumable uploads that have not received a chunk within UPLOAD_SESSION_TTL, with their staged bytes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", type=int, metavar="SECONDS",
+                            help="Keep running, expiring sessions every SECONDS.")
+
+    def handle(self, *args, **options):
+        while True:
+            expired = UploadSession.objects.expire()
+            self.stdout.write(self.style.SUCCESS(f"Expired {expired} upload session(s)."))
+            if not options["loop"]:
+                break
+            time.sleep(options["loop"])
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from resource import extraction
+
+
+class Command(BaseCommand):
+    help = (
+        "Extract text and metadata from queued uploads and versions for search and previews. "
+        "Files uploaded before the blob store need import_blobs first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=extraction.DEFAULT_WORKERS,
+                            help="Worker processes; 0 extracts inline.")
+        parser.add_argument("--timeout", type=int, default=extraction.DEFAULT_TIMEOUT,
+                            help="Seconds allowed per file.")
+        parser.add_argument("--memory-mb", type=int, default=extraction.DEFAULT_MEMORY_MB,
+                            help="Address space cap per worker, 0 for none.")
+        parser.add_argument("--retry-failed", action="store_true",
+                            help=f"Also retry failed files with fewer than {extraction.MAX_ATTEMPTS} attempts.")
+        parser.add_argument("--all", action="store_true", dest="everything",
+                            help="Re-extract everything, e.g. after an extractor changed.")
+        parser.add_argument("--loop", type=int, metavar="SECONDS",
+                            help="Keep running, checking the queue every SECONDS.")
+
+    def handle(self, *args, **options):
+        while True:
+            rows = extraction.queued(options["retry_failed"], options["everything"])
+            done = extraction.extract_queued(
+                rows,
+                workers=options["workers"],
+                timeout=options["timeout"],
+                memory_mb=options["memory_mb"],
+                progress=self.progress,
+            )
+            if done:
+                self.stdout.write(self.style.SUCCESS(f"Extracted {done} file(s)."))
+            if not options["loop"]:
+                break
+            # Only the first pass re-extracts everything
+            options["everything"] = False
+            time.sleep(options["loop"])
+
+    def progress(self, done, total, row):
+        if row.status == row.FAILED:
+            self.stderr.write(f"Blob {row.blob_id}: {row.error}")
+        if done % 50 == 0 or done == total:
+            self.stdout.write(f"{done}/{total}")
@@ -0,0 +1,40 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from resource.blobs import store_blob
+from resource.models import FileVersion, UploadedFile
+
+
+class Command(BaseCommand):
+    help = "Move files uploaded before the blob store into deduplicated, content-addressed blobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--delete-originals",
+            action="store_true",
+            help="Delete each original file once no row points at it any more.",
+        )
+
+    def handle(self, *args, **options):
+        for model in (UploadedFile, FileVersion):
+            rows = model.objects.filter(blob__isnull=True).exclude(file="")
+            total = rows.count()
+            for done, row in enumerate(rows.iterator(), start=1):
+                original = row.file.name
+                try:
+                    with row.file.open("rb") as content:
+                        row.use_blob(store_blob(content))
+                except FileNotFoundError:
+                    self.stderr.write(f"{model.__name__} {row.pk}: {original} is missing, skipped")
+                    continue
+                row.save()
+
+                if options["delete_originals"] and not any(
+                    m.objects.filter(file=original).exists() for m in (UploadedFile, FileVersion)
+                ):
+                    default_storage.delete(original)
+
+                if done % 100 == 0 or done == total:
+                    self.stdout.write(f"{model.__name__}: {done}/{total}")
+
+        self.stdout.write(self.style.SUCCESS("Blob import complete."))
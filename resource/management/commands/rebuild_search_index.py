@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from resource import search
+from resource.models import UploadedFile
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search entry of every file, e.g. after restoring a backup."
+
+    def handle(self, *args, **options):
+        file_ids = list(UploadedFile.objects.values_list("pk", flat=True))
+        total = len(file_ids)
+        for done, file_id in enumerate(file_ids, start=1):
+            search.index_file(file_id)
+            if done % 100 == 0 or done == total:
+                self.stdout.write(f"{done}/{total}")
+
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt."))
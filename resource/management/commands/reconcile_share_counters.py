@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from resource.models import ShareCounter
+
+
+class Command(BaseCommand):
+    help = "Recount every user's unseen file shares and fix counters that have drifted."
+
+    def handle(self, *args, **options):
+        fixed = ShareCounter.objects.reconcile()
+        self.stdout.write(self.style.SUCCESS(f"Fixed {fixed} share counter(s)."))
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from resource import reminders
+
+
+class Command(BaseCommand):
+    help = "Fire due reminders as in-app notifications and queued emails, and schedule recurring ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true",
+                            help="Fire what is due now and exit, e.g. from cron.")
+        parser.add_argument("--batch", type=int, default=reminders.DEFAULT_BATCH_SIZE,
+                            help="Reminders fired per transaction.")
+        parser.add_argument("--horizon", type=int, default=int(reminders.DEFAULT_HORIZON.total_seconds()),
+                            help="Seconds ahead to keep in memory.")
+        parser.add_argument("--refresh", type=int, default=reminders.DEFAULT_REFRESH,
+                            help="Seconds between reloads, the longest a new reminder waits to be seen.")
+
+    def handle(self, *args, **options):
+        dispatcher = reminders.Dispatcher(
+            batch_size=options["batch"],
+            horizon=timedelta(seconds=options["horizon"]),
+            refresh=options["refresh"],
+        )
+        if options["once"]:
+            self.stdout.write(f"Fired {dispatcher.run_once()} reminder(s).")
+            return
+        dispatcher.run_forever(log=lambda fired: self.stdout.write(f"Fired {fired} reminder(s)."))
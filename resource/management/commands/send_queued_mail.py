@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from resource import mail
+
+
+class Command(BaseCommand):
+    help = "Send queued email over one reused connection, retrying failures with backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=500,
+                            help="Messages claimed per pass.")
+        parser.add_argument("--rate", type=float, default=mail.SEND_RATE,
+                            help="Messages per second, 0 for no limit.")
+        parser.add_argument("--loop", type=int, metavar="SECONDS",
+                            help="Keep running, checking the queue every SECONDS.")
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = mail.send_queued(options["batch"], options["rate"])
+            if sent or failed:
+                self.stdout.write(f"Sent {sent}, failed {failed}.")
+            if not options["loop"]:
+                break
+            # A full batch means more is probably waiting
+            if sent + failed < options["batch"]:
+                time.sleep(options["loop"])
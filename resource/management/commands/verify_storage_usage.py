@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from resource.models import StorageUsage
+
+
+class Command(BaseCommand):
+    help = "Recount folder and user storage totals from the files and report (or with --fix, repair) any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="Overwrite the totals that are wrong.")
+
+    def handle(self, *args, **options):
+        if options["fix"]:
+            folders, users = StorageUsage.objects.reconcile()
+            self.stdout.write(self.style.SUCCESS(f"Fixed {folders} folder total(s) and {users} user total(s)."))
+            return
+
+        folders, users = StorageUsage.objects.drift()
+        for pk, (size, version_size, files) in sorted(folders.items()):
+            self.stdout.write(f"folder {pk}: should be {size} bytes, {version_size} version bytes, {files} files")
+        for pk, (size, version_size, files) in sorted(users.items()):
+            self.stdout.write(f"user {pk}: should be {size} bytes, {version_size} version bytes, {files} files")
+        if folders or users:
+            self.stdout.write(self.style.WARNING(f"{len(folders)} folder total(s) and {len(users)} user total(s) are wrong; run with --fix."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Storage totals match the files."))
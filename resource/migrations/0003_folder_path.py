@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-18 13:54
+
+from django.db import migrations, models
+
+
+def build_paths(apps, schema_editor):
+    Folder = apps.get_model('resource', 'Folder')
+    children = {}
+    for pk, parent_id in Folder.objects.values_list('pk', 'parent_id'):
+        children.setdefault(parent_id, []).append(pk)
+
+    pending = [(pk, '/', 0) for pk in children.get(None, [])]
+    while pending:
+        pk, parent_path, level = pending.pop()
+        path = f"{parent_path}{pk}/"
+        Folder.objects.filter(pk=pk).update(path=path, level=level)
+        pending.extend((child, path, level + 1) for child in children.get(pk, []))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resource', '0002_reminder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='level',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=1024),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.4 on 2026-10-18 13:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resource', '0003_folder_path'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='filesharing',
+            index=models.Index(fields=['shared_to', '-shared_at', '-id'], name='share_to_shared_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['parent', '-created_at', '-id'], name='folder_parent_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploadedfile',
+            index=models.Index(fields=['folder', '-uploaded_at', '-id'], name='file_folder_uploaded_idx'),
+        ),
+    ]
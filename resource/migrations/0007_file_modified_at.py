@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resource', '0006_upload_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='modified_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
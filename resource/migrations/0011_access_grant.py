@@ -0,0 +1,56 @@
+# Generated by Django 5.1.4 on 2026-10-18 14:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_grants(apps, schema_editor):
+    AccessGrant = apps.get_model('resource', 'AccessGrant')
+    Folder = apps.get_model('resource', 'Folder')
+    UploadedFile = apps.get_model('resource', 'UploadedFile')
+    FileSharing = apps.get_model('resource', 'FileSharing')
+
+    grants = []
+    for kind, model in (('file', UploadedFile), ('folder', Folder)):
+        for pk, owner_id, is_public in model.objects.values_list('pk', 'owner_id', 'is_public').iterator():
+            if owner_id:
+                grants.append(AccessGrant(grantee=owner_id, reason='owner', **{f'{kind}_id': pk}))
+            if is_public:
+                grants.append(AccessGrant(grantee=0, reason='public', **{f'{kind}_id': pk}))
+
+    for share in FileSharing.objects.filter(share_type='FILE', file__isnull=False).iterator():
+        grants.append(AccessGrant(grantee=share.shared_to_id, file_id=share.file_id, reason='shared'))
+
+    for share in FileSharing.objects.filter(share_type='FOLDER', folder__isnull=False).select_related('folder'):
+        path = share.folder.path
+        for pk in Folder.objects.filter(path__startswith=path).values_list('pk', flat=True):
+            grants.append(AccessGrant(grantee=share.shared_to_id, folder_id=pk, reason='inherited', via_folder_id=share.folder_id))
+        for pk in UploadedFile.objects.filter(folder__path__startswith=path).values_list('pk', flat=True):
+            grants.append(AccessGrant(grantee=share.shared_to_id, file_id=pk, reason='inherited', via_folder_id=share.folder_id))
+
+    AccessGrant.objects.bulk_create(grants, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resource', '0010_outbound_email'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccessGrant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grantee', models.BigIntegerField()),
+                ('reason', models.CharField(choices=[('owner', 'Owner'), ('public', 'Public'), ('shared', 'Shared'), ('inherited', 'Inherited')], max_length=10)),
+                ('file', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='access_grants', to='resource.uploadedfile')),
+                ('folder', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='access_grants', to='resource.folder')),
+                ('via_folder', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='resource.folder')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['file', 'grantee'], name='access_file_grantee_idx'), models.Index(fields=['folder', 'grantee'], name='access_folder_grantee_idx'), models.Index(fields=['grantee', 'via_folder'], name='access_grantee_via_idx')],
+            },
+        ),
+        migrations.RunPython(build_grants, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 5.1.4 on 2026-10-18 14:15
+
+import calendar
+from datetime import timedelta
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+# Copies of resource.reminders.add_months / next_occurrence as they were when this
+# migration was written, so later changes to that module can't change or break it
+def add_months(moment, months):
+    month_index = moment.month - 1 + months
+    year, month = moment.year + month_index // 12, month_index % 12 + 1
+    return moment.replace(year=year, month=month, day=min(moment.day, calendar.monthrange(year, month)[1]))
+
+
+def next_occurrence(anchor, repeat, after):
+    periods = {'daily': timedelta(days=1), 'weekly': timedelta(weeks=1)}
+    if repeat in periods:
+        period = periods[repeat]
+        steps = max((after - anchor) // period + 1, 1)
+        return anchor + steps * period
+    step = {'monthly': 1, 'yearly': 12}.get(repeat)
+    if step is None:
+        return None
+    months = max(((after.year - anchor.year) * 12 + after.month - anchor.month) // step * step, step)
+    candidate = add_months(anchor, months)
+    while candidate <= after:
+        months += step
+        candidate = add_months(anchor, months)
+    return candidate
+
+
+def schedule_reminders(apps, schema_editor):
+    """ Upcoming reminders fire at remind_at; past recurring ones at their next occurrence. """
+    Reminder = apps.get_model('resource', 'Reminder')
+    now = timezone.now()
+    Reminder.objects.filter(remind_at__gt=now).update(next_fire_at=models.F('remind_at'))
+    past = Reminder.objects.filter(remind_at__lte=now).exclude(repeat='none')
+    for reminder in past.iterator():
+        reminder.next_fire_at = next_occurrence(reminder.remind_at, reminder.repeat, now)
+        reminder.save(update_fields=['next_fire_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resource', '0011_access_grant'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('reminder', 'Reminder')], max_length=20)),
+                ('message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('read_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='reminder',
+            name='last_fired_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='reminder',
+            name='next_fire_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='reminder',
+            index=models.Index(fields=['user', 'next_fire_at'], name='reminder_user_next_fire_idx'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='file',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='resource.uploadedfile'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='reminder',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notifications', to='resource.reminder'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'read_at', '-created_at'], name='notification_user_unread_idx'),
+        ),
+        migrations.RunPython(schedule_reminders, migrations.RunPython.noop),
+    ]
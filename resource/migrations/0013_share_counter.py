@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-18 14:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_unseen(apps, schema_editor):
+    FileSharing = apps.get_model('resource', 'FileSharing')
+    ShareCounter = apps.get_model('resource', 'ShareCounter')
+    counts = (
+        FileSharing.objects.filter(is_seen=False, share_type='FILE')
+        .values_list('shared_to').annotate(count=Count('id')).order_by()
+    )
+    ShareCounter.objects.bulk_create(
+        [ShareCounter(user_id=user_id, unseen=count) for user_id, count in counts],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('resource', '0012_reminder_dispatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShareCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='share_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('unseen', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_unseen, migrations.RunPython.noop),
+    ]
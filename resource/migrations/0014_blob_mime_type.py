@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resource', '0013_share_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='mime_type',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.1.4 on 2026-10-18 14:38
+
+import django.db.models.deletion
+from django.conf import settings
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def count_usage(apps, schema_editor):
+    Folder = apps.get_model('resource', 'Folder')
+    FileVersion = apps.get_model('resource', 'FileVersion')
+    StorageUsage = apps.get_model('resource', 'StorageUsage')
+    UploadedFile = apps.get_model('resource', 'UploadedFile')
+
+    direct, users = defaultdict(lambda: [0, 0, 0]), defaultdict(lambda: [0, 0, 0])
+    files = UploadedFile.objects.values_list('folder_id', 'owner_id').annotate(total=Sum('file_size'), count=Count('id')).order_by()
+    for folder_id, owner_id, total, count in files:
+        for target in (direct[folder_id], users[owner_id]):
+            target[0] += total or 0
+            target[2] += count
+    versions = FileVersion.objects.values_list('uploaded_file__folder_id', 'uploaded_file__owner_id').annotate(total=Sum('file_size')).order_by()
+    for folder_id, owner_id, total in versions:
+        direct[folder_id][1] += total or 0
+        users[owner_id][1] += total or 0
+
+    paths = dict(Folder.objects.values_list('id', 'path'))
+    folders = defaultdict(lambda: [0, 0, 0])
+    for folder_id, totals in direct.items():
+        for ancestor_id in paths.get(folder_id, '').strip('/').split('/') if folder_id else []:
+            if ancestor_id and int(ancestor_id) in paths:
+                for i, value in enumerate(totals):
+                    folders[int(ancestor_id)][i] += value
+    Folder.objects.bulk_update(
+        [Folder(pk=pk, tree_bytes=t[0], tree_version_bytes=t[1], tree_files=t[2]) for pk, t in folders.items()],
+        ['tree_bytes', 'tree_version_bytes', 'tree_files'], batch_size=500,
+    )
+    users.pop(None, None)
+    StorageUsage.objects.bulk_create(
+        [StorageUsage(user_id=user_id, bytes=t[0], version_bytes=t[1], files=t[2]) for user_id, t in users.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('resource', '0014_blob_mime_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='storage_usage', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('bytes', models.BigIntegerField(default=0)),
+                ('version_bytes', models.BigIntegerField(default=0)),
+                ('files', models.BigIntegerField(default=0)),
+                ('quota', models.BigIntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='tree_bytes',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='tree_files',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='tree_version_bytes',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_usage, migrations.RunPython.noop),
+    ]
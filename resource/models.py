@@ -1,19 +1,42 @@
-from django.db import models
+import os
+import uuid
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models.signals import m2m_changed
+from django.db.models import Count, F, OuterRef, ProtectedError, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Concat, Length, Substr
 from django.contrib.auth.models import User
 from django.utils import timezone
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True, null=True, 
         blank=True,)
+
+    # The name as stored, to tell whether a save renamed it
+    _stored_name = None
     
     def __str__(self):
         return self.name if self.name else "Unnamed Category"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored_name = instance.__dict__.get('name')
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._stored_name = self.name
+
     @staticmethod
     def get_default_category():
         """ Ensure 'General' category exists and return it as default """
-        category, created = Category.objects.get_or_create(name="General")
-        return category.id 
+        from .refdata import default_category_id
+        return default_category_id()
 
 
 class Tag(models.Model):
@@ -23,25 +46,363 @@ class Tag(models.Model):
         return self.name
 
 
-class Folder(models.Model):
+def _child_count(model, fk):
+    """ Correlated COUNT of `model` rows pointing at the outer folder through `fk`. """
+    counts = (
+        model.objects.filter(**{fk: OuterRef('pk')})
+        .order_by()
+        .values(fk)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=models.IntegerField()), 0)
+
+
+# Set this attribute on a queryset before calling delete() when the caller has already done the
+# per-row bookkeeping of the delete signals (storage totals, blob references, search entries,
+# events) in bulk; the signal handlers then leave those rows alone.
+BULK_ACCOUNTED = 'bulk_accounted'
+
+
+def bulk_accounted(origin):
+    return getattr(origin, BULK_ACCOUNTED, False)
+
+
+def _usage_fields(instance):
+    """ What a file is charged to and how much, to tell whether a save has to move it. """
+    return instance.__dict__.get('owner_id'), instance.__dict__.get('folder_id'), instance.__dict__.get('file_size') or 0
+
+
+def _facet_fields(instance):
+    """
+    What a file's facet counts depend on besides its access fields, to tell whether a save
+    has to expire them: the grouped fields, archiving, and the name and content that search
+    scopes match on. Stars and other flags don't count.
+    """
+    return tuple(instance.__dict__.get(name) for name in ('category_id', 'file_type', 'is_archived', 'name', 'blob_id'))
+
+
+def _cached_path(instance):
+    """ {folder id: path} when the instance has its folder loaded, to save charge() the lookup. """
+    folder = instance._state.fields_cache.get('folder')
+    return {folder.pk: folder.path} if folder is not None and folder.path else {}
+
+
+def _access_fields(instance, location):
+    """ The fields the access index depends on, to tell whether a save has to update it. """
+    return {name: instance.__dict__.get(name) for name in ('owner_id', 'is_public', location)}
+
+
+class AccessIndexed:
+    """ Model mixin: keep AccessGrant rows in step with the owner, is_public and the `access_location` field. """
+    access_location = None
+    _stored_access = None
+    # Whether the save under way can change facet counts (see resource.facets); post_save reads it
+    _facets_changed = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored_access = _access_fields(instance, cls.access_location)
+        return instance
+
+    def _sync_access(self, created):
+        location = self.access_location
+        current = _access_fields(self, location)
+        stored = self._stored_access
+        if created:
+            AccessGrant.objects.add_item(self)
+        elif stored is not None:
+            if (stored['owner_id'], stored['is_public']) != (current['owner_id'], current['is_public']):
+                AccessGrant.objects.sync_item(self)
+            if stored[location] != current[location]:
+                AccessGrant.objects.sync_inherited(self)
+        self._stored_access = current
+
+
+class FolderQuerySet(models.QuerySet):
+    def with_child_counts(self):
+        """ Annotate direct subfolder and file counts without joining the children in. """
+        return self.annotate(
+            subfolder_count=_child_count(Folder, 'parent'),
+            file_count=_child_count(UploadedFile, 'folder'),
+        )
+
+    def visible_to(self, user):
+        """ Folders `user` owns, can see because they are public, or had shared with them directly or through a parent. """
+        return self.filter(AccessGrant.objects.covers('folder', user))
+
+    def subtree(self, folder, include_self=True):
+        """ Folders under `folder`, found through the indexed path prefix. """
+        queryset = self.filter(path__startswith=folder.path)
+        return queryset if include_self else queryset.exclude(pk=folder.pk)
+
+
+class Folder(AccessIndexed, models.Model):
     name = models.CharField(max_length=255)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='subfolders')
     created_at = models.DateTimeField(auto_now_add=True)
     is_starred = models.BooleanField(default=False, blank=True, null=True) 
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='folders', null=True, blank=True) 
     is_public = models.BooleanField(default=False)
+    # Materialized path of ancestor ids ("/1/5/9/") and nesting level, maintained in save()
+    path = models.CharField(max_length=1024, db_index=True, editable=False, default='')
+    level = models.PositiveIntegerField(default=0, editable=False)
+    # Storage used by the whole subtree, kept by StorageUsage.objects.charge(); see StorageUsageManager
+    tree_bytes = models.BigIntegerField(default=0, editable=False)
+    tree_version_bytes = models.BigIntegerField(default=0, editable=False)
+    tree_files = models.BigIntegerField(default=0, editable=False)
 
+    objects = FolderQuerySet.as_manager()
+    access_location = 'parent_id'
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of folder listings: (parent, created_at, id)
+            models.Index(fields=['parent', '-created_at', '-id'], name='folder_parent_created_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """ Keep `path`/`level` of this folder and its whole subtree, and the access index, in sync. """
+        with transaction.atomic():
+            created = self._state.adding
+            parent_path = ''
+            if self.parent_id:
+                parent_path = Folder.objects.filter(pk=self.parent_id).values_list('path', flat=True).get()
+                if self.path and parent_path.startswith(self.path):
+                    raise ValueError("A folder cannot be moved inside itself.")
+
+            if not created and kwargs.get('update_fields') is None:
+                # The tree_* totals only change through charge(); don't write back a stale copy
+                kwargs['update_fields'] = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key and field.name not in ('tree_bytes', 'tree_version_bytes', 'tree_files')
+                ]
+            # An empty new folder counts toward no facets; a moved or re-shared one does
+            self._facets_changed = not created and self._stored_access != _access_fields(self, self.access_location)
+            super().save(*args, **kwargs)
+
+            old_path, old_level = self.path, self.level
+            new_path = f"{parent_path or '/'}{self.pk}/"
+            new_level = new_path.count('/') - 2
+            if new_path != old_path:
+                Folder.objects.filter(pk=self.pk).update(path=new_path, level=new_level)
+                if old_path:
+                    # Moved: re-root every descendant in one UPDATE
+                    Folder.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                        path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                        level=F('level') + (new_level - old_level),
+                    )
+                    StorageUsage.objects.move_tree(self.pk, old_path, new_path)
+                self.path, self.level = new_path, new_level
+
+            self._sync_access(created)
+
+    def ancestor_ids(self):
+        return [int(pk) for pk in self.path.strip('/').split('/')[:-1]] if self.path else []
+
+    def get_ancestors(self):
+        """ Ancestors from the root down to the direct parent, in one primary-key lookup. """
+        return Folder.objects.filter(pk__in=self.ancestor_ids()).order_by(Length('path'))
+
+    def get_descendants(self, include_self=False):
+        return Folder.objects.subtree(self, include_self=include_self)
+
+    def is_inside(self, other):
+        """ True when this folder sits anywhere below `other`. """
+        return self.pk != other.pk and self.path.startswith(other.path)
+
+
+def _file_extension(*names):
+    """ Lower-cased extension of the first name that has one. """
+    for name in names:
+        extension = os.path.splitext(name or '')[1]
+        if extension:
+            return extension[1:].lower()
+    return ''
+
+
+class BlobManager(models.Manager):
+    def swap_reference(self, old_id, new_id):
+        """ Move one reference from blob `old_id` to blob `new_id` (either may be None). """
+        if new_id:
+            self.filter(pk=new_id).update(ref_count=F('ref_count') + 1)
+        if old_id:
+            self.release(old_id)
+
+    def add_references(self, blob_ids):
+        """ Take a reference for every entry of `blob_ids` (repeats count), one UPDATE per distinct count. """
+        by_count = defaultdict(list)
+        for blob_id, count in Counter(blob_ids).items():
+            by_count[count].append(blob_id)
+        for count, ids in by_count.items():
+            self.filter(pk__in=ids).update(ref_count=F('ref_count') + count)
+
+    def release(self, blob_id):
+        self.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        transaction.on_commit(lambda: self.collect(blob_id))
+
+    def release_many(self, blob_ids):
+        """ release() for every entry of `blob_ids` (repeats count), one UPDATE per distinct count. """
+        by_count = defaultdict(list)
+        for blob_id, count in Counter(blob_id for blob_id in blob_ids if blob_id).items():
+            by_count[count].append(blob_id)
+        for count, ids in by_count.items():
+            self.filter(pk__in=ids, ref_count__gte=count).update(ref_count=F('ref_count') - count)
+        released = [blob_id for ids in by_count.values() for blob_id in ids]
+        transaction.on_commit(lambda: [self.collect(blob_id) for blob_id in released])
+
+    def collect(self, blob_id):
+        """
+        Delete the blob and its bytes once nothing references it any more.
+
+        The row is locked and re-checked, so a reference taken meanwhile keeps it. The
+        bytes go after the row: store_blob() never writes over an existing name, so
+        content stored again in between lands in a file of its own.
+        """
+        with transaction.atomic():
+            blob = self.select_for_update().filter(pk=blob_id, ref_count=0).first()
+            if blob is None:
+                return False
+            try:
+                with transaction.atomic():
+                    blob.delete()
+            except ProtectedError:
+                return False
+        blob.file.delete(save=False)
+        return True
+
+    def sweep(self, before):
+        """ collect() the unreferenced blobs created before `before`, e.g. left by a failed upload. Returns how many went. """
+        orphans = self.filter(ref_count=0, created_at__lt=before).values_list('pk', flat=True)
+        return sum(self.collect(blob_id) for blob_id in list(orphans))
+
+
+# Blob is one stored copy of some content, shared by every file and version with the same bytes.
+class Blob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='blobs/', max_length=255)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    # Sniffed from the content after upload; blank until then
+    mime_type = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = BlobManager()
+
+    def __str__(self):
+        return self.sha256
+
+
+class ExtractedText(models.Model):
+    """
+    Text and document metadata pulled out of one blob by the extraction workers.
+
+    Keyed by blob, so content shared by several files and versions is only read once.
+    Rows are queued as PENDING when a file or version is saved and filled in by
+    `manage.py extract_text` (see resource.extraction).
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    blob = models.OneToOneField(Blob, on_delete=models.CASCADE, primary_key=True, related_name='extracted_text')
+    file_type = models.CharField(max_length=50, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    text = models.TextField(blank=True)
+    title = models.CharField(max_length=255, blank=True)
+    author = models.CharField(max_length=255, blank=True)
+    page_count = models.PositiveIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    extracted_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Text of {self.blob_id} ({self.status})"
+
+
+class BlobReference(models.Model):
+    """ Base for rows whose `file` is a shared Blob; keeps the blob's ref_count in step with `blob`. """
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+
+    _stored_blob_id = None
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored_blob_id = instance.__dict__.get('blob_id')
+        return instance
+
+    def use_blob(self, blob):
+        self.blob = blob
+        self.file = blob.file.name
+
+    def save(self, *args, **kwargs):
+        # Usually nested in a subclass's own transaction; a savepoint would only add round trips
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            if self.blob_id != self._stored_blob_id:
+                Blob.objects.swap_reference(self._stored_blob_id, self.blob_id)
+                self._stored_blob_id = self.blob_id
+
+
+class UploadedFileQuerySet(models.QuerySet):
+    def for_listing(self):
+        """ Load everything UploadedFileSerializer reads per row up front. """
+        return self.select_related('owner', 'category').prefetch_related('meta_tags')
+
+    def bulk_add(self, files):
+        """
+        Insert new files in one statement, doing for each what save() does: size and type from
+        the blob, the default category, blob references and access grants. No post_save signals
+        are sent, so callers queue search indexing and text extraction themselves.
+        """
+        for uploaded_file in files:
+            uploaded_file.file_size = uploaded_file.blob.size
+            uploaded_file.file_type = _file_extension(uploaded_file.file.name, uploaded_file.name)
+            if not uploaded_file.category_id:
+                uploaded_file.category_id = Category.get_default_category()
+        with transaction.atomic(savepoint=False):
+            self.bulk_create(files)
+            Blob.objects.add_references(uploaded_file.blob_id for uploaded_file in files)
+            AccessGrant.objects.add_items(files)
+            paths = {}
+            for uploaded_file in files:
+                paths.update(_cached_path(uploaded_file))
+            StorageUsage.objects.charge(
+                [(f.owner_id, f.folder_id, f.file_size or 0, 0, 1) for f in files], paths=paths,
+            )
+        for uploaded_file in files:
+            uploaded_file._stored_blob_id = uploaded_file.blob_id
+            uploaded_file._stored_access = _access_fields(uploaded_file, UploadedFile.access_location)
+            uploaded_file._stored_usage = _usage_fields(uploaded_file)
+            uploaded_file._stored_facets = _facet_fields(uploaded_file)
+        return files
+
+    def visible_to(self, user):
+        """ Files `user` owns, can see because they are public, or had shared with them directly or through a folder. """
+        return self.filter(AccessGrant.objects.covers('file', user))
+
 
 # UploadedFile model stores each uploaded file along with metadata.
-class UploadedFile(models.Model):
+class UploadedFile(AccessIndexed, BlobReference):
     name = models.CharField(max_length=255)
     file = models.FileField(upload_to='uploads/')  
     file_type = models.CharField(max_length=50, blank=True)  
-    file_size = models.PositiveIntegerField(blank=True, null=True)
+    file_size = models.PositiveBigIntegerField(blank=True, null=True)
     category = models.ForeignKey(
         Category, 
         on_delete=models.SET_NULL, 
@@ -50,6 +411,7 @@ class UploadedFile(models.Model):
         default=Category.get_default_category
     )
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    modified_at = models.DateTimeField(auto_now=True)  # Last-Modified for downloads
     folder = models.ForeignKey(Folder, on_delete=models.CASCADE, null=True, blank=True, related_name='files')
     is_starred = models.BooleanField(default=False, blank=True, null=True)  
     is_archived = models.BooleanField(default=False, blank=True, null=True) 
@@ -57,33 +419,198 @@ class UploadedFile(models.Model):
     is_public = models.BooleanField(default=False)
     meta_tags = models.ManyToManyField(Tag, blank=True, related_name="files")
 
+    objects = UploadedFileQuerySet.as_manager()
+    access_location = 'folder_id'
+    _stored_usage = None
+    _stored_facets = None
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of file listings: (folder, uploaded_at, id)
+            models.Index(fields=['folder', '-uploaded_at', '-id'], name='file_folder_uploaded_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored_usage = _usage_fields(instance)
+        instance._stored_facets = _facet_fields(instance)
+        return instance
 
     def rollback_to_version(self, version: 'FileVersion'):
         self.file = version.file
-        self.file_size = version.file.size
-        self.file_type = version.file.name.split('.')[-1].lower()
+        self.blob_id = version.blob_id
+        self.file_size = version.file_size
+        self.file_type = version.file_type
         self.save()
 
 
+    def add_version(self, blob, file_name, uploaded_by, change_note=''):
+        """ Make `blob` the current content, recording it (and a base version if needed) in the history. """
+        with transaction.atomic():
+            latest_version = self.versions.order_by('-version_number').first()
+            if latest_version is None:
+                # The content before the first new version becomes version 0, sharing its blob
+                FileVersion.objects.create(
+                    uploaded_file=self,
+                    version_number=0,
+                    file=self.file,
+                    blob_id=self.blob_id,
+                    file_name=self.name,
+                    uploaded_by=self.owner,
+                    change_note="Base version",
+                    is_current=False,
+                )
+                version_number = 1
+            else:
+                version_number = latest_version.version_number + 1
+
+            self.versions.update(is_current=False)
+
+            version = FileVersion(
+                uploaded_file=self,
+                version_number=version_number,
+                file_name=file_name,
+                uploaded_by=uploaded_by,
+                change_note=change_note,
+                is_current=True,
+            )
+            version.use_blob(blob)
+            version.save()
+
+            self.use_blob(blob)
+            self.name = file_name
+            self.save()
+            return version
+
     def save(self, *args, **kwargs):
         """ Extract file type and size before saving. """
         if self.file:
             self.file_size = self.file.size  # Store file size in bytes
-            self.file_type = self.file.name.split(".")[-1].lower()  # Extract file extension
+            # Blob paths carry no extension, so fall back to the display name
+            self.file_type = _file_extension(self.file.name, self.name)
 
         # Assign default category if not provided
         if not self.category_id:  
             self.category_id = Category.get_default_category()
 
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            created = self._state.adding
+            facet_fields = _facet_fields(self)
+            self._facets_changed = (
+                created
+                or self._stored_access != _access_fields(self, self.access_location)
+                or self._stored_facets != facet_fields
+            )
+            super().save(*args, **kwargs)
+
+            self._sync_access(created)
+            self._sync_usage(created)
+            self._stored_facets = facet_fields
+
+    def _sync_usage(self, created):
+        """ Charge a new file, or move its charge when it changed size, folder or owner. """
+        current = _usage_fields(self)
+        stored = self._stored_usage
+        if created:
+            StorageUsage.objects.charge([(*current, 0, 1)], paths=_cached_path(self))
+        elif stored is not None and stored != current:
+            version_bytes = 0
+            if stored[:2] != current[:2]:
+                # Moved: the history goes along
+                version_bytes = self.versions.aggregate(total=Sum('file_size'))['total'] or 0
+            StorageUsage.objects.charge([
+                (*stored[:2], -stored[2], -version_bytes, -1),
+                (*current[:2], current[2], version_bytes, 1),
+            ], paths=_cached_path(self))
+        self._stored_usage = current
+
+    def set_tags(self, tag_ids):
+        """
+        Make `tag_ids` the file's tags with at most one DELETE and one INSERT on the through
+        table, leaving unchanged tags alone. Sends the m2m_changed signals meta_tags.set() would.
+        """
+        through = UploadedFile.meta_tags.through
+        prefetched = getattr(self, '_prefetched_objects_cache', {})
+        if 'meta_tags' in prefetched:
+            current = {tag.pk for tag in prefetched.pop('meta_tags')}
+        else:
+            current = set(through.objects.filter(uploadedfile_id=self.pk).values_list('tag_id', flat=True))
+        wanted = set(tag_ids)
+
+        def notify(action, pk_set):
+            m2m_changed.send(sender=through, instance=self, action=action, reverse=False, model=Tag, pk_set=pk_set, using=self._state.db)
+
+        removed, added = current - wanted, wanted - current
+        with transaction.atomic(savepoint=False):
+            if removed:
+                notify('pre_remove', removed)
+                through.objects.filter(uploadedfile_id=self.pk, tag_id__in=removed).delete()
+                notify('post_remove', removed)
+            if added:
+                notify('pre_add', added)
+                through.objects.bulk_create(
+                    [through(uploadedfile_id=self.pk, tag_id=tag_id) for tag_id in added], ignore_conflicts=True,
+                )
+                notify('post_add', added)
 
     def is_accessible_by(self, user):
-        return self.owner == user or user in self.shared_with.all()
+        return self.access_grants.filter(grantee__in=AccessGrant.grantees(user)).exists()
 
     def __str__(self):
         return self.name if self.name else "Unnamed File"
 
+
+class SearchDocument(models.Model):
+    """
+    Full-text search data for one file.
+
+    `body` holds text extracted from the document. On PostgreSQL `search_vector` is the
+    weighted tsvector behind a GIN index; on SQLite the same data lives in the
+    resource_search_fts FTS5 table instead (see resource.search).
+    """
+    file = models.OneToOneField(UploadedFile, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    body = models.TextField(blank=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Search document for {self.file_id}"
+
     
+class FileSharingManager(models.Manager):
+
+    def create_new(self, shares):
+        """
+        Insert the unsaved FileSharing rows `shares`, skipping pairs that are already
+        shared, and return the rows this call inserted, with their ids. Grants, share
+        counters and events go to those only: a concurrent request may have shared the
+        same pair first.
+        """
+        shares = list(shares)
+        if not shares:
+            return []
+        now = timezone.now()
+        for share in shares:
+            share.shared_at = now
+        self.bulk_create(shares, ignore_conflicts=True)
+        # Skipped rows don't raise and no row gets its id back, so read back the rows
+        # carrying this insert's sharer and timestamp
+        wanted = {(share.share_type, share.file_id, share.folder_id, share.shared_to_id) for share in shares}
+        inserted = self.filter(
+            shared_by_id__in={share.shared_by_id for share in shares},
+            shared_to_id__in={share.shared_to_id for share in shares},
+            shared_at=now,
+        ).filter(
+            Q(file_id__in={share.file_id for share in shares if share.file_id})
+            | Q(folder_id__in={share.folder_id for share in shares if share.folder_id})
+        )
+        return [
+            share for share in inserted
+            if (share.share_type, share.file_id, share.folder_id, share.shared_to_id) in wanted
+        ]
+
+
 class FileSharing(models.Model):
     FILE = 'FILE'
     FOLDER = 'FOLDER'
@@ -104,17 +631,452 @@ class FileSharing(models.Model):
     share_type = models.CharField(max_length=10, choices=SHARE_TYPE_CHOICES)
     is_seen = models.BooleanField(default=False)
 
+    objects = FileSharingManager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['file', 'shared_to'], name='unique_file_share'),
             models.UniqueConstraint(fields=['folder', 'shared_to'], name='unique_folder_share'),
         ]
+        indexes = [
+            models.Index(fields=['shared_to', '-shared_at', '-id'], name='share_to_shared_at_idx'),
+        ]
 
     def __str__(self):
         return f"{self.shared_by} shared {self.share_type.lower()} to {self.shared_to}"
 
 
-class FileVersion(models.Model):
+class ShareCounterManager(models.Manager):
+    """
+    Keeps ShareCounter in step with FileSharing: call add() when file shares are created
+    (save() does it through a signal), and clear() when a user has seen theirs. Deleting an
+    unseen file share subtracts it through a signal. `manage.py reconcile_share_counters`
+    repairs any drift.
+    """
+
+    def unseen(self, user):
+        return self.filter(pk=user.pk).values_list('unseen', flat=True).first() or 0
+
+    def add(self, shares):
+        """ Count the unseen file shares among the FileSharing rows `shares`. """
+        per_user = {}
+        for share in shares:
+            if share.share_type == FileSharing.FILE and not share.is_seen:
+                per_user[share.shared_to_id] = per_user.get(share.shared_to_id, 0) + 1
+        if not per_user:
+            return
+        self.bulk_create([ShareCounter(user_id=user_id) for user_id in per_user], ignore_conflicts=True)
+        # One UPDATE per distinct increment; bulk shares usually give everyone the same one
+        by_increment = {}
+        for user_id, count in per_user.items():
+            by_increment.setdefault(count, []).append(user_id)
+        for count, user_ids in by_increment.items():
+            self.filter(pk__in=user_ids).update(unseen=F('unseen') + count)
+
+    def subtract(self, user_id, count=1):
+        self.filter(pk=user_id, unseen__gte=count).update(unseen=F('unseen') - count)
+
+    def clear(self, user_id):
+        """ Zero the user's counter; returns whether it had anything to clear. """
+        return bool(self.filter(pk=user_id, unseen__gt=0).update(unseen=0))
+
+    def actual(self):
+        """ {user id: unseen file shares}, counted from FileSharing. """
+        return dict(
+            FileSharing.objects.filter(is_seen=False, share_type=FileSharing.FILE)
+            .values_list('shared_to').annotate(count=Count('id')).order_by()
+        )
+
+    def reconcile(self):
+        """ Reset every counter that disagrees with FileSharing. Returns the number fixed. """
+        with transaction.atomic():
+            actual = self.actual()
+            stored = dict(self.select_for_update().values_list('user_id', 'unseen'))
+            wrong = {
+                user_id: actual.get(user_id, 0)
+                for user_id in set(actual) | set(stored)
+                if actual.get(user_id, 0) != stored.get(user_id, 0)
+            }
+            missing = [ShareCounter(user_id=user_id, unseen=count) for user_id, count in wrong.items() if user_id not in stored]
+            self.bulk_create(missing)
+            changed = [ShareCounter(user_id=user_id, unseen=count) for user_id, count in wrong.items() if user_id in stored]
+            self.bulk_update(changed, ['unseen'], batch_size=500)
+        return len(wrong)
+
+
+# ShareCounter is the number of file shares each user hasn't seen yet, for the shared-with-me badge.
+class ShareCounter(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='share_counter')
+    unseen = models.PositiveIntegerField(default=0)
+
+    objects = ShareCounterManager()
+
+    def __str__(self):
+        return f"{self.user}: {self.unseen} unseen"
+
+
+class StorageUsageManager(models.Manager):
+    """
+    Keeps the storage rollups in step with the files: StorageUsage per file owner and the
+    tree_* fields of every folder, which cover the folder's whole subtree. Bytes are the
+    current content (UploadedFile.file_size); version bytes are the FileVersion rows.
+
+    UploadedFile.save(), bulk_add(), FileVersion.save() and Folder.save() (moves) charge
+    what they change, and deleting a file or version un-charges it through a signal.
+    Queryset updates and deletes have to call charge() themselves.
+    `manage.py verify_storage_usage` finds and repairs any drift.
+    """
+    FIELDS = ('bytes', 'version_bytes', 'files')
+
+    def charge(self, entries, paths=None):
+        """
+        Apply (owner id, folder id, bytes, version bytes, files) deltas to the owner's total and
+        to the folder and each of its ancestors. `paths` may give folder paths already loaded.
+        Runs one UPDATE per distinct delta for folders and for users, after at most one path lookup.
+        """
+        paths = dict(paths or {})
+        entries = [entry for entry in entries if any(entry[2:])]
+        missing = {folder_id for _, folder_id, *_ in entries if folder_id and folder_id not in paths}
+        if missing:
+            paths.update(Folder.objects.filter(pk__in=missing).values_list('id', 'path'))
+
+        folders, users = defaultdict(lambda: [0, 0, 0]), defaultdict(lambda: [0, 0, 0])
+        for owner_id, folder_id, *delta in entries:
+            targets = [folders[pk] for pk in _path_ids(paths.get(folder_id) or '')]
+            if owner_id:
+                targets.append(users[owner_id])
+            for total in targets:
+                for i, value in enumerate(delta):
+                    total[i] += value
+
+        with transaction.atomic(savepoint=False):
+            for delta, folder_ids in _group_by_delta(folders):
+                Folder.objects.filter(pk__in=folder_ids).update(**_increments(('tree_bytes', 'tree_version_bytes', 'tree_files'), delta))
+            for delta, user_ids in _group_by_delta(users):
+                increments = _increments(self.FIELDS, delta)
+                if self.filter(pk__in=user_ids).update(**increments) < len(user_ids):
+                    # First charge for some of them
+                    existing = set(self.filter(pk__in=user_ids).values_list('pk', flat=True))
+                    self.bulk_create([StorageUsage(user_id=user_id) for user_id in user_ids if user_id not in existing], ignore_conflicts=True)
+                    self.filter(pk__in=[user_id for user_id in user_ids if user_id not in existing]).update(**increments)
+
+    def discharge(self, files):
+        """
+        Un-charge the UploadedFile queryset `files` and their versions in two aggregate
+        queries, for bulk deletes that skip the per-row signals (see BULK_ACCOUNTED).
+        """
+        entries = [
+            (owner_id, folder_id, -(total or 0), 0, -count) for folder_id, owner_id, total, count in
+            files.values_list('folder_id', 'owner_id').annotate(total=Sum('file_size'), count=Count('id')).order_by()
+        ]
+        entries += [
+            (owner_id, folder_id, 0, -(total or 0), 0) for folder_id, owner_id, total in
+            FileVersion.objects.filter(uploaded_file__in=files)
+            .values_list('uploaded_file__folder_id', 'uploaded_file__owner_id').annotate(total=Sum('file_size')).order_by()
+        ]
+        self.charge(entries)
+
+    def move_tree(self, folder_id, old_path, new_path):
+        """ Carry a moved folder's totals from its old ancestors to its new ones. """
+        totals = Folder.objects.filter(pk=folder_id).values_list('tree_bytes', 'tree_version_bytes', 'tree_files').get()
+        if not any(totals):
+            return
+        fields = ('tree_bytes', 'tree_version_bytes', 'tree_files')
+        Folder.objects.filter(pk__in=_path_ids(old_path)[:-1]).update(**_increments(fields, [-value for value in totals]))
+        Folder.objects.filter(pk__in=_path_ids(new_path)[:-1]).update(**_increments(fields, totals))
+
+    def for_user(self, user):
+        """ The user's StorageUsage, unsaved and empty if nothing was ever charged to them. """
+        return self.filter(pk=user.pk).first() or StorageUsage(user=user)
+
+    def allows(self, user, new_bytes):
+        """ Whether `new_bytes` more fit in the user's quota. One query. """
+        return self.for_user(user).allows(new_bytes)
+
+    def actual(self):
+        """ ({folder id: totals}, {user id: totals}) counted from the files, totals as [bytes, version bytes, files]. """
+        direct, users = defaultdict(lambda: [0, 0, 0]), defaultdict(lambda: [0, 0, 0])
+        files = UploadedFile.objects.values_list('folder_id', 'owner_id').annotate(total=Sum('file_size'), count=Count('id')).order_by()
+        for folder_id, owner_id, total, count in files:
+            for target in (direct[folder_id], users[owner_id]):
+                target[0] += total or 0
+                target[2] += count
+        versions = FileVersion.objects.values_list('uploaded_file__folder_id', 'uploaded_file__owner_id').annotate(total=Sum('file_size')).order_by()
+        for folder_id, owner_id, total in versions:
+            direct[folder_id][1] += total or 0
+            users[owner_id][1] += total or 0
+
+        folders = {pk: [0, 0, 0] for pk in Folder.objects.values_list('pk', flat=True)}
+        for pk, path in Folder.objects.filter(pk__in=[pk for pk in direct if pk]).values_list('pk', 'path'):
+            for ancestor_id in _path_ids(path):
+                if ancestor_id in folders:
+                    for i, value in enumerate(direct[pk]):
+                        folders[ancestor_id][i] += value
+        users.pop(None, None)
+        return folders, dict(users)
+
+    def drift(self, lock=False):
+        """ ({folder id: actual totals}, {user id: actual totals}) for the stored totals that are wrong. """
+        folders, users = self.actual()
+        stored_folders = Folder.objects.select_for_update() if lock else Folder.objects.all()
+        stored_folders = {
+            pk: list(totals) for pk, *totals in
+            stored_folders.values_list('pk', 'tree_bytes', 'tree_version_bytes', 'tree_files')
+        }
+        stored_users = self.select_for_update() if lock else self.all()
+        stored_users = {pk: list(totals) for pk, *totals in stored_users.values_list('pk', *self.FIELDS)}
+        return (
+            {pk: totals for pk, totals in folders.items() if stored_folders.get(pk, totals) != totals},
+            {
+                user_id: users.get(user_id, [0, 0, 0])
+                for user_id in set(users) | set(stored_users)
+                if users.get(user_id, [0, 0, 0]) != stored_users.get(user_id, [0, 0, 0])
+            },
+        )
+
+    def reconcile(self):
+        """ Reset every folder and user total that disagrees with the files. Returns (folders, users) fixed. """
+        with transaction.atomic():
+            folders, users = self.drift(lock=True)
+            Folder.objects.bulk_update(
+                [Folder(pk=pk, tree_bytes=t[0], tree_version_bytes=t[1], tree_files=t[2]) for pk, t in folders.items()],
+                ['tree_bytes', 'tree_version_bytes', 'tree_files'], batch_size=500,
+            )
+            existing = set(self.filter(pk__in=users).values_list('pk', flat=True))
+            rows = [StorageUsage(user_id=user_id, bytes=t[0], version_bytes=t[1], files=t[2]) for user_id, t in users.items()]
+            self.bulk_create([row for row in rows if row.user_id not in existing])
+            self.bulk_update([row for row in rows if row.user_id in existing], list(self.FIELDS), batch_size=500)
+        return len(folders), len(users)
+
+
+def _group_by_delta(totals):
+    """ Ids sharing the same delta, so each distinct delta is one UPDATE. """
+    by_delta = defaultdict(list)
+    for pk, delta in totals.items():
+        if any(delta):
+            by_delta[tuple(delta)].append(pk)
+    return by_delta.items()
+
+
+def _increments(fields, delta):
+    return {field: F(field) + value for field, value in zip(fields, delta) if value}
+
+
+# StorageUsage is the storage charged to each user: every file they own, with its versions.
+class StorageUsage(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='storage_usage')
+    bytes = models.BigIntegerField(default=0)
+    version_bytes = models.BigIntegerField(default=0)
+    files = models.BigIntegerField(default=0)
+    # Overrides STORAGE_QUOTA_BYTES for this user; 0 means unlimited
+    quota = models.BigIntegerField(null=True, blank=True)
+
+    objects = StorageUsageManager()
+
+    def __str__(self):
+        return f"{self.user}: {self.bytes + self.version_bytes} bytes"
+
+    @property
+    def used(self):
+        return self.bytes + self.version_bytes
+
+    @property
+    def limit(self):
+        """ The quota in bytes, or None for unlimited. """
+        quota = self.quota if self.quota is not None else getattr(settings, 'STORAGE_QUOTA_BYTES', 0)
+        return quota or None
+
+    def allows(self, new_bytes):
+        return self.limit is None or self.used + new_bytes <= self.limit
+
+
+class AccessGrantManager(models.Manager):
+    """
+    Maintains the access index. Model saves call add_item/sync_item/sync_inherited, sharing code
+    calls grant_shares, and FileSharing deletion calls revoke_share; deleting a file or
+    folder drops its grants through the cascade.
+    """
+
+    def covers(self, kind, user):
+        """ Filter for a file or folder queryset: an indexed lookup of (item, grantee). """
+        return models.Exists(self.filter(**{kind: OuterRef('pk')}, grantee__in=AccessGrant.grantees(user)))
+
+    def add_item(self, item):
+        """ All grants of a newly created file or folder, in one INSERT. """
+        self.bulk_create(self._own_grants(item) + self._inherited_grants(item))
+
+    def add_items(self, items):
+        """ add_item for many new files or folders: one INSERT, one share lookup per distinct location. """
+        shares_by_path = {}
+        grants = []
+        for item in items:
+            grants += self._own_grants(item)
+            path = self._location_path(item)
+            if path is None:
+                continue
+            if path not in shares_by_path:
+                shares_by_path[path] = self._folder_shares(path)
+            grants += [
+                AccessGrant(grantee=shared_to_id, reason=AccessGrant.INHERITED, via_folder_id=folder_id, **{_kind(item): item})
+                for folder_id, shared_to_id in shares_by_path[path]
+            ]
+        self.bulk_create(grants)
+
+    def move_files(self, file_ids, folder):
+        """ sync_inherited for files moved into `folder` (None for the root) with a queryset update. """
+        self.filter(file_id__in=file_ids, reason=AccessGrant.INHERITED).delete()
+        if folder is not None:
+            shares = self._folder_shares(folder.path)
+            self.bulk_create([
+                AccessGrant(grantee=shared_to_id, reason=AccessGrant.INHERITED, via_folder_id=via_folder_id, file_id=file_id)
+                for file_id in file_ids for via_folder_id, shared_to_id in shares
+            ])
+
+    def sync_item(self, item):
+        """ Rewrite the owner and public grants of a file or folder. """
+        self.filter(**{_kind(item): item}, reason__in=[AccessGrant.OWNER, AccessGrant.PUBLIC]).delete()
+        self.bulk_create(self._own_grants(item))
+
+    def sync_inherited(self, item):
+        """ Recompute the folder-share grants of a moved file, or of a moved folder and everything below it. """
+        if isinstance(item, UploadedFile):
+            self.filter(file=item, reason=AccessGrant.INHERITED).delete()
+            self.bulk_create(self._inherited_grants(item))
+            return
+
+        self.filter(
+            models.Q(folder__path__startswith=item.path) | models.Q(file__folder__path__startswith=item.path),
+            reason=AccessGrant.INHERITED,
+        ).delete()
+        # Shares above the folder cover all of it; shares inside only their own part
+        shares = FileSharing.objects.filter(share_type=FileSharing.FOLDER).filter(
+            models.Q(folder_id__in=_path_ids(item.path)) | models.Q(folder__path__startswith=item.path)
+        )
+        self.bulk_create(self._subtree_grants(item.path, shares.values_list('folder__path', 'folder_id', 'shared_to_id')))
+
+    def _own_grants(self, item):
+        kind = _kind(item)
+        grants = []
+        if item.owner_id:
+            grants.append(AccessGrant(grantee=item.owner_id, reason=AccessGrant.OWNER, **{kind: item}))
+        if item.is_public:
+            grants.append(AccessGrant(grantee=AccessGrant.EVERYONE, reason=AccessGrant.PUBLIC, **{kind: item}))
+        return grants
+
+    def _location_path(self, item):
+        """ Path of the folder whose shares reach `item`, or None for a root-level file. """
+        if isinstance(item, Folder):
+            return item.path
+        if not item.folder_id:
+            return None
+        if UploadedFile.folder.is_cached(item):
+            return item.folder.path
+        return Folder.objects.filter(pk=item.folder_id).values_list('path', flat=True).get()
+
+    def _folder_shares(self, path):
+        """ (folder id, shared_to id) of the folder shares covering `path`. """
+        shares = FileSharing.objects.filter(share_type=FileSharing.FOLDER, folder_id__in=_path_ids(path))
+        return list(shares.values_list('folder_id', 'shared_to_id'))
+
+    def _inherited_grants(self, item):
+        """ Grants from shares of the folders above a single file or folder. """
+        path = self._location_path(item)
+        if path is None:
+            return []
+        return [
+            AccessGrant(grantee=shared_to_id, reason=AccessGrant.INHERITED, via_folder_id=folder_id, **{_kind(item): item})
+            for folder_id, shared_to_id in self._folder_shares(path)
+        ]
+
+    def grant_shares(self, shares):
+        """ Add the grants of newly created FileSharing rows. """
+        grants = [
+            AccessGrant(grantee=share.shared_to_id, file_id=share.file_id, reason=AccessGrant.SHARED)
+            for share in shares if share.share_type == FileSharing.FILE
+        ]
+        folder_shares = [share for share in shares if share.share_type == FileSharing.FOLDER]
+        paths = dict(Folder.objects.filter(pk__in={s.folder_id for s in folder_shares}).values_list('pk', 'path'))
+        for path in set(paths.values()):
+            grants += self._subtree_grants(path, [
+                (path, share.folder_id, share.shared_to_id) for share in folder_shares if paths[share.folder_id] == path
+            ])
+        self.bulk_create(grants)
+
+    def revoke_share(self, share):
+        if share.share_type == FileSharing.FILE:
+            self.filter(grantee=share.shared_to_id, file_id=share.file_id, reason=AccessGrant.SHARED).delete()
+        else:
+            self.filter(grantee=share.shared_to_id, via_folder_id=share.folder_id).delete()
+
+    def _subtree_grants(self, root_path, shares):
+        """ Grants for every (share path, share folder, recipient) over the folders and files under `root_path`. """
+        shares = list(shares)
+        if not shares:
+            return []
+        folders = list(Folder.objects.filter(path__startswith=root_path).values_list('pk', 'path'))
+        files = list(UploadedFile.objects.filter(folder__path__startswith=root_path).values_list('pk', 'folder__path'))
+        grants = []
+        for share_path, via_folder_id, grantee in shares:
+            grants += [
+                AccessGrant(grantee=grantee, folder_id=pk, reason=AccessGrant.INHERITED, via_folder_id=via_folder_id)
+                for pk, path in folders if path.startswith(share_path)
+            ]
+            grants += [
+                AccessGrant(grantee=grantee, file_id=pk, reason=AccessGrant.INHERITED, via_folder_id=via_folder_id)
+                for pk, path in files if path.startswith(share_path)
+            ]
+        return grants
+
+
+def _kind(item):
+    return 'file' if isinstance(item, UploadedFile) else 'folder'
+
+
+def _path_ids(path):
+    return [int(pk) for pk in path.strip('/').split('/') if pk]
+
+
+# AccessGrant is the materialized answer to "who may see this file or folder", one row per reason.
+class AccessGrant(models.Model):
+    EVERYONE = 0  # grantee of public items
+
+    OWNER = 'owner'
+    PUBLIC = 'public'
+    SHARED = 'shared'
+    INHERITED = 'inherited'  # through a share of the folder or one of its parents
+
+    REASON_CHOICES = [
+        (OWNER, 'Owner'),
+        (PUBLIC, 'Public'),
+        (SHARED, 'Shared'),
+        (INHERITED, 'Inherited'),
+    ]
+
+    grantee = models.BigIntegerField()  # user id, or EVERYONE
+    # Indexed together with the grantee below
+    file = models.ForeignKey(UploadedFile, on_delete=models.CASCADE, null=True, blank=True, related_name='access_grants', db_index=False)
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, null=True, blank=True, related_name='access_grants', db_index=False)
+    reason = models.CharField(max_length=10, choices=REASON_CHOICES)
+    via_folder = models.ForeignKey(Folder, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+
+    objects = AccessGrantManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['file', 'grantee'], name='access_file_grantee_idx'),
+            models.Index(fields=['folder', 'grantee'], name='access_folder_grantee_idx'),
+            models.Index(fields=['grantee', 'via_folder'], name='access_grantee_via_idx'),
+        ]
+
+    @staticmethod
+    def grantees(user):
+        return [AccessGrant.EVERYONE, user.pk] if user.is_authenticated else [AccessGrant.EVERYONE]
+
+    def __str__(self):
+        return f"{self.grantee} {self.reason} {self.file_id or self.folder_id}"
+
+
+class FileVersion(BlobReference):
     uploaded_file = models.ForeignKey(UploadedFile, on_delete=models.CASCADE, related_name="versions")
     version_number = models.PositiveIntegerField()
     file = models.FileField(upload_to='uploads/versions/')
@@ -123,7 +1085,7 @@ class FileVersion(models.Model):
     change_note = models.TextField(blank=True)
     is_current = models.BooleanField(default=False)
 
-    file_size = models.PositiveIntegerField(blank=True, null=True)
+    file_size = models.PositiveBigIntegerField(blank=True, null=True)
     file_type = models.CharField(max_length=50, blank=True)
     file_name = models.CharField(max_length=255, blank=True)
 
@@ -133,8 +1095,16 @@ class FileVersion(models.Model):
     def save(self, *args, **kwargs):
         if self.file:
             self.file_size = self.file.size
-            self.file_type = self.file.name.split('.')[-1].lower()
-        super().save(*args, **kwargs)
+            self.file_type = _file_extension(self.file.name, self.file_name)
+        with transaction.atomic():
+            created = self._state.adding
+            super().save(*args, **kwargs)
+            if created and self.file_size:
+                uploaded_file = self.uploaded_file
+                StorageUsage.objects.charge(
+                    [(uploaded_file.owner_id, uploaded_file.folder_id, 0, self.file_size, 0)],
+                    paths=_cached_path(uploaded_file),
+                )
 
     def __str__(self):
         return f"Version {self.version_number} of {self.uploaded_file.name}"
@@ -157,6 +1127,166 @@ class Reminder(models.Model):
     repeat = models.CharField(max_length=20, choices=REPEAT_CHOICES, default='none')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # When the dispatcher fires it next; None once a one-off reminder has fired
+    next_fire_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    last_fired_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'next_fire_at'], name='reminder_user_next_fire_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored_schedule = (instance.__dict__.get('remind_at'), instance.__dict__.get('repeat'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # A new or rescheduled reminder fires at its own time again
+        if self._state.adding or getattr(self, '_stored_schedule', None) != (self.remind_at, self.repeat):
+            self.next_fire_at = self.remind_at
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'next_fire_at'}
+        super().save(*args, **kwargs)
+        self._stored_schedule = (self.remind_at, self.repeat)
 
     def is_recurring(self):
         return self.repeat != 'none'
+
+
+class Notification(models.Model):
+    """ An in-app notification, listed by the notifications endpoint until the user reads it. """
+    REMINDER = 'reminder'
+
+    KIND_CHOICES = [
+        (REMINDER, 'Reminder'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    message = models.TextField(blank=True)
+    file = models.ForeignKey(UploadedFile, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    reminder = models.ForeignKey(Reminder, on_delete=models.SET_NULL, null=True, blank=True, related_name='notifications')
+    created_at = models.DateTimeField(default=timezone.now)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'read_at', '-created_at'], name='notification_user_unread_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} for {self.user}: {self.message[:40]}"
+
+
+def upload_session_expiry():
+    return timezone.now() + settings.UPLOAD_SESSION_TTL
+
+
+class UploadSessionManager(models.Manager):
+    def expire(self, now=None):
+        """ Delete sessions past their expiry and their staging files. Returns how many went. """
+        expired = self.filter(expires_at__lte=now or timezone.now())
+        count = 0
+        for session in expired.iterator():
+            # Conditional, so a session that a chunk extended meanwhile is kept with its bytes
+            if self.filter(pk=session.pk, expires_at=session.expires_at).delete()[0]:
+                default_storage.delete(session.staging_name)
+                count += 1
+        return count
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload: chunks are appended to a staging file until the client finalizes it.
+    Sessions untouched until `expires_at` are removed by `manage.py expire_upload_sessions`.
+    """
+    ACTIVE = 'active'
+    COMPLETE = 'complete'
+
+    STATUS_CHOICES = [
+        (ACTIVE, 'Active'),
+        (COMPLETE, 'Complete'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    file_name = models.CharField(max_length=255)
+    total_size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=ACTIVE)
+
+    # Where the finished file goes: a new file in `folder`, or a new version of `target_file`
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, null=True, blank=True)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
+    is_public = models.BooleanField(default=False)
+    target_file = models.ForeignKey(UploadedFile, on_delete=models.CASCADE, null=True, blank=True, related_name='upload_sessions')
+    change_note = models.TextField(blank=True)
+    result_file = models.ForeignKey(UploadedFile, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    # SHA-256 the client expects, and the one of the bytes received, set with the last chunk
+    expected_sha256 = models.CharField(max_length=64, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True)
+    # Held by the request writing a chunk, so only one writes at a time without a row lock
+    writing_until = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField(default=upload_session_expiry, db_index=True)
+
+    objects = UploadSessionManager()
+
+    @property
+    def is_expired(self):
+        return self.expires_at <= timezone.now()
+
+    @property
+    def staging_name(self):
+        return f"uploads/chunks/{self.id}"
+
+    def __str__(self):
+        return f"{self.file_name} ({self.received}/{self.total_size})"
+
+
+class OutboundEmail(models.Model):
+    """
+    One queued email. Requests only insert these; `manage.py send_queued_mail` delivers
+    them over a shared SMTP connection and retries failures with backoff (see resource.mail).
+    """
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='outbound_emails')
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField()
+    reply_to = models.JSONField(default=list, blank=True)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # When the worker may pick it up: the retry time for QUEUED, the lease expiry for SENDING
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='email_status_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} ({self.status})"
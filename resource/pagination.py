@@ -0,0 +1,72 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+
+DEFAULT_PAGE_SIZE = getattr(settings, 'RESOURCE_PAGE_SIZE', 100)
+MAX_PAGE_SIZE = getattr(settings, 'RESOURCE_MAX_PAGE_SIZE', 500)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, pk):
+    """ Opaque cursor for the (timestamp, id) position of the last row on a page. """
+    raw = json.dumps([timestamp.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, pk = json.loads(raw)
+        timestamp = parse_datetime(timestamp)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor.")
+    if timestamp is None or not isinstance(pk, int):
+        raise InvalidCursor("Invalid cursor.")
+    return timestamp, pk
+
+
+def parse_limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def paginate(queryset, field, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return one page of `queryset`, newest first by (`field`, id), and the cursor of the next page.
+
+    Pages are found by seeking past the previous page's last (`field`, id) pair instead
+    of using OFFSET, so page 1000 costs the same index range scan as page 1, and rows
+    inserted while paging never shift or duplicate entries.
+    """
+    queryset = queryset.order_by(f'-{field}', '-id')
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        queryset = queryset.filter(**{f'{field}__lte': timestamp}).exclude(**{field: timestamp, 'id__gte': pk})
+
+    rows = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.pk)
+    return rows, next_cursor
+
+
+def paginate_request(queryset, request, field, cursor_param='cursor'):
+    """ paginate() driven by the `cursor_param` and `limit` query parameters. """
+    return paginate(
+        queryset,
+        field,
+        cursor=request.GET.get(cursor_param),
+        limit=parse_limit(request.GET.get('limit')),
+    )
@@ -0,0 +1,142 @@
+"""
+Post-upload processing.
+
+Once a batch upload commits, the per-file work that doesn't have to hold up the
+response (MIME sniffing of the stored content, the search index entry, and whatever
+steps are added to STEPS later) runs in a bounded pool of POST_UPLOAD_WORKERS
+threads, so a batch takes about as long as its slowest file rather than the sum of
+all of them. Text extraction is already queued in the upload transaction and runs
+in `manage.py extract_text`.
+
+Progress is kept in the shared cache, one entry per file, so any worker can answer
+GET /upload-batches/<id>/ while the pool is still running. A batch lost to a worker
+restart only misses these derived values: `rebuild_search_index` and the next sniff
+fill them in again.
+"""
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+
+from . import search
+from .models import Blob, UploadedFile
+from .sniffing import sniff
+
+
+logger = logging.getLogger(__name__)
+
+# Progress entries outlive the batch by this long
+PROGRESS_TIMEOUT = 60 * 60
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def sniff_mime_type(uploaded_file):
+    blob = uploaded_file.blob
+    if blob is None or blob.mime_type:
+        return
+    with blob.file.open('rb') as content:
+        blob.mime_type = sniff(content)
+    Blob.objects.filter(pk=blob.pk, mime_type='').update(mime_type=blob.mime_type)
+
+
+def index_for_search(uploaded_file):
+    search.index_file(uploaded_file.pk)
+
+
+STEPS = [sniff_mime_type, index_for_search]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def workers():
+    return getattr(settings, 'POST_UPLOAD_WORKERS', 4)
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=workers(), thread_name_prefix='post-upload')
+        return _pool
+
+
+def _batch_key(batch_id):
+    return f'resource:upload-batch:{batch_id}'
+
+
+def _file_key(batch_id, file_id):
+    return f'resource:upload-batch:{batch_id}:{file_id}'
+
+
+def process_file(batch_id, file_id, pooled=False):
+    """ Run every step for one file and record the outcome. """
+    if pooled:
+        # Pool threads keep their own connections; make sure they are usable, and
+        # don't leave them open between batches
+        close_old_connections()
+    try:
+        uploaded_file = UploadedFile.objects.select_related('blob').get(pk=file_id)
+        for step in STEPS:
+            step(uploaded_file)
+        outcome = {"status": DONE}
+    except Exception as e:
+        logger.exception("Post-upload processing failed for file %s", file_id)
+        outcome = {"status": FAILED, "error": f"{type(e).__name__}: {e}"}
+    finally:
+        if pooled:
+            close_old_connections()
+    cache.set(_file_key(batch_id, file_id), outcome, PROGRESS_TIMEOUT)
+    return outcome
+
+
+def _run(batch_id, file_ids):
+    if workers() < 1:
+        for file_id in file_ids:
+            process_file(batch_id, file_id)
+    else:
+        pool = _executor()
+        for file_id in file_ids:
+            pool.submit(process_file, batch_id, file_id, True)
+
+
+def start(user, file_ids):
+    """
+    Process the files `file_ids` once the current transaction (if any) commits.
+    Returns the batch id for progress(). With POST_UPLOAD_WORKERS = 0 the files are
+    processed in the calling thread (tests, debugging).
+    """
+    batch_id = uuid.uuid4()
+    file_ids = list(file_ids)
+    cache.set(_batch_key(batch_id), {"user": user.pk, "files": file_ids}, PROGRESS_TIMEOUT)
+    cache.set_many({_file_key(batch_id, file_id): {"status": PENDING} for file_id in file_ids}, PROGRESS_TIMEOUT)
+    # Pool threads use their own connections and only see committed rows
+    transaction.on_commit(lambda: _run(batch_id, file_ids))
+    return batch_id
+
+
+def progress(batch_id, user):
+    """ The batch's per-file status, or None if it is unknown, expired or someone else's. """
+    batch = cache.get(_batch_key(batch_id))
+    if batch is None or batch["user"] != user.pk:
+        return None
+    outcomes = cache.get_many([_file_key(batch_id, file_id) for file_id in batch["files"]])
+    files = [
+        {"id": file_id, **outcomes.get(_file_key(batch_id, file_id), {"status": PENDING})}
+        for file_id in batch["files"]
+    ]
+    return {
+        "id": str(batch_id),
+        "total": len(files),
+        "done": sum(f["status"] == DONE for f in files),
+        "failed": sum(f["status"] == FAILED for f in files),
+        "files": files,
+    }
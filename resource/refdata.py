@@ -0,0 +1,127 @@
+"""
+Process-local cache of reference data: categories and the default category.
+
+Each worker keeps one Snapshot and a copy of the version stamp it was loaded under.
+The stamp lives in the default cache, which all workers on a host share (see CACHES),
+so reading it costs no query. Saving or deleting a Category writes a new stamp, and
+every worker reloads on its next read. Uploads and get_categories read the snapshot
+and only query when something has changed.
+
+Tags are not kept: there are as many as users care to invent, and each tag edit
+looks up just the names it uses, in one query (see tag_ids).
+
+A snapshot loaded inside a transaction is used but not kept: it may include rows that
+are rolled back.
+"""
+import hashlib
+import json
+import logging
+import uuid
+
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+
+from .models import Category, Tag
+
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'resource:refdata-version'
+DEFAULT_CATEGORY = 'General'
+
+
+class Snapshot:
+    __slots__ = ('categories', 'category_ids', 'default_category_id', 'etag')
+
+    def __init__(self, categories):
+        self.categories = [{"id": pk, "name": name} for pk, name in categories]
+        self.category_ids = {pk for pk, _ in categories}
+        self.default_category_id = next((pk for pk, name in categories if name == DEFAULT_CATEGORY), None)
+        self.etag = hashlib.sha1(json.dumps(self.categories).encode()).hexdigest()
+
+
+_state = None  # (version, Snapshot)
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # First worker to get here (or after the cache was cleared) sets it for all
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def snapshot(keep=None):
+    """ The current Snapshot. `keep` overrides whether a freshly loaded one is cached. """
+    global _state
+    version = _version()
+    state = _state
+    if state is not None and state[0] == version:
+        return state[1]
+    loaded = Snapshot(list(Category.objects.order_by('id').values_list('id', 'name')))
+    if keep is None:
+        keep = not connection.in_atomic_block
+    if keep:
+        _state = (version, loaded)
+    return loaded
+
+
+def invalidate():
+    """ Make every worker reload on its next read. """
+    global _state
+    _state = None
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def warm():
+    """ Load the snapshot at startup; a database that isn't migrated yet is left for later. """
+    try:
+        snapshot(keep=True)
+    except DatabaseError as e:
+        logger.warning("Reference data not preloaded: %s", e)
+
+
+def default_category_id():
+    category_id = snapshot().default_category_id
+    if category_id is None:
+        category_id = Category.objects.get_or_create(name=DEFAULT_CATEGORY)[0].pk
+    return category_id
+
+
+def category(pk):
+    """ Category `pk` as a model instance built from the snapshot, for serializers. """
+    for entry in snapshot().categories:
+        if entry["id"] == pk:
+            return Category.from_db(Category.objects.db, ['id', 'name'], (pk, entry["name"]))
+    # Created since the snapshot was taken (the default category, on a fresh database)
+    return Category.objects.get(pk=pk)
+
+
+def category_id(value):
+    """ `value` as an existing category id, or the default category's. """
+    try:
+        pk = int(value)
+    except (TypeError, ValueError):
+        return default_category_id()
+    return pk if pk in snapshot().category_ids else default_category_id()
+
+
+def tag_ids(names):
+    """ Ids of the tags called `names`, creating the ones that don't exist yet. """
+    names = {name.strip() for name in names if name and name.strip()}
+    if not names:
+        return []
+    ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = names - ids.keys()
+    if missing:
+        Tag.objects.bulk_create([Tag(name=name) for name in missing], ignore_conflicts=True)
+        ids.update(Tag.objects.filter(name__in=missing).values_list('name', 'id'))
+    return list(ids.values())
+
+
+def changed():
+    """ Call after Category rows change; bulk operations don't send the signals that do it. """
+    invalidate()
+    # Another worker may reload before we commit and cache the old rows; bump again once they're visible
+    transaction.on_commit(invalidate)
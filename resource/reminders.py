@@ -0,0 +1,172 @@
+"""
+Reminder dispatcher.
+
+Every pending reminder carries an indexed `next_fire_at`. The dispatcher keeps the
+reminders due within the next `horizon` in a heap, topped up from an index range scan
+every `refresh` seconds, and sleeps until the earliest one. Due reminders are fired in
+batches: one in-app Notification and one queued email each, inserted in bulk. Recurring
+reminders then move on to their next occurrence after now, so a dispatcher that was down
+fires each missed reminder once instead of replaying every missed occurrence.
+"""
+import calendar
+import heapq
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import events
+from .mail import build_email
+from .models import Notification, OutboundEmail, Reminder
+
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_HORIZON = timedelta(minutes=5)
+DEFAULT_REFRESH = 30
+# Most reminders held in memory at once; a larger backlog is loaded as the heap drains
+MAX_LOADED = 50_000
+
+_PERIODS = {
+    'daily': timedelta(days=1),
+    'weekly': timedelta(weeks=1),
+}
+_MONTHS = {
+    'monthly': 1,
+    'yearly': 12,
+}
+
+
+def add_months(moment, months):
+    """ `moment` moved by `months`, with the day clamped to the length of the target month. """
+    month_index = moment.month - 1 + months
+    year, month = moment.year + month_index // 12, month_index % 12 + 1
+    return moment.replace(year=year, month=month, day=min(moment.day, calendar.monthrange(year, month)[1]))
+
+
+def next_occurrence(anchor, repeat, after):
+    """
+    First occurrence of a reminder starting at `anchor` that falls after `after`, or None
+    for one-off reminders. Counted from the anchor, so a reminder on the 31st comes back
+    to the 31st after shorter months.
+    """
+    if repeat in _PERIODS:
+        period = _PERIODS[repeat]
+        steps = max((after - anchor) // period + 1, 1)
+        return anchor + steps * period
+    if repeat in _MONTHS:
+        step = _MONTHS[repeat]
+        months = max(((after.year - anchor.year) * 12 + after.month - anchor.month) // step * step, step)
+        candidate = add_months(anchor, months)
+        while candidate <= after:
+            months += step
+            candidate = add_months(anchor, months)
+        return candidate
+    return None
+
+
+def _notification_message(reminder):
+    return reminder.note or f"Reminder for {reminder.file.name}"
+
+
+class Dispatcher:
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, horizon=DEFAULT_HORIZON, refresh=DEFAULT_REFRESH):
+        self.batch_size = batch_size
+        self.horizon = horizon
+        self.refresh_interval = refresh
+        self.heap = []
+        # Latest known fire time per reminder; heap entries that disagree are stale
+        self.scheduled = {}
+        self.refreshed_at = None
+        self.truncated = False
+
+    def refresh(self, now, horizon=None):
+        """ Load the earliest reminders due before now + horizon through the next_fire_at index. """
+        horizon = self.horizon if horizon is None else horizon
+        upcoming = (
+            Reminder.objects.filter(next_fire_at__lte=now + horizon)
+            .order_by('next_fire_at')
+            .values_list('id', 'next_fire_at')[:MAX_LOADED]
+        )
+        self.heap = [(fire_at, pk) for pk, fire_at in upcoming]
+        self.scheduled = {pk: fire_at for fire_at, pk in self.heap}
+        self.truncated = len(self.heap) == MAX_LOADED
+        self.refreshed_at = now
+
+    def pop_due(self, now):
+        ids = []
+        while self.heap and self.heap[0][0] <= now and len(ids) < self.batch_size:
+            fire_at, pk = heapq.heappop(self.heap)
+            if self.scheduled.get(pk) == fire_at:
+                del self.scheduled[pk]
+                ids.append(pk)
+        return ids
+
+    def fire(self, ids, now):
+        """ Fire the reminders `ids` that are still due. Returns how many fired. """
+        with transaction.atomic():
+            reminders = list(
+                Reminder.objects.select_for_update(skip_locked=True, of=('self',))
+                .filter(id__in=ids, next_fire_at__lte=now)
+                .select_related('user', 'file')
+            )
+            notifications, emails = [], []
+            for reminder in reminders:
+                message = _notification_message(reminder)
+                notifications.append(Notification(
+                    user=reminder.user, kind=Notification.REMINDER, message=message,
+                    file=reminder.file, reminder=reminder, created_at=now,
+                ))
+                if reminder.user.email:
+                    emails.append(build_email(
+                        subject=f"Reminder: {reminder.file.name}",
+                        body=f"{message}\n\nFile: {reminder.file.name}",
+                        to=[reminder.user.email],
+                    ))
+                reminder.last_fired_at = now
+                reminder.next_fire_at = next_occurrence(reminder.remind_at, reminder.repeat, now)
+
+            Notification.objects.bulk_create(notifications)
+            OutboundEmail.objects.bulk_create(emails)
+            Reminder.objects.bulk_update(reminders, ['next_fire_at', 'last_fired_at'], batch_size=self.batch_size)
+            events.publish_many([
+                ([n.user_id], events.REMINDER, {'id': n.pk, 'message': n.message[:200], 'file': n.file_id})
+                for n in notifications
+            ])
+
+        for reminder in reminders:
+            if reminder.next_fire_at and reminder.next_fire_at <= now + self.horizon:
+                self.scheduled[reminder.pk] = reminder.next_fire_at
+                heapq.heappush(self.heap, (reminder.next_fire_at, reminder.pk))
+        return len(reminders)
+
+    def fire_due(self, now):
+        fired = 0
+        while ids := self.pop_due(now):
+            fired += self.fire(ids, now)
+        return fired
+
+    def run_once(self):
+        """ Fire everything due right now, for cron-style runs. """
+        now = timezone.now()
+        fired = 0
+        while True:
+            self.refresh(now, horizon=timedelta(0))
+            fired += self.fire_due(now)
+            if not self.truncated:
+                return fired
+
+    def run_forever(self, log=None):
+        while True:
+            now = timezone.now()
+            stale = self.refreshed_at is None or (now - self.refreshed_at).total_seconds() >= self.refresh_interval
+            if stale or (self.truncated and not self.heap):
+                self.refresh(now)
+            fired = self.fire_due(now)
+            if fired and log:
+                log(fired)
+
+            wake = self.refreshed_at + timedelta(seconds=self.refresh_interval)
+            if self.heap:
+                wake = min(wake, self.heap[0][0])
+            time.sleep(max((wake - timezone.now()).total_seconds(), 0.05))
@@ -0,0 +1,344 @@
+"""
+Thumbnails and previews, rendered after the first request and kept in a local disk cache.
+
+A rendition is a JPEG that fits in size x size pixels, for one of SIZES, stored as
+<RENDITION_CACHE_DIR>/<aa>/<sha256>-<size>.jpg. Blobs are content-addressed, so a
+rendition never goes stale and is served with immutable cache headers.
+
+Images are scaled with Pillow. PDFs have their first page rendered by `pdftoppm`
+(poppler-utils), and office documents use the thumbnail they embed, or else are
+converted by LibreOffice (`soffice`); without those tools installed the types
+simply have no rendition.
+
+Requests never render: a missing rendition is queued for a pool of
+RENDITION_WORKERS threads per process and the request gets QUEUED back, to answer
+404 until the image is there (with RENDITION_WORKERS = 0 it is rendered in the
+request, for tests). Each rendition is queued once per process. Content that fails
+to render is remembered as an empty file; a conversion that timed out is not, as a
+busy machine is the likelier cause, and is tried again after RETRY_AFTER seconds.
+
+The cache is trimmed least recently used first once it grows past
+RENDITION_CACHE_MAX_BYTES; serving a rendition refreshes its mtime.
+"""
+import io
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .sniffing import sniff
+
+
+logger = logging.getLogger(__name__)
+
+SIZES = (64, 256, 1024)
+THUMBNAIL_SIZE = 64
+JPEG_QUALITY = 80
+MAX_CONCURRENT_RENDERS = 2
+# Seconds a conversion tool may run, and before one that ran out of time is tried again
+RENDER_TIMEOUT = 60
+RETRY_AFTER = 10 * 60
+# A cache hit only rewrites the file's mtime this often
+TOUCH_INTERVAL = 60 * 60
+# Eviction trims the cache to this share of its limit, so it doesn't run on every write
+EVICT_TO = 0.9
+
+IMAGE_TYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/bmp', 'image/tiff', 'image/webp'}
+PDF_TYPE = 'application/pdf'
+OFFICE_TYPES = {
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'application/vnd.oasis.opendocument.text',
+    'application/vnd.oasis.opendocument.spreadsheet',
+    'application/vnd.oasis.opendocument.presentation',
+    'application/x-ole-storage',
+    'application/rtf',
+}
+# File types the listings offer a thumbnail for, before the content has been looked at
+EXTENSIONS = {
+    'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tif', 'tiff', 'webp', 'pdf',
+    'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'odt', 'ods', 'odp', 'rtf',
+}
+# Previews office formats store alongside the document
+EMBEDDED_THUMBNAILS = ('docProps/thumbnail.jpeg', 'docProps/thumbnail.jpg', 'Thumbnails/thumbnail.png')
+
+
+# open_rendition(): the rendition is being rendered in the background
+QUEUED = 'queued'
+
+
+def cache_dir():
+    return settings.RENDITION_CACHE_DIR
+
+
+def max_bytes():
+    return settings.RENDITION_CACHE_MAX_BYTES
+
+
+def workers():
+    return getattr(settings, 'RENDITION_WORKERS', MAX_CONCURRENT_RENDERS)
+
+
+def has_rendition(file_type):
+    return (file_type or '').lower() in EXTENSIONS
+
+
+def _path(sha256, size):
+    return os.path.join(cache_dir(), sha256[:2], f"{sha256}-{size}.jpg")
+
+
+# Rendering
+
+def _scale_image(source, size):
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        # JPEGs decode straight at a reduced scale
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode in ('RGBA', 'LA', 'P', 'PA'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def _local_file(blob, work_dir, extension):
+    """ A filesystem path with `blob`'s content, for the command line tools. """
+    path = os.path.join(work_dir, f"source.{extension}")
+    try:
+        os.symlink(blob.file.path, path)
+    except NotImplementedError:
+        # Remote storage
+        with blob.file.open('rb') as content, open(path, 'wb') as copy:
+            shutil.copyfileobj(content, copy)
+    return path
+
+
+def _render_pdf(path, size, work_dir):
+    if shutil.which('pdftoppm') is None:
+        return None
+    output = os.path.join(work_dir, 'page')
+    subprocess.run(
+        ['pdftoppm', '-f', '1', '-l', '1', '-singlefile', '-scale-to', str(size),
+         '-jpeg', '-jpegopt', f'quality={JPEG_QUALITY}', path, output],
+        check=True, capture_output=True, timeout=RENDER_TIMEOUT,
+    )
+    with open(f"{output}.jpg", 'rb') as page:
+        return page.read()
+
+
+def _embedded_thumbnail(blob):
+    with blob.file.open('rb') as content:
+        try:
+            with zipfile.ZipFile(content) as archive:
+                names = set(archive.namelist())
+                for name in EMBEDDED_THUMBNAILS:
+                    if name in names:
+                        return archive.read(name)
+        except zipfile.BadZipFile:
+            pass
+    return None
+
+
+def _render_office(blob, size, extension, work_dir):
+    embedded = _embedded_thumbnail(blob)
+    if embedded:
+        return _scale_image(io.BytesIO(embedded), size)
+    soffice = shutil.which('soffice') or shutil.which('libreoffice')
+    if soffice is None or shutil.which('pdftoppm') is None:
+        return None
+    source = _local_file(blob, work_dir, extension)
+    subprocess.run(
+        [soffice, '--headless', '--norestore', f'-env:UserInstallation=file://{work_dir}/profile',
+         '--convert-to', 'pdf', '--outdir', work_dir, source],
+        check=True, capture_output=True, timeout=RENDER_TIMEOUT,
+    )
+    return _render_pdf(os.path.join(work_dir, 'source.pdf'), size, work_dir)
+
+
+def render(blob, size, extension=''):
+    """
+    JPEG bytes of `blob` scaled to fit `size`, or None when its type has no renderer
+    here. Raises when the content is broken.
+    """
+    mime_type = blob.mime_type
+    if not mime_type:
+        with blob.file.open('rb') as content:
+            mime_type = sniff(content)
+    if mime_type in IMAGE_TYPES:
+        with blob.file.open('rb') as content:
+            return _scale_image(content, size)
+    if mime_type != PDF_TYPE and mime_type not in OFFICE_TYPES:
+        return None
+    with tempfile.TemporaryDirectory(prefix='rendition-') as work_dir:
+        if mime_type == PDF_TYPE:
+            return _render_pdf(_local_file(blob, work_dir, 'pdf'), size, work_dir)
+        return _render_office(blob, size, extension or 'bin', work_dir)
+
+
+# Disk cache
+
+_renders = threading.BoundedSemaphore(MAX_CONCURRENT_RENDERS)
+_in_flight = {}  # path: Lock held while it is rendered
+_in_flight_lock = threading.Lock()
+_queued = set()  # paths waiting for or being rendered by the pool
+_retry_at = {}  # path: time.monotonic() after which a render that timed out is tried again
+_pool = None
+_usage = None  # bytes in the cache as this process last counted them
+_usage_lock = threading.Lock()
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Readers in other processes only ever see complete files
+    fd, partial = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    with os.fdopen(fd, 'wb') as output:
+        output.write(data)
+    os.replace(partial, path)
+
+
+def _entries():
+    for directory, _, names in os.walk(cache_dir()):
+        for name in names:
+            if name.endswith('.part'):
+                continue  # still being written
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+
+def evict(limit=None):
+    """ Delete least recently used renditions until the cache fits. Returns the bytes freed. """
+    global _usage
+    limit = max_bytes() if limit is None else limit
+    entries = sorted(_entries())
+    total = sum(size for _, size, _ in entries)
+    freed = 0
+    target = limit * EVICT_TO
+    for _, size, path in entries:
+        if total - freed <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        freed += size
+    with _usage_lock:
+        _usage = total - freed
+    return freed
+
+
+def _added(size):
+    global _usage
+    with _usage_lock:
+        if _usage is None:
+            _usage = sum(entry_size for _, entry_size, _ in _entries())
+        _usage += size
+        full = _usage > max_bytes()
+    if full:
+        evict()
+
+
+def _cached(path):
+    """ The open rendition at `path`, None if it isn't cached, or False if it failed to render. """
+    try:
+        rendition = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    stat = os.fstat(rendition.fileno())
+    if stat.st_size == 0:
+        rendition.close()
+        return False
+    if time.time() - stat.st_mtime > TOUCH_INTERVAL:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # evicted meanwhile; the open file stays readable
+    return rendition
+
+
+def _executor():
+    global _pool
+    with _in_flight_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=workers(), thread_name_prefix='rendition')
+        return _pool
+
+
+def _render_into_cache(path, blob, size, extension):
+    """ Render `blob` to `path` unless another thread did first. Returns _cached(path). """
+    with _in_flight_lock:
+        lock = _in_flight.setdefault(path, threading.Lock())
+    with lock:
+        # Someone else may have rendered it while we waited
+        rendition = _cached(path)
+        if rendition is None:
+            try:
+                with _renders:
+                    data = render(blob, size, extension)
+            except subprocess.TimeoutExpired:
+                logger.warning("Rendering blob %s at %s timed out", blob.sha256, size)
+                _retry_at[path] = time.monotonic() + RETRY_AFTER
+                data = None
+            except Exception:
+                logger.warning("Could not render blob %s at %s", blob.sha256, size, exc_info=True)
+                data = b''
+            # None: no renderer for the type here, so try again once one is installed
+            if data is not None:
+                _write(path, data)
+                _added(len(data))
+                rendition = _cached(path)
+        with _in_flight_lock:
+            _in_flight.pop(path, None)
+    return rendition
+
+
+def _render_queued(path, blob, size, extension):
+    try:
+        rendition = _render_into_cache(path, blob, size, extension)
+        if rendition:
+            rendition.close()
+    finally:
+        with _in_flight_lock:
+            _queued.discard(path)
+
+
+def open_rendition(blob, size, extension=''):
+    """
+    The rendition of `blob` at `size` as an open binary file, None when there is none,
+    or QUEUED when it has been queued for rendering; ask again later.
+    """
+    path = _path(blob.sha256, size)
+    rendition = _cached(path)
+    if rendition is not None:
+        return rendition or None
+    if _retry_at.get(path, 0) > time.monotonic():
+        return None
+    _retry_at.pop(path, None)
+
+    if workers() < 1:
+        return _render_into_cache(path, blob, size, extension) or None
+    with _in_flight_lock:
+        queue = path not in _queued
+        _queued.add(path)
+    if queue:
+        _executor().submit(_render_queued, path, blob, size, extension)
+    return QUEUED
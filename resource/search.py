@@ -0,0 +1,179 @@
+"""
+Full-text search over file names, categories, tags and extracted body text.
+
+PostgreSQL keeps a weighted tsvector per file in SearchDocument.search_vector behind
+a GIN index. SQLite (the default settings.DATABASES) uses the resource_search_fts
+FTS5 table, keyed by the file id. Both are updated one file at a time whenever a
+file is uploaded, renamed, re-tagged or gets new content, and for a whole category
+at once when it is renamed, so queries never scan the files table.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import AccessGrant, ExtractedText, SearchDocument, UploadedFile
+
+
+FTS_TABLE = "resource_search_fts"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _vendor():
+    return connection.vendor
+
+
+def _fields(uploaded_file):
+    tags = " ".join(tag.name for tag in uploaded_file.meta_tags.all())
+    category = uploaded_file.category.name if uploaded_file.category and uploaded_file.category.name else ""
+    return uploaded_file.name, category, tags
+
+
+def index_file(file_id):
+    """ (Re)build the search entry of one file from its name, category, tags and the text of its current content. """
+    uploaded_file = (
+        UploadedFile.objects.select_related("category", "search_document")
+        .prefetch_related("meta_tags")
+        .filter(pk=file_id)
+        .first()
+    )
+    if uploaded_file is None:
+        remove_file(file_id)
+        return
+
+    name, category, tags = _fields(uploaded_file)
+    body = (
+        ExtractedText.objects.filter(blob_id=uploaded_file.blob_id, status=ExtractedText.DONE)
+        .values_list("text", flat=True)
+        .first()
+    ) or ""
+    document, created = SearchDocument.objects.get_or_create(file=uploaded_file, defaults={"body": body})
+    if not created and document.body != body:
+        document.body = body
+        document.save(update_fields=["body", "updated_at"])
+
+    if _vendor() == "postgresql":
+        SearchDocument.objects.filter(pk=document.pk).update(
+            search_vector=(
+                SearchVector(Value(name), weight="A")
+                + SearchVector(Value(f"{tags} {category}"), weight="B")
+                + SearchVector("body", weight="C")
+            )
+        )
+    elif _vendor() == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [uploaded_file.pk])
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, category, tags, body) VALUES (%s, %s, %s, %s, %s)",
+                [uploaded_file.pk, name, category, tags, document.body],
+            )
+
+
+def rename_category(category_id, name):
+    """
+    Give every file in the category its new category name in the search index, with one
+    statement rather than one index_file() per file.
+    """
+    if _vendor() == "postgresql":
+        # The vector index_file() builds, with the tags gathered per file
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE resource_searchdocument d SET search_vector =
+                    setweight(to_tsvector(COALESCE(f.name, '')), 'A')
+                    || setweight(to_tsvector(COALESCE(t.tags, '') || ' ' || %s), 'B')
+                    || setweight(to_tsvector(COALESCE(d.body, '')), 'C')
+                FROM resource_uploadedfile f
+                LEFT JOIN (
+                    SELECT ft.uploadedfile_id, string_agg(tag.name, ' ') AS tags
+                    FROM resource_uploadedfile_meta_tags ft
+                    JOIN resource_tag tag ON tag.id = ft.tag_id
+                    JOIN resource_uploadedfile tagged ON tagged.id = ft.uploadedfile_id
+                    WHERE tagged.category_id = %s
+                    GROUP BY ft.uploadedfile_id
+                ) t ON t.uploadedfile_id = f.id
+                WHERE d.file_id = f.id AND f.category_id = %s
+                """,
+                [name or "", category_id, category_id],
+            )
+    elif _vendor() == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {FTS_TABLE} SET category = %s WHERE rowid IN (SELECT id FROM resource_uploadedfile WHERE category_id = %s)",
+                [name or "", category_id],
+            )
+
+
+def remove_file(file_id):
+    # PostgreSQL entries go with the SearchDocument row through the cascade
+    if _vendor() == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [file_id])
+
+
+def remove_files(file_ids):
+    """ remove_file for many files in one statement. """
+    file_ids = list(file_ids)
+    if file_ids and _vendor() == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(file_ids))})", file_ids)
+
+
+def _fts5_query(text):
+    """ Every word as a quoted prefix term, so user input can never be FTS5 syntax. """
+    return " ".join(f'"{token}"*' for token in _TOKEN_RE.findall(text))
+
+
+def search_files(text, user, limit=50):
+    """ Files visible to `user` matching `text`, best match first. """
+    if _vendor() == "postgresql":
+        query = SearchQuery(text, search_type="websearch")
+        return list(
+            UploadedFile.objects.visible_to(user).for_listing()
+            .filter(search_document__search_vector=query)
+            .annotate(rank=SearchRank(F("search_document__search_vector"), query))
+            .order_by("-rank", "-uploaded_at")[:limit]
+        )
+
+    if _vendor() == "sqlite":
+        match = _fts5_query(text)
+        if not match:
+            return []
+        with connection.cursor() as cursor:
+            # bm25 weights follow the column order: name, category, tags, body
+            cursor.execute(
+                f"""
+                SELECT f.id FROM {FTS_TABLE}
+                JOIN resource_uploadedfile f ON f.id = {FTS_TABLE}.rowid
+                WHERE {FTS_TABLE} MATCH %s AND EXISTS (
+                    SELECT 1 FROM resource_accessgrant g WHERE g.file_id = f.id AND g.grantee IN (%s, %s)
+                )
+                ORDER BY bm25({FTS_TABLE}, 10.0, 4.0, 4.0, 1.0)
+                LIMIT %s
+                """,
+                [match, AccessGrant.EVERYONE, user.pk or AccessGrant.EVERYONE, limit],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        files = UploadedFile.objects.for_listing().in_bulk(ids)
+        return [files[pk] for pk in ids if pk in files]
+
+    return list(
+        UploadedFile.objects.visible_to(user).for_listing()
+        .filter(name__icontains=text)
+        .order_by("-uploaded_at")[:limit]
+    )
+
+
+def search_filter(text):
+    """ A filter matching `text`, for UploadedFile querysets that aggregate over search results. """
+    if _vendor() == "postgresql":
+        return Q(search_document__search_vector=SearchQuery(text, search_type="websearch"))
+    if _vendor() == "sqlite":
+        match = _fts5_query(text)
+        if not match:
+            return Q(pk__in=[])
+        return Q(pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match]))
+    return Q(name__icontains=text)
@@ -1,25 +1,31 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import Category, UploadedFile, Folder, FileSharing, Tag, FileVersion, Reminder
+from .models import Category, UploadedFile, Folder, FileSharing, Tag, FileVersion, Reminder, UploadSession, OutboundEmail, Notification
+from django.urls import reverse
+from . import refdata, renditions
 
 User = get_user_model()
 
 class FolderSerializer(serializers.ModelSerializer):
     created_at = serializers.DateTimeField(read_only=True)
-    subfolders = serializers.SerializerMethodField()
-    files = serializers.SerializerMethodField()
+    subfolder_count = serializers.SerializerMethodField()
+    file_count = serializers.SerializerMethodField()
     owner_email = serializers.SerializerMethodField()
     owner_first_name = serializers.SerializerMethodField()
 
     class Meta:
         model = Folder
-        fields = ['id', 'name', 'parent', 'created_at', 'subfolders', 'files', 'is_starred', 'owner_email', 'owner_first_name']
+        fields = ['id', 'name', 'parent', 'created_at', 'subfolder_count', 'file_count', 'is_starred', 'owner_email', 'owner_first_name', 'tree_bytes', 'tree_files']
+        read_only_fields = ['tree_bytes', 'tree_files']
 
-    def get_subfolders(self, obj):
-        return FolderSerializer(obj.subfolders.all(), many=True).data
+    # Counts come from Folder.objects.with_child_counts() on listings; fall back to a query otherwise
+    def get_subfolder_count(self, obj):
+        count = getattr(obj, 'subfolder_count', None)
+        return count if count is not None else obj.subfolders.count()
 
-    def get_files(self, obj):
-        return UploadedFileSerializer(obj.files.all(), many=True).data
+    def get_file_count(self, obj):
+        count = getattr(obj, 'file_count', None)
+        return count if count is not None else obj.files.count()
 
     def get_owner_email(self, obj):
         if obj.owner:
@@ -45,13 +51,12 @@ class TagSerializer(serializers.ModelSerializer):
 
 class UploadedFileSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)  # Nested representation
-    category_id = serializers.PrimaryKeyRelatedField(
-        queryset=Category.objects.all(), source="category", write_only=True
-    )  # Accept category ID in requests
+    category_id = serializers.IntegerField(write_only=True)  # Accept category ID in requests
     
     owner_email = serializers.SerializerMethodField()
     owner_first_name = serializers.SerializerMethodField()
     is_owner = serializers.SerializerMethodField()
+    thumbnail_url = serializers.SerializerMethodField()
 
     meta_tags = TagSerializer(many=True, read_only=True)
     meta_tag_names = serializers.ListField(
@@ -60,7 +65,9 @@ class UploadedFileSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = UploadedFile
-        fields = ["id", "name", "file", "file_type", "file_size", "category", "category_id", "uploaded_at", 'folder', 'is_starred', 'is_archived', 'is_public', 'owner_email',  'owner_first_name', 'meta_tags', 'meta_tag_names', 'is_owner']
+        fields = ["id", "name", "file", "file_type", "file_size", "category", "category_id", "uploaded_at", 'folder', 'is_starred', 'is_archived', 'is_public', 'owner_email',  'owner_first_name', 'meta_tags', 'meta_tag_names', 'is_owner', 'thumbnail_url']
+        # Content changes go through uploads and versions so the blob reference stays in step
+        read_only_fields = ["file"]
 
     def get_owner_email(self, obj):
         if obj.owner:
@@ -76,25 +83,36 @@ class UploadedFileSerializer(serializers.ModelSerializer):
         request = self.context.get("request")
         if not request or not request.user.is_authenticated:
             return False
-        return obj.owner == request.user     
+        return obj.owner_id == request.user.id
+
+    def get_thumbnail_url(self, obj):
+        # Decided from the extension so listings don't need the blob row
+        if obj.blob_id and renditions.has_rendition(obj.file_type):
+            return reverse("rendition", args=[obj.blob_id, renditions.THUMBNAIL_SIZE])
+        return None
+
+    def validate_category_id(self, value):
+        # Checked against the reference-data cache rather than with a query
+        if value not in refdata.snapshot().category_ids:
+            raise serializers.ValidationError(f'Invalid pk "{value}" - object does not exist.')
+        return value
 
     def create(self, validated_data):
-        tag_names = validated_data.pop('meta_tag_names', [])
+        tag_names = validated_data.pop('meta_tag_names', None)
         instance = super().create(validated_data)
         self._handle_tags(instance, tag_names)
         return instance
 
     def update(self, instance, validated_data):
-        tag_names = validated_data.pop('meta_tag_names', [])
+        tag_names = validated_data.pop('meta_tag_names', None)
         instance = super().update(instance, validated_data)
         self._handle_tags(instance, tag_names)
         return instance
 
     def _handle_tags(self, instance, tag_names):
-        instance.meta_tags.clear()
-        for name in tag_names:
-            tag, _ = Tag.objects.get_or_create(name=name.strip())
-            instance.meta_tags.add(tag)
+        # Leave the tags alone unless the request sent them
+        if tag_names is not None:
+            instance.set_tags(refdata.tag_ids(tag_names))
 
 
 class FileSharingSerializer(serializers.ModelSerializer):
@@ -115,6 +133,24 @@ class FileSharingSerializer(serializers.ModelSerializer):
         return data
     
 
+class BulkShareSerializer(serializers.Serializer):
+    id = serializers.IntegerField(required=False)  # single file, as sent by the share dialog
+    file_ids = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    folder_ids = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    emails = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+    message = serializers.CharField(required=False, allow_blank=True, default="")
+
+    def validate(self, data):
+        if data.get('id'):
+            data['file_ids'] = [data.pop('id'), *data['file_ids']]
+        if not data['file_ids'] and not data['folder_ids']:
+            raise serializers.ValidationError("At least one file or folder is required.")
+        # Duplicates would only repeat work, keep first-seen order for the response
+        for key in ('file_ids', 'folder_ids', 'emails'):
+            data[key] = list(dict.fromkeys(data[key]))
+        return data
+
+
 class EmailShareSerializer(serializers.Serializer):
     recipients = serializers.ListField(
         child=serializers.EmailField(),
@@ -124,6 +160,14 @@ class EmailShareSerializer(serializers.Serializer):
     file_id = serializers.IntegerField()
 
 
+class OutboundEmailSerializer(serializers.ModelSerializer):
+    delivery_id = serializers.UUIDField(source='id', read_only=True)
+
+    class Meta:
+        model = OutboundEmail
+        fields = ['delivery_id', 'status', 'to', 'attempts', 'next_attempt_at', 'last_error', 'created_at', 'sent_at']
+
+
 class FileVersionSerializer(serializers.ModelSerializer):
     uploaded_by_name = serializers.SerializerMethodField()
     uploaded_file_url = serializers.SerializerMethodField()
@@ -151,4 +195,24 @@ class ReminderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Reminder
-        fields = ['id', 'file', 'note', 'remind_at', 'repeat', 'repeat_display']    
\ No newline at end of file
+        fields = ['id', 'file', 'note', 'remind_at', 'repeat', 'repeat_display', 'next_fire_at', 'last_fired_at']
+        read_only_fields = ['next_fire_at', 'last_fired_at']
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    file_name = serializers.CharField(source='file.name', read_only=True, default=None)
+
+    class Meta:
+        model = Notification
+        fields = ['id', 'kind', 'message', 'file', 'file_name', 'reminder', 'created_at', 'read_at']
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'file_name', 'total_size', 'received', 'status',
+            'folder', 'category', 'is_public', 'target_file', 'change_note',
+            'result_file', 'expected_sha256', 'sha256', 'created_at', 'expires_at',
+        ]
+        read_only_fields = ['received', 'status', 'result_file', 'sha256', 'created_at', 'expires_at']
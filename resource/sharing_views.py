@@ -1,3 +1,5 @@
+from collections import Counter
+
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
@@ -5,89 +7,139 @@ from rest_framework.response import Response
 from rest_framework import status
 from django.contrib.auth.models import User
 from django.shortcuts import get_object_or_404
-from django.db import IntegrityError
-from django.utils import timezone
-from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import Q
 from django.conf import settings
 from django.template.loader import render_to_string
+from django.urls import reverse
 from datetime import datetime
 from django.utils.html import strip_tags
 
 
-from .models import UploadedFile, FileSharing 
-from .serializers import FileSharingSerializer, EmailShareSerializer
+from .models import AccessGrant, UploadedFile, Folder, FileSharing, OutboundEmail, ShareCounter
+from .serializers import FileSharingSerializer, BulkShareSerializer, EmailShareSerializer, OutboundEmailSerializer
+from . import events, facets
+from .mail import queue_email
+from .pagination import InvalidCursor, paginate_request
 
 class ShareItemView(APIView):
+    """
+    Share any number of files and folders with any number of people in one request.
+
+    Recipients are resolved with one query and all FileSharing rows go in with one
+    bulk_create; pairs that already exist are left alone by the unique constraints.
+    The response reports per recipient which items were newly shared.
+    """
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        file_id = request.data.get("id")
-        emails = request.data.get("emails", [])
-        message = request.data.get("message", "")
-
-        if not file_id or not emails:
-            return Response({"error": "File ID and recipient emails are required."}, status=status.HTTP_400_BAD_REQUEST)
-
-        file = get_object_or_404(UploadedFile, id=file_id)
-        if file.owner != request.user:
+        serializer = BulkShareSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({"error": "File ID and recipient emails are required.", "details": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        items = [
+            (FileSharing.FILE, pk, owner_id)
+            for pk, owner_id in UploadedFile.objects.filter(id__in=data['file_ids']).values_list('id', 'owner_id')
+        ] + [
+            (FileSharing.FOLDER, pk, owner_id)
+            for pk, owner_id in Folder.objects.filter(id__in=data['folder_ids']).values_list('id', 'owner_id')
+        ]
+        if len(items) != len(data['file_ids']) + len(data['folder_ids']):
+            return Response({"error": "Some files or folders do not exist."}, status=status.HTTP_404_NOT_FOUND)
+        if any(owner_id != request.user.id for _, _, owner_id in items):
             return Response({"error": "You do not own this file."}, status=status.HTTP_403_FORBIDDEN)
 
-        shared = []
-        errors = []
-
-        for email in emails:
-            try:
-                recipient = User.objects.get(email=email)
-
-                share, created = FileSharing.objects.get_or_create(
-                    file=file,
+        recipients = {}
+        for user in User.objects.filter(email__in=data['emails']).only('id', 'email'):
+            recipients.setdefault(user.email, user)
+
+        existing = set(
+            FileSharing.objects.filter(shared_to__in=recipients.values())
+            .filter(Q(file_id__in=data['file_ids']) | Q(folder_id__in=data['folder_ids']))
+            .values_list('share_type', 'file_id', 'folder_id', 'shared_to_id')
+        )
+
+        new_shares = []
+        for email in data['emails']:
+            recipient = recipients.get(email)
+            if recipient is None:
+                continue
+            for share_type, pk, _ in items:
+                file_id, folder_id = (pk, None) if share_type == FileSharing.FILE else (None, pk)
+                if (share_type, file_id, folder_id, recipient.id) in existing:
+                    continue
+                new_shares.append(FileSharing(
+                    file_id=file_id,
+                    folder_id=folder_id,
+                    share_type=share_type,
+                    shared_by=request.user,
                     shared_to=recipient,
-                    defaults={
-                        'shared_by': request.user,
-                        'message': message,
-                        'share_type': FileSharing.FILE,
-                        'shared_at': timezone.now()
-                    }
-                )
-                if created:
-                    shared.append(email)
-                else:
-                    errors.append(f"{email} already has access.")
-            except User.DoesNotExist:
-                errors.append(f"No user found with email {email}.")
-            except IntegrityError:
-                errors.append(f"{email} already shared.")
-            except Exception as e:
-                errors.append(f"{email}: {str(e)}")
-
+                    message=data['message'],
+                ))
+
+        with transaction.atomic():
+            # A concurrent request may have shared some pairs since the lookup above
+            created = FileSharing.objects.create_new(new_shares)
+            AccessGrant.objects.grant_shares(created)
+            ShareCounter.objects.add(created)
+            events.shares_created(created)
+            # bulk_create sends no signals; the recipients can see more files now
+            facets.changed()
+
+        per_recipient = Counter(share.shared_to_id for share in created)
+        results = []
+        for email in data['emails']:
+            recipient = recipients.get(email)
+            if recipient is None:
+                results.append({"email": email, "status": "not_found", "shared": 0})
+                continue
+            count = per_recipient[recipient.id]
+            results.append({"email": email, "status": "shared" if count else "already_shared", "shared": count})
+
+        shared = [r["email"] for r in results if r["status"] == "shared"]
+        errors = [
+            f"No user found with email {r['email']}." if r["status"] == "not_found" else f"{r['email']} already has access."
+            for r in results if r["status"] != "shared"
+        ]
         return Response({
             "message": f"Shared with: {shared}",
             "errors": errors,
+            "results": results,
         }, status=status.HTTP_207_MULTI_STATUS if errors else status.HTTP_201_CREATED)
 
 
-
 class SharedWithMeView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        shares = FileSharing.objects.filter(shared_to=request.user, share_type=FileSharing.FILE).select_related('file', 'shared_by').order_by('-shared_at') 
+        shares = (
+            FileSharing.objects.filter(shared_to=request.user, share_type=FileSharing.FILE)
+            .select_related('file__owner', 'file__category', 'shared_by')
+            .prefetch_related('file__meta_tags')
+        )
+        try:
+            shares, next_cursor = paginate_request(shares, request, 'shared_at')
+        except InvalidCursor as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         serializer = FileSharingSerializer(shares, many=True, context={'request': request})
-        return Response({"files": serializer.data}, status=status.HTTP_200_OK)
+        return Response({"files": serializer.data, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
 
 
 # views.py
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def shared_unseen_count(request):
-    count = FileSharing.objects.filter(shared_to=request.user, is_seen=False, share_type=FileSharing.FILE).count()
-    return Response({'count': count})
+    return Response({'count': ShareCounter.objects.unseen(request.user)})
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def mark_shared_as_seen(request):
-    FileSharing.objects.filter(shared_to=request.user, is_seen=False).update(is_seen=True)
+    with transaction.atomic():
+        # Nothing to mark when the counter is already at zero, which is the usual case
+        if ShareCounter.objects.clear(request.user.pk):
+            FileSharing.objects.filter(shared_to=request.user, is_seen=False).update(is_seen=True)
     return Response({'status': 'marked_as_seen'})
 
 
@@ -104,43 +156,41 @@ class SendFileEmailView(APIView):
 
             try:
                 file_instance = UploadedFile.objects.get(id=file_id)
-                file_url = request.build_absolute_uri(file_instance.file.url)
-
-                subject = "A file has been shared with you"
-                sender_email = request.user.email if request.user.is_authenticated else settings.DEFAULT_FROM_EMAIL
-
-                context = {
-                    'message': message,
-                    'download_url': file_url,
-                    'sender': sender_email,  # or name
-                    'current_year': datetime.now().year,
-                }
-
-              
-                html_content = render_to_string("email_template.html", context)
-                plain_text = strip_tags(html_content)
-
-
-                # text_content = f"{message}\n\nDownload here: {file_url}\n\nSent by: {sender_email}"
-
-                email = EmailMultiAlternatives(
-                    subject=subject,
-                    body=plain_text,
-                    from_email="MinT <passengerlunar@gmail.com>",  
-                    to=recipients,
-                    reply_to=[sender_email] 
-                )
-                email.attach_alternative(html_content, "text/html")
-                email.send()
-
-                return Response({'success': 'Email sent successfully!'}, status=status.HTTP_200_OK)
-
             except UploadedFile.DoesNotExist:
                 return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
-            except Exception as e:
-                return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+            file_url = request.build_absolute_uri(file_instance.file.url)
+            sender_email = request.user.email if request.user.is_authenticated else settings.DEFAULT_FROM_EMAIL
+
+            context = {
+                'message': message,
+                'download_url': file_url,
+                'sender': sender_email,  # or name
+                'current_year': datetime.now().year,
+            }
+
+            html_content = render_to_string("email_template.html", context)
+            plain_text = strip_tags(html_content)
+
+            # Delivered by `manage.py send_queued_mail`; the client polls the status URL
+            delivery = queue_email(
+                subject="A file has been shared with you",
+                body=plain_text,
+                html_body=html_content,
+                from_email="MinT <passengerlunar@gmail.com>",
+                to=recipients,
+                reply_to=[sender_email],
+                created_by=request.user,
+            )
+            data = OutboundEmailSerializer(delivery).data
+            data['status_url'] = reverse('email-delivery', args=[delivery.id])
+            return Response(data, status=status.HTTP_202_ACCEPTED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-        
\ No newline at end of file
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def email_delivery_status(request, delivery_id):
+    delivery = get_object_or_404(OutboundEmail, id=delivery_id, created_by=request.user)
+    return Response(OutboundEmailSerializer(delivery).data)
@@ -0,0 +1,127 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import events, extraction, facets, refdata, search
+from .models import AccessGrant, Blob, Category, FileSharing, FileVersion, Folder, ShareCounter, StorageUsage, Tag, UploadedFile, bulk_accounted
+
+# Saves that don't touch these leave the search entry as it is (stars, archive, seen flags)
+SEARCHED_FIELDS = {'name', 'category', 'file', 'blob'}
+
+
+@receiver(post_delete, sender=UploadedFile)
+@receiver(post_delete, sender=FileVersion)
+def release_blob(sender, instance, origin=None, **kwargs):
+    """ Drop the deleted row's blob reference, including rows removed by cascades. """
+    if instance.blob_id and not bulk_accounted(origin):
+        Blob.objects.release(instance.blob_id)
+
+
+@receiver(pre_delete, sender=UploadedFile)
+def uncharge_deleted_file(sender, instance, origin=None, **kwargs):
+    if bulk_accounted(origin):
+        return
+    # Its versions un-charge themselves, also when they go with it
+    StorageUsage.objects.charge([(instance.owner_id, instance.folder_id, -(instance.file_size or 0), 0, -1)])
+
+
+@receiver(pre_delete, sender=FileVersion)
+def uncharge_deleted_version(sender, instance, origin=None, **kwargs):
+    if instance.file_size and not bulk_accounted(origin):
+        uploaded_file = instance.uploaded_file
+        StorageUsage.objects.charge([(uploaded_file.owner_id, uploaded_file.folder_id, 0, -instance.file_size, 0)])
+
+
+@receiver(post_save, sender=UploadedFile)
+def index_saved_file(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not SEARCHED_FIELDS.intersection(update_fields):
+        return
+    transaction.on_commit(lambda: search.index_file(instance.pk))
+
+
+@receiver(m2m_changed, sender=UploadedFile.meta_tags.through)
+def index_retagged_file(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, UploadedFile):
+        transaction.on_commit(lambda: search.index_file(instance.pk))
+
+
+@receiver(post_save, sender=Category)
+def index_category_files(sender, instance, created, **kwargs):
+    # Runs inside save(), so _stored_name is still the name before it
+    if created or instance.name == instance._stored_name:
+        return
+    transaction.on_commit(lambda: search.rename_category(instance.pk, instance.name))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def reload_reference_data(sender, **kwargs):
+    refdata.changed()
+
+
+@receiver(post_delete, sender=UploadedFile)
+def unindex_file(sender, instance, origin=None, **kwargs):
+    if not bulk_accounted(origin):
+        search.remove_file(instance.pk)
+
+
+@receiver(post_save, sender=UploadedFile)
+@receiver(post_save, sender=FileVersion)
+def queue_text_extraction(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'blob' in update_fields:
+        extraction.queue_blob(instance.blob_id, instance.file_type)
+
+
+@receiver(post_save, sender=FileSharing)
+def grant_share(sender, instance, created, **kwargs):
+    # Bulk sharing bypasses save() and calls grant_shares itself
+    if created:
+        AccessGrant.objects.grant_shares([instance])
+        ShareCounter.objects.add([instance])
+        events.shares_created([instance])
+
+
+@receiver(post_delete, sender=FileSharing)
+def revoke_share(sender, instance, **kwargs):
+    AccessGrant.objects.revoke_share(instance)
+    if instance.share_type == FileSharing.FILE and not instance.is_seen:
+        ShareCounter.objects.subtract(instance.shared_to_id)
+
+
+@receiver(post_save, sender=UploadedFile)
+def push_saved_file(sender, instance, created, **kwargs):
+    files = [(instance.pk, instance.folder_id)]
+    action = 'created' if created else 'updated'
+    transaction.on_commit(lambda: events.files_changed(files, action))
+
+
+@receiver(pre_delete, sender=UploadedFile)
+def push_deleted_file(sender, instance, origin=None, **kwargs):
+    if bulk_accounted(origin):
+        return
+    # Look the audience up while the file's grants still exist
+    files = [(instance.pk, instance.folder_id)]
+    grantees = events.file_grantees([instance.pk])
+    transaction.on_commit(lambda: events.files_changed(files, 'deleted', grantees))
+
+
+@receiver(post_save, sender=UploadedFile)
+@receiver(post_save, sender=Folder)
+def expire_facets_on_save(sender, instance, **kwargs):
+    # Starring, renaming a folder and other saves the counts don't depend on keep them cached
+    if instance._facets_changed:
+        facets.changed()
+
+
+@receiver(post_delete, sender=UploadedFile)
+@receiver(post_delete, sender=Folder)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=FileSharing)
+@receiver(post_delete, sender=FileSharing)
+@receiver(m2m_changed, sender=UploadedFile.meta_tags.through)
+def expire_facets(sender, **kwargs):
+    if kwargs.get('action', 'post_').startswith('post_'):
+        facets.changed()
@@ -0,0 +1,82 @@
+"""
+MIME type detection from a file's leading bytes, so the stored type reflects the
+content rather than whatever extension the upload was given.
+"""
+import zipfile
+
+HEAD_SIZE = 2048
+
+# (offset, signature, mime type), checked in order
+SIGNATURES = [
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'BM', 'image/bmp'),
+    (0, b'II*\x00', 'image/tiff'),
+    (0, b'MM\x00*', 'image/tiff'),
+    (8, b'WEBP', 'image/webp'),
+    (0, b'{\\rtf', 'application/rtf'),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/x-ole-storage'),  # legacy .doc/.xls/.ppt
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (0, b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (0, b'Rar!\x1a\x07', 'application/vnd.rar'),
+    (4, b'ftyp', 'video/mp4'),
+    (0, b'ID3', 'audio/mpeg'),
+]
+
+# Office Open XML and OpenDocument are ZIPs told apart by their members
+ZIP_MEMBERS = [
+    ('word/', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+    ('xl/', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    ('ppt/', 'application/vnd.openxmlformats-officedocument.presentationml.presentation'),
+]
+
+
+def _zip_type(file):
+    try:
+        file.seek(0)
+        with zipfile.ZipFile(file) as archive:
+            names = archive.namelist()
+            if 'mimetype' in names:
+                # OpenDocument stores its type as the first member
+                return archive.read('mimetype').decode('ascii', 'replace').strip() or 'application/zip'
+    except (zipfile.BadZipFile, OSError, KeyError):
+        return 'application/zip'
+    for prefix, mime_type in ZIP_MEMBERS:
+        if any(name.startswith(prefix) for name in names):
+            return mime_type
+    return 'application/zip'
+
+
+def _text_type(head):
+    if b'\x00' in head:
+        return None
+    try:
+        text = head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off by HEAD_SIZE is still text
+        if e.start < len(head) - 3:
+            return None
+        text = head[:e.start].decode('utf-8')
+    stripped = text.lstrip('\ufeff \t\r\n')
+    if stripped.startswith('<?xml'):
+        return 'application/xml'
+    if stripped[:1] in ('{', '['):
+        return 'application/json'
+    if stripped.lower().startswith(('<!doctype html', '<html')):
+        return 'text/html'
+    return 'text/plain'
+
+
+def sniff(file):
+    """ MIME type of the open binary `file` judged by its content, or application/octet-stream. """
+    file.seek(0)
+    head = file.read(HEAD_SIZE)
+    if head.startswith(b'PK\x03\x04'):
+        return _zip_type(file)
+    for offset, signature, mime_type in SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return mime_type
+    return _text_type(head) or 'application/octet-stream'
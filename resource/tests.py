@@ -1,3 +1,1527 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import importlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import warnings
+import zipfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core import mail as outbox
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.handlers.asgi import ASGIHandler
+from django.core.signals import request_finished, request_started
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import close_old_connections, connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from resource_center import middleware
+from resource_center.views import request_metrics
+
+from . import blobs, events, extraction, mail, refdata, reminders, renditions, search, upload_views
+from .blobs import store_blob
+from .models import AccessGrant, Blob, Category, ExtractedText, FileVersion, Notification, Reminder, OutboundEmail, FileSharing, ShareCounter, StorageUsage, Folder, Tag, UploadedFile, UploadSession
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, POST_UPLOAD_WORKERS=0)
+class ResourceTestCase(TestCase):
+    """
+    Stored files go to a scratch MEDIA_ROOT that is removed after each class, and
+    post-upload processing runs inline.
+    """
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def assertFlatQueries(self, prepare, request, sizes=(2, 20), budget=None):
+        """
+        For each size, call `prepare(size)` and then measure `request(prepared)`: every run
+        has to cost the same number of queries, and no more than `budget` if given.
+        `request` may return a response, which must not be an error. Returns the counts.
+        """
+        counts = []
+        for size in sizes:
+            prepared = prepare(size)
+            with CaptureQueriesContext(connection) as queries:
+                response = request(prepared)
+            if response is not None:
+                self.assertLess(response.status_code, 400, response.content)
+            counts.append(len(queries.captured_queries))
+        if budget is not None:
+            self.assertLessEqual(max(counts), budget, f"ran {counts} queries, budget {budget}")
+        self.assertEqual(counts[0], counts[1], f"query count grows with size: {counts}")
+        return counts
+
+
+async def asgi_get(path, cookie, on_chunk=None):
+    """
+    GET `path` through the ASGI handler the way an ASGI server would, calling `on_chunk`
+    for each body message as it is sent. Returns (status, body). Falling back to reading
+    a synchronous stream into memory is an error.
+    """
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+        "root_path": "", "headers": [(b"host", b"testserver"), (b"cookie", cookie.encode())],
+        "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+    }
+    received = False
+    status, body = None, []
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()  # the client never disconnects
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message.get("body"):
+            body.append(message["body"])
+            if on_chunk:
+                on_chunk(message["body"])
+
+    # As the test client does: the test's transaction must survive the request
+    request_started.disconnect(close_old_connections)
+    request_finished.disconnect(close_old_connections)
+    try:
+        with warnings.catch_warnings():
+            warnings.filterwarnings("error", message=".*must consume synchronous iterators")
+            await ASGIHandler()(scope, receive, send)
+    finally:
+        request_started.connect(close_old_connections)
+        request_finished.connect(close_old_connections)
+    return status, b"".join(body)
+
+
+class QueryBudgetTestCase(ResourceTestCase):
+    """
+    Listing endpoints must run a fixed number of queries however many rows they return.
+
+    Each endpoint is measured on a small and a large seeded dataset; both runs have to
+    fit the endpoint's budget, and the large one may not cost more than the small one.
+    """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner", email="owner@example.com", first_name="Owner")
+        self.other = User.objects.create_user("other", email="other@example.com", first_name="Other")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.category = Category.objects.create(name="Reports")
+        Category.objects.create(name="General")
+        self.tags = [Tag.objects.create(name=f"tag-{i}") for i in range(3)]
+        self.folder = Folder.objects.create(name="Projects", owner=self.owner)
+        # Steady state: reference data is already cached
+        refdata.warm()
+        self.addCleanup(refdata.invalidate)
+
+    def seed(self, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._seed(count)
+
+    def _seed(self, count):
+        for i in range(count):
+            Folder.objects.create(name=f"sub-{count}-{i}", parent=self.folder, owner=self.owner)
+            uploaded_file = UploadedFile(
+                name=f"file-{count}-{i}.pdf",
+                file=SimpleUploadedFile(f"file-{count}-{i}.pdf", b"%PDF-1.4"),
+                category=self.category,
+                folder=self.folder,
+                owner=self.owner if i % 2 else self.other,
+                is_public=True,
+                is_archived=i % 3 == 0,
+            )
+            uploaded_file.save()
+            uploaded_file.meta_tags.set(self.tags)
+            FileSharing.objects.create(
+                file=uploaded_file,
+                shared_by=self.other,
+                shared_to=self.owner,
+                share_type=FileSharing.FILE,
+            )
+
+    def assertQueryBudget(self, budget, method, url_factory, **kwargs):
+        self.assertFlatQueries(self.seed, lambda _: getattr(self.client, method)(url_factory(), **kwargs), budget=budget)
+
+    def test_folder_contents(self):
+        self.assertQueryBudget(4, "get", lambda: f"/folder-contents/{self.folder.id}/")
+
+    def test_root_folder_contents(self):
+        self.assertQueryBudget(2, "get", lambda: "/folder-contents/")
+
+    def test_file_upload_listing(self):
+        self.assertQueryBudget(3, "get", lambda: f"/file-upload/{self.folder.id}/")
+
+    def test_archived_listing(self):
+        self.assertQueryBudget(2, "get", lambda: "/file-upload/?archived=true")
+
+    def test_folder_tree(self):
+        self.assertQueryBudget(4, "get", lambda: f"/folder-tree/{self.folder.id}/?depth=3")
+
+    def test_shared_with_me(self):
+        self.assertQueryBudget(2, "get", lambda: "/api/shared-with-me/")
+
+    def test_search(self):
+        self.assertQueryBudget(3, "get", lambda: "/search/?q=file")
+
+    def test_file_detail(self):
+        self.seed(1)
+        uploaded_file = UploadedFile.objects.filter(folder=self.folder).first()
+        with self.assertNumQueries(2):
+            self.client.get(f"/files-update/{uploaded_file.id}/")
+
+    def test_file_upload(self):
+        def prepare(size):
+            self.seed(size)
+            return SimpleUploadedFile(f"new-{size}.txt", f"hello {size}".encode())
+
+        # Includes queueing text extraction, the new file's access grants, the quota check and usage totals
+        self.assertFlatQueries(prepare, lambda upload: self.client.post(
+            f"/file-upload/{self.folder.id}/", data={"files": [upload], "folder_id": self.folder.id},
+        ), budget=17)
+
+
+@override_settings(REQUEST_METRICS_ENABLED=True)
+class RequestMetricsTestCase(TestCase):
+    """ The opt-in middleware reports each request's queries and timings and keeps per-view totals. """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        middleware.aggregates.reset()
+        self.addCleanup(middleware.aggregates.reset)
+
+    def test_server_timing_and_aggregates(self):
+        UploadedFile.objects.create(name="a.txt", owner=self.owner)
+        with self.assertLogs("resource_center.requests", "INFO") as logs:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get("/folder-contents/")
+            count = len(queries.captured_queries)
+            self.client.get("/folder-contents/")
+        timing = response["Server-Timing"]
+        self.assertIn(f'desc="{count} queries"', timing)
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, total;dur=[\d.]+$')
+        self.assertEqual(json.loads(logs.records[0].getMessage())["queries"], count)
+
+        entry = middleware.aggregates.snapshot()["folder-contents"]
+        self.assertEqual(entry["requests"], 2)
+        self.assertEqual(entry["queries"], 2 * count)
+        self.assertEqual(entry["bytes"], 2 * len(response.content))
+
+    def test_metrics_view_is_staff_only(self):
+        factory = RequestFactory()
+        request = factory.get("/metrics/requests/")
+        request.user = self.owner
+        self.assertEqual(request_metrics(request).status_code, 302)
+
+        middleware.aggregates.add("home", 0.5, middleware.RequestMetrics(), 10)
+        request.user = User.objects.create_user("staff", is_staff=True)
+        response = request_metrics(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["home"]["requests"], 1)
+
+    @override_settings(REQUEST_METRICS_ENABLED=False)
+    def test_disabled_middleware_drops_out(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            middleware.RequestMetricsMiddleware(lambda request: None)
+        with self.assertNoLogs("resource_center.requests"):
+            self.assertNotIn("Server-Timing", self.client.get("/folder-contents/"))
+
+    def test_serializer_timing_counts_the_outermost_call(self):
+        """ BaseSerializer.data is patched for every serializer; only top-level calls in a measured request are timed. """
+        from rest_framework import serializers
+
+        middleware._instrument_serializers()
+        middleware._instrument_serializers()  # patches once
+
+        class Inner(serializers.Serializer):
+            value = serializers.IntegerField()
+
+        class Outer(serializers.Serializer):
+            inner = serializers.SerializerMethodField()
+
+            def get_inner(self, obj):
+                return Inner({"value": 1}).data
+
+        # Outside a request the data is computed as usual
+        self.assertEqual(Outer({}).data, {"inner": {"value": 1}})
+
+        metrics = middleware.RequestMetrics()
+        token = middleware._current.set(metrics)
+        try:
+            with mock.patch.object(middleware, "perf_counter", side_effect=[10.0, 12.5]):
+                self.assertEqual(Outer({}).data, {"inner": {"value": 1}})
+        finally:
+            middleware._current.reset(token)
+        self.assertEqual(metrics.serializer_time, 2.5)
+        self.assertFalse(metrics.in_serializer)
+
+
+class FolderTreeTestCase(TestCase):
+    """ Folders keep a materialized path and level, re-rooted with their subtree on moves. """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner")
+        self.projects = Folder.objects.create(name="Projects", owner=self.owner)
+        self.archive = Folder.objects.create(name="Archive", owner=self.owner)
+        self.child = Folder.objects.create(name="Child", parent=self.projects, owner=self.owner)
+        self.grandchild = Folder.objects.create(name="Grandchild", parent=self.child, owner=self.owner)
+
+    def tree(self):
+        return {name: (path, level) for name, path, level in Folder.objects.values_list("name", "path", "level")}
+
+    def test_move_re_roots_the_subtree(self):
+        p, a, c, g = (f.pk for f in (self.projects, self.archive, self.child, self.grandchild))
+        self.assertEqual(self.tree()["Grandchild"], (f"/{p}/{c}/{g}/", 2))
+
+        self.child.parent = self.archive
+        self.child.save()
+        self.assertEqual(self.tree(), {
+            "Projects": (f"/{p}/", 0),
+            "Archive": (f"/{a}/", 0),
+            "Child": (f"/{a}/{c}/", 1),
+            "Grandchild": (f"/{a}/{c}/{g}/", 2),
+        })
+        self.grandchild.refresh_from_db()
+        self.assertEqual([f.name for f in self.grandchild.get_ancestors()], ["Archive", "Child"])
+
+        self.child.parent = None
+        self.child.save()
+        self.assertEqual(self.tree()["Grandchild"], (f"/{c}/{g}/", 1))
+
+    def test_cannot_move_into_its_own_subtree(self):
+        before = self.tree()
+        for target in (self.grandchild, self.projects):
+            self.projects.parent = target
+            with self.assertRaises(ValueError):
+                self.projects.save()
+        self.assertEqual(self.tree(), before)
+
+    def test_migration_backfills_paths(self):
+        from django.apps import apps
+
+        expected = self.tree()
+        Folder.objects.update(path="", level=0)
+        importlib.import_module("resource.migrations.0003_folder_path").build_paths(apps, None)
+        self.assertEqual(self.tree(), expected)
+
+
+class PaginationTestCase(ResourceTestCase):
+    """ Listings are paged by a (timestamp, id) cursor. """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        for i in range(5):
+            UploadedFile.objects.create(name=f"file-{i}.txt", owner=self.owner)
+            Folder.objects.create(name=f"folder-{i}", owner=self.owner)
+
+    def walk(self, url):
+        """ Follow both cursors to the end, as "Load more" does, returning the names in order. """
+        response = self.client.get(url, {"limit": 2})
+        files = [entry["name"] for entry in response.data["files"]]
+        folders = [entry["name"] for entry in response.data["folders"]]
+        while response.data["next_cursor"] or response.data["next_folder_cursor"]:
+            cursors = {"cursor": response.data["next_cursor"], "folder_cursor": response.data["next_folder_cursor"]}
+            response = self.client.get(url, {"limit": 2, **{k: v for k, v in cursors.items() if v}})
+            self.assertEqual(response.status_code, 200, response.content)
+            # A list without a cursor is finished; its first page comes back again and is ignored
+            if cursors["cursor"]:
+                files += [entry["name"] for entry in response.data["files"]]
+            if cursors["folder_cursor"]:
+                folders += [entry["name"] for entry in response.data["folders"]]
+        return files, folders
+
+    def test_cursor_round_trip(self):
+        files, folders = self.walk("/folder-contents/")
+        self.assertEqual(files, [f"file-{i}.txt" for i in reversed(range(5))])
+        self.assertEqual(folders, [f"folder-{i}" for i in reversed(range(5))])
+
+    def test_equal_timestamps_are_ordered_by_id(self):
+        moment = timezone.now()
+        UploadedFile.objects.update(uploaded_at=moment)
+        Folder.objects.update(created_at=moment)
+        files, folders = self.walk("/folder-contents/")
+        self.assertEqual(files, [f"file-{i}.txt" for i in reversed(range(5))])
+        self.assertEqual(folders, [f"folder-{i}" for i in reversed(range(5))])
+
+    def test_invalid_cursor(self):
+        for params in ({"cursor": "not-a-cursor"}, {"folder_cursor": "bm9wZQ"}):
+            response = self.client.get("/folder-contents/", params)
+            self.assertEqual(response.status_code, 400, params)
+        self.assertEqual(self.client.get("/api/shared-with-me/", {"cursor": "x"}).status_code, 400)
+
+
+class UploadSessionTestCase(ResourceTestCase):
+    """ Resumable uploads: chunks at increasing offsets, then finalize. """
+
+    data = b"0123456789" * 30
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def start(self, **fields):
+        response = self.client.post("/uploads/", {"file_name": "notes.txt", "total_size": len(self.data), **fields}, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.data["id"]
+
+    def put(self, session_id, offset, data):
+        return self.client.generic("PUT", f"/uploads/{session_id}/", data, content_type="application/octet-stream", HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_chunks_resume_and_finalize(self):
+        session_id = self.start()
+        self.assertEqual(self.put(session_id, 0, self.data[:100]).data["received"], 100)
+        # A retried or skipped chunk is refused with the offset to resume from
+        for offset in (0, 200):
+            response = self.put(session_id, offset, self.data[offset:offset + 100])
+            self.assertEqual((response.status_code, response.data["received"]), (409, 100))
+        self.assertEqual(self.client.get(f"/uploads/{session_id}/").data["received"], 100)
+        self.assertEqual(self.put(session_id, 100, self.data[100:]).data["received"], len(self.data))
+
+        response = self.client.post(f"/uploads/{session_id}/finalize/", {"sha256": hashlib.sha256(self.data).hexdigest()}, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+        uploaded_file = UploadedFile.objects.get(pk=response.data["file"]["id"])
+        self.assertEqual(uploaded_file.file.read(), self.data)
+        self.assertEqual(uploaded_file.blob.sha256, hashlib.sha256(self.data).hexdigest())
+        # Finalizing again returns the same file
+        self.assertEqual(self.client.post(f"/uploads/{session_id}/finalize/").data["file"]["id"], uploaded_file.pk)
+
+    def test_digest_survives_another_process(self):
+        session_id = self.start()
+        self.put(session_id, 0, self.data[:100])
+        upload_views._hashers.clear()
+        self.put(session_id, 100, self.data[100:])
+        self.assertEqual(UploadSession.objects.get(pk=session_id).sha256, hashlib.sha256(self.data).hexdigest())
+
+    def test_finalize_rejects_a_digest_mismatch(self):
+        session_id = self.start(expected_sha256=hashlib.sha256(b"something else").hexdigest())
+        self.put(session_id, 0, self.data)
+        response = self.client.post(f"/uploads/{session_id}/finalize/")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["sha256"], hashlib.sha256(self.data).hexdigest())
+        self.assertFalse(UploadedFile.objects.exists())
+        self.assertEqual(UploadSession.objects.get(pk=session_id).status, UploadSession.ACTIVE)
+
+    def test_one_writer_at_a_time(self):
+        session_id = self.start()
+        UploadSession.objects.filter(pk=session_id).update(writing_until=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(self.put(session_id, 0, self.data).status_code, 409)
+
+    def test_delete_and_expiry(self):
+        session_id = self.start()
+        self.put(session_id, 0, self.data[:100])
+        staging_name = UploadSession.objects.get(pk=session_id).staging_name
+        self.assertEqual(self.client.delete(f"/uploads/{session_id}/").status_code, 200)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(default_storage.exists(staging_name))
+
+        session_id = self.start()
+        self.put(session_id, 0, self.data[:100])
+        staging_name = UploadSession.objects.get(pk=session_id).staging_name
+        UploadSession.objects.filter(pk=session_id).update(expires_at=timezone.now())
+        self.assertEqual(self.put(session_id, 100, self.data[100:]).status_code, 410)
+        self.assertEqual(UploadSession.objects.expire(), 1)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(default_storage.exists(staging_name))
+
+    def test_folder_must_be_visible(self):
+        folder = Folder.objects.create(name="Private", owner=User.objects.create_user("stranger"))
+        response = self.client.post("/uploads/", {"file_name": "notes.txt", "total_size": 1, "folder": folder.id}, format="json")
+        self.assertEqual(response.status_code, 403)
+
+
+class BlobStoreTestCase(ResourceTestCase):
+    """ Shared blobs are collected when unreferenced, without racing uploads of the same content. """
+
+    def test_content_stored_while_its_old_blob_is_collected(self):
+        old = store_blob(SimpleUploadedFile("a.txt", b"same bytes"))
+        old_name = old.file.name
+        # collect() has deleted the row but not yet the file when the same content comes in
+        Blob.objects.filter(pk=old.pk).delete()
+        new = store_blob(SimpleUploadedFile("b.txt", b"same bytes"))
+        self.assertNotEqual(new.file.name, old_name)
+        default_storage.delete(old_name)
+        self.assertEqual(new.file.read(), b"same bytes")
+
+    def test_collect_keeps_referenced_blobs(self):
+        blob = store_blob(SimpleUploadedFile("a.txt", b"kept"))
+        Blob.objects.filter(pk=blob.pk).update(ref_count=1)
+        self.assertFalse(Blob.objects.collect(blob.pk))
+        self.assertTrue(default_storage.exists(blob.file.name))
+
+    def test_sweep_removes_old_orphans(self):
+        orphan = store_blob(SimpleUploadedFile("a.txt", b"orphan"))
+        young = store_blob(SimpleUploadedFile("b.txt", b"young"))
+        used = UploadedFile.objects.create(name="used.txt", owner=User.objects.create_user("owner"))
+        used.use_blob(store_blob(SimpleUploadedFile("c.txt", b"used")))
+        used.save()
+        stray = default_storage.save("blobs/ab/cd/stray", io.BytesIO(b"stray"))
+        Blob.objects.filter(pk=orphan.pk).update(created_at=timezone.now() - timedelta(days=2))
+
+        later = timezone.now() + timedelta(seconds=1)
+        self.assertEqual(Blob.objects.sweep(timezone.now() - timedelta(days=1)), 1)
+        self.assertEqual(set(Blob.objects.values_list("pk", flat=True)), {young.pk, used.blob_id})
+        self.assertFalse(default_storage.exists(orphan.file.name))
+
+        self.assertGreaterEqual(blobs.sweep_files(later), 1)
+        self.assertFalse(default_storage.exists(stray))
+        self.assertTrue(all(default_storage.exists(blob.file.name) for blob in Blob.objects.all()))
+
+
+class FileDeliveryTestCase(ResourceTestCase):
+    """ Offloaded delivery hands the transfer to the proxy; Django only authorizes and validates. """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner")
+        self.client.force_login(self.owner)
+        self.uploaded_file = UploadedFile(name="report.pdf", owner=self.owner)
+        self.uploaded_file.file = SimpleUploadedFile("report.pdf", b"%PDF-1.4 body")
+        self.uploaded_file.save()
+
+    @override_settings(FILE_DELIVERY_MODE="x-accel-redirect", FILE_DELIVERY_INTERNAL_PREFIX="/protected-media/")
+    def test_x_accel_redirect(self):
+        response = self.client.get(f"/download-file/{self.uploaded_file.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-media/{self.uploaded_file.file.name}")
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="report.pdf"')
+        self.assertIn("ETag", response)
+        self.assertEqual(response.content, b"")
+
+    @override_settings(FILE_DELIVERY_MODE="x-sendfile")
+    def test_x_sendfile(self):
+        response = self.client.get(f"/view-file/{self.uploaded_file.id}/")
+        self.assertEqual(response["X-Sendfile"], self.uploaded_file.file.path)
+        self.assertEqual(response["Content-Disposition"], 'inline; filename="report.pdf"')
+
+    @override_settings(FILE_DELIVERY_MODE="x-accel")
+    def test_unknown_mode_is_a_configuration_error(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.client.get(f"/download-file/{self.uploaded_file.id}/")
+
+    @override_settings(FILE_DELIVERY_MODE="x-accel-redirect")
+    def test_offload_still_answers_conditional_requests(self):
+        etag = self.client.get(f"/view-file/{self.uploaded_file.id}/")["ETag"]
+        response = self.client.get(f"/view-file/{self.uploaded_file.id}/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn("X-Accel-Redirect", response)
+
+    async def test_asgi_streams_downloads_in_chunks(self):
+        def store():
+            self.uploaded_file.file = SimpleUploadedFile("big.bin", os.urandom(300 * 1024))
+            self.uploaded_file.save()
+            return f"sessionid={self.client.cookies['sessionid'].value}"
+
+        cookie = await sync_to_async(store)()
+        chunks = []
+        status, body = await asgi_get(f"/download-file/{self.uploaded_file.id}/", cookie, chunks.append)
+        self.assertEqual(status, 200)
+        self.assertGreater(len(chunks), 1)
+        with open(self.uploaded_file.file.path, "rb") as stored:
+            self.assertEqual(body, stored.read())
+
+    def test_direct_mode_streams_the_file(self):
+        response = self.client.get(f"/view-file/{self.uploaded_file.id}/", HTTP_RANGE="bytes=0-7")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4")
+        self.assertNotIn("X-Accel-Redirect", response)
+
+    def view(self, **headers):
+        return self.client.get(f"/view-file/{self.uploaded_file.id}/", **headers)
+
+    def test_multiple_ranges(self):
+        response = self.view(HTTP_RANGE="bytes=0-3,9-")
+        self.assertEqual(response.status_code, 206)
+        boundary = response["Content-Type"].split("boundary=")[1]
+        body = b"".join(response.streaming_content)
+        self.assertEqual(len(body), int(response["Content-Length"]))
+        parts = body.split(f"--{boundary}".encode())
+        self.assertEqual(len(parts), 4)  # preamble, two parts, closing "--"
+        self.assertIn(b"Content-Range: bytes 0-3/13\r\n\r\n%PDF\r\n", parts[1])
+        self.assertIn(b"Content-Range: bytes 9-12/13\r\n\r\nbody\r\n", parts[2])
+
+    def test_unsatisfiable_range(self):
+        response = self.view(HTTP_RANGE="bytes=100-200")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */13")
+
+    def test_if_range(self):
+        first = self.view()
+        for validator in (first["ETag"], first["Last-Modified"]):
+            response = self.view(HTTP_RANGE="bytes=0-3", HTTP_IF_RANGE=validator)
+            self.assertEqual(response.status_code, 206, validator)
+        # A stale validator gets the whole file instead of a range of different bytes
+        for validator in ('"stale"', "Mon, 01 Jan 2001 00:00:00 GMT"):
+            response = self.view(HTTP_RANGE="bytes=0-3", HTTP_IF_RANGE=validator)
+            self.assertEqual(response.status_code, 200, validator)
+            self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4 body")
+
+    def test_conditional_get_and_last_modified(self):
+        first = self.view()
+        self.assertEqual(self.view(HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 304)
+        self.assertEqual(self.view(HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+        # A later rename doesn't change the bytes, so the validators stay
+        self.uploaded_file.name = "renamed.pdf"
+        self.uploaded_file.save()
+        UploadedFile.objects.filter(pk=self.uploaded_file.pk).update(modified_at=timezone.now() + timedelta(days=1))
+        later = self.view()
+        self.assertEqual((later["ETag"], later["Last-Modified"]), (first["ETag"], first["Last-Modified"]))
+        self.assertEqual(self.view(HTTP_IF_MODIFIED_SINCE=first["Last-Modified"]).status_code, 304)
+
+
+class SearchTestCase(ResourceTestCase):
+    """ The index follows renames and tag changes and only returns files the user may see. """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner")
+        self.other = User.objects.create_user("other")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def create_file(self, name, owner, is_public=False):
+        with self.captureOnCommitCallbacks(execute=True):
+            uploaded_file = UploadedFile(name=name, owner=owner, is_public=is_public)
+            uploaded_file.file = SimpleUploadedFile(name, b"content")
+            uploaded_file.save()
+        return uploaded_file
+
+    def search(self, query):
+        response = self.client.get("/search/", {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return [f["name"] for f in response.data["files"]]
+
+    def test_ranks_visible_matches(self):
+        self.create_file("budget-2026.xlsx", self.owner)
+        self.create_file("notes.txt", self.owner)
+        self.create_file("budget-draft.docx", self.other)
+        self.create_file("budget-public.pdf", self.other, is_public=True)
+        self.assertCountEqual(self.search("budg"), ["budget-2026.xlsx", "budget-public.pdf"])
+
+    def test_follows_renames_and_tags(self):
+        uploaded_file = self.create_file("scan.pdf", self.owner)
+        with self.captureOnCommitCallbacks(execute=True):
+            uploaded_file.name = "invoice.pdf"
+            uploaded_file.save()
+            uploaded_file.meta_tags.add(Tag.objects.create(name="finance"))
+        self.assertEqual(self.search("invoice"), ["invoice.pdf"])
+        self.assertEqual(self.search("finance"), ["invoice.pdf"])
+        self.assertEqual(self.search("scan"), [])
+
+    def test_category_renames_reindex_in_one_statement(self):
+        category = Category.objects.create(name="Invoices")
+        for i in range(3):
+            uploaded_file = self.create_file(f"scan-{i}.pdf", self.owner)
+            uploaded_file.category = category
+            with self.captureOnCommitCallbacks(execute=True):
+                uploaded_file.save()
+        self.assertEqual(len(self.search("invoices")), 3)
+
+        category = Category.objects.get(pk=category.pk)
+        with mock.patch.object(search, "rename_category") as rename, self.captureOnCommitCallbacks(execute=True):
+            category.save()
+        rename.assert_not_called()
+
+        category.name = "Receipts"
+        with mock.patch.object(search, "rename_category") as rename, self.captureOnCommitCallbacks(execute=True):
+            category.save()
+        rename.assert_called_once_with(category.pk, "Receipts")
+        with self.assertNumQueries(1):
+            search.rename_category(category.pk, "Receipts")
+        self.assertEqual(len(self.search("receipts")), 3)
+        self.assertEqual(self.search("invoices"), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.create_file("report.pdf", self.owner)
+        self.assertEqual(self.search('"report*) -'), ["report.pdf"])
+
+
+class TextExtractionTestCase(ResourceTestCase):
+    """ Uploads are only queued; the extraction run fills in text and makes the content searchable. """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def upload(self, name, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/file-upload/", {"files": [SimpleUploadedFile(name, content)]})
+        self.assertEqual(response.status_code, 201, response.content)
+        return UploadedFile.objects.get(name=name)
+
+    def docx(self, text, title):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            archive.writestr("word/document.xml", (
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                f'<w:body><w:p><w:r><w:t>{text}</w:t></w:r></w:p></w:body></w:document>'
+            ))
+            archive.writestr("docProps/core.xml", (
+                '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+                f'xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>{title}</dc:title>'
+                '<dc:creator>Jane Doe</dc:creator></cp:coreProperties>'
+            ))
+        return buffer.getvalue()
+
+    def test_uploads_are_extracted_and_searchable(self):
+        uploaded_file = self.upload("minutes.docx", self.docx("Quarterly procurement review", "Board minutes"))
+        row = ExtractedText.objects.get(blob_id=uploaded_file.blob_id)
+        self.assertEqual(row.status, ExtractedText.PENDING)
+
+        extraction.extract_queued(extraction.queued(), workers=0)
+
+        row.refresh_from_db()
+        self.assertEqual(row.status, ExtractedText.DONE)
+        self.assertEqual((row.title, row.author), ("Board minutes", "Jane Doe"))
+        response = self.client.get("/search/", {"q": "procurement"})
+        self.assertEqual([f["name"] for f in response.data["files"]], ["minutes.docx"])
+
+    def test_broken_documents_fail_without_stopping_the_run(self):
+        self.upload("broken.docx", b"not a zip")
+        notes = self.upload("notes.txt", b"plain text notes")
+
+        self.assertEqual(extraction.extract_queued(extraction.queued(), workers=0), 2)
+
+        statuses = dict(ExtractedText.objects.values_list("file_type", "status"))
+        self.assertEqual(statuses, {"docx": ExtractedText.FAILED, "txt": ExtractedText.DONE})
+        self.assertEqual(ExtractedText.objects.get(blob_id=notes.blob_id).text, "plain text notes")
+
+    def test_unsupported_types_are_not_queued(self):
+        self.upload("photo.jpg", b"\xff\xd8\xff")
+        self.assertFalse(ExtractedText.objects.exists())
+
+
+class FailingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionRefusedError("SMTP server unavailable")
+
+
+class EmailQueueTestCase(ResourceTestCase):
+    """ Sharing by email only queues the message; the worker sends it or retries later. """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner", email="owner@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.uploaded_file = UploadedFile(name="report.pdf", owner=self.owner)
+        self.uploaded_file.file = SimpleUploadedFile("report.pdf", b"%PDF-1.4")
+        self.uploaded_file.save()
+
+    def share(self):
+        response = self.client.post("/send-email/", {
+            "recipients": ["a@example.com", "b@example.com"],
+            "message": "Please review",
+            "file_id": self.uploaded_file.id,
+        }, format="json")
+        self.assertEqual(response.status_code, 202, response.content)
+        return response.data
+
+    def test_request_only_queues(self):
+        data = self.share()
+        self.assertEqual(len(outbox.outbox), 0)
+        self.assertEqual(data["status"], OutboundEmail.QUEUED)
+
+        self.assertEqual(mail.send_queued(rate=0), (1, 0))
+        self.assertEqual(outbox.outbox[0].to, ["a@example.com", "b@example.com"])
+        self.assertEqual(self.client.get(data["status_url"]).data["status"], OutboundEmail.SENT)
+
+    @override_settings(EMAIL_BACKEND="resource.tests.FailingEmailBackend")
+    def test_failures_are_retried_with_backoff(self):
+        data = self.share()
+        with self.assertLogs("resource.mail", "WARNING"):
+            self.assertEqual(mail.send_queued(rate=0), (0, 1))
+
+        delivery = OutboundEmail.objects.get(id=data["delivery_id"])
+        self.assertEqual((delivery.status, delivery.attempts), (OutboundEmail.QUEUED, 1))
+        self.assertIn("SMTP server unavailable", delivery.last_error)
+        # Not due again until the backoff has passed
+        self.assertEqual(mail.send_queued(rate=0), (0, 0))
+
+    def test_lease_covers_the_batch_and_taken_over_messages_are_skipped(self):
+        self.share()
+        self.share()
+        rows, leased_until = mail.claim(10, rate=0.01)
+        self.assertGreaterEqual(leased_until - timezone.now(), mail.LEASE + timedelta(seconds=190))
+        OutboundEmail.objects.update(status=OutboundEmail.QUEUED, next_attempt_at=timezone.now())
+
+        claim = mail.claim
+
+        def claim_then_lose_one(limit, rate):
+            rows, leased_until = claim(limit, rate)
+            # Another worker claimed the second message after the lease ran out
+            OutboundEmail.objects.filter(pk=rows[1].pk).update(next_attempt_at=timezone.now() + timedelta(hours=1))
+            return rows, leased_until
+
+        with mock.patch.object(mail, "claim", claim_then_lose_one), self.assertLogs("resource.mail", "WARNING"):
+            self.assertEqual(mail.send_queued(rate=0), (1, 0))
+        self.assertEqual(len(outbox.outbox), 1)
+
+    def test_status_is_private_to_the_sender(self):
+        data = self.share()
+        self.client.force_authenticate(User.objects.create_user("other"))
+        self.assertEqual(self.client.get(data["status_url"]).status_code, 404)
+
+
+class BulkShareTestCase(ResourceTestCase):
+    """ One share request costs the same few queries however many recipients and items it has. """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner", email="owner@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.folder = Folder.objects.create(name="Projects", owner=self.owner)
+        self.files = [UploadedFile.objects.create(name=f"f{i}.txt", owner=self.owner) for i in range(3)]
+
+    def share(self, emails, **items):
+        return self.client.post("/api/share/", {"emails": emails, **items}, format="json")
+
+    def test_query_count_is_flat(self):
+        self.assertFlatQueries(
+            lambda size: [User.objects.create_user(f"u{size}-{i}", email=f"u{size}-{i}@example.com").email for i in range(size)],
+            lambda emails: self.share(emails, file_ids=[f.id for f in self.files], folder_ids=[self.folder.id]),
+        )
+        self.assertEqual(FileSharing.objects.count(), 22 * 4)
+        self.assertEqual(FileSharing.objects.filter(share_type=FileSharing.FOLDER).count(), 22)
+
+    def test_per_recipient_results(self):
+        User.objects.create_user("known", email="known@example.com")
+        self.share(["known@example.com"], id=self.files[0].id)
+        response = self.share(["known@example.com", "nobody@example.com"], file_ids=[f.id for f in self.files[:2]])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data["results"], [
+            {"email": "known@example.com", "status": "shared", "shared": 1},
+            {"email": "nobody@example.com", "status": "not_found", "shared": 0},
+        ])
+
+    def test_pairs_shared_concurrently_are_not_counted_twice(self):
+        known = User.objects.create_user("known", email="known@example.com")
+        create_new = FileSharing.objects.create_new
+
+        def after_concurrent_share(shares):
+            # Another request shares the first file between the lookup and the insert
+            FileSharing.objects.create(file=self.files[0], shared_by=self.owner, shared_to=known, share_type=FileSharing.FILE)
+            return create_new(shares)
+
+        with mock.patch.object(FileSharing.objects, "create_new", side_effect=after_concurrent_share):
+            response = self.share(["known@example.com"], file_ids=[f.id for f in self.files[:2]])
+        self.assertEqual(response.data["results"], [{"email": "known@example.com", "status": "shared", "shared": 1}])
+        self.assertEqual(FileSharing.objects.filter(shared_to=known).count(), 2)
+        self.assertEqual(AccessGrant.objects.filter(grantee=known.id, reason=AccessGrant.SHARED).count(), 2)
+        self.assertEqual(ShareCounter.objects.unseen(known), 2)
+
+    def test_items_must_belong_to_the_sharer(self):
+        other_file = UploadedFile.objects.create(name="theirs.txt", owner=User.objects.create_user("other"))
+        User.objects.create_user("known", email="known@example.com")
+        response = self.share(["known@example.com"], file_ids=[self.files[0].id, other_file.id])
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(FileSharing.objects.exists())
+
+
+class AccessIndexTestCase(ResourceTestCase):
+    """ The access index follows shares, moves, publishing and unsharing. """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner")
+        self.reader = User.objects.create_user("reader", email="reader@example.com")
+        self.projects = Folder.objects.create(name="Projects", owner=self.owner)
+        self.nested = Folder.objects.create(name="Nested", parent=self.projects, owner=self.owner)
+        self.elsewhere = Folder.objects.create(name="Elsewhere", owner=self.owner)
+        self.report = UploadedFile(name="report.pdf", owner=self.owner, folder=self.nested)
+        self.report.file = SimpleUploadedFile("report.pdf", b"%PDF-1.4")
+        self.report.save()
+
+    def visible(self, user=None):
+        user = user or self.reader
+        return (
+            set(UploadedFile.objects.visible_to(user).values_list("name", flat=True)),
+            set(Folder.objects.visible_to(user).values_list("name", flat=True)),
+        )
+
+    def test_folder_share_covers_descendants(self):
+        share = FileSharing.objects.create(folder=self.projects, shared_by=self.owner, shared_to=self.reader, share_type=FileSharing.FOLDER)
+        later = UploadedFile.objects.create(name="later.txt", owner=self.owner, folder=self.projects)
+        self.assertEqual(self.visible(), ({"report.pdf", "later.txt"}, {"Projects", "Nested"}))
+        self.assertTrue(self.report.is_accessible_by(self.reader))
+
+        share.delete()
+        self.assertEqual(self.visible(), (set(), set()))
+        self.assertTrue(later.is_accessible_by(self.owner))
+
+    def test_moves_follow_the_new_location(self):
+        FileSharing.objects.create(folder=self.projects, shared_by=self.owner, shared_to=self.reader, share_type=FileSharing.FOLDER)
+        self.nested.parent = self.elsewhere
+        self.nested.save()
+        self.assertEqual(self.visible(), (set(), {"Projects"}))
+
+        self.report.refresh_from_db()
+        self.report.folder = self.projects
+        self.report.save()
+        self.assertEqual(self.visible(), ({"report.pdf"}, {"Projects"}))
+
+    def test_publishing_and_downloads(self):
+        client = APIClient()
+        client.force_login(self.reader)
+        self.assertEqual(client.get(f"/download-file/{self.report.id}/").status_code, 404)
+
+        self.report.is_public = True
+        self.report.save()
+        self.assertEqual(client.get(f"/download-file/{self.report.id}/").status_code, 200)
+        self.assertEqual(AccessGrant.objects.filter(file=self.report).count(), 2)
+
+    def test_my_files_page_lists_only_visible_items(self):
+        Folder.objects.create(name="Private", owner=User.objects.create_user("stranger"))
+        self.client.force_login(self.reader)
+        response = self.client.get("/my-files")
+        self.assertEqual((list(response.context["files"]), list(response.context["folders"])), ([], []))
+
+        FileSharing.objects.create(folder=self.projects, shared_by=self.owner, shared_to=self.reader, share_type=FileSharing.FOLDER)
+        response = self.client.get("/my-files")
+        self.assertEqual([f.name for f in response.context["folders"]], ["Projects"])
+
+    def test_bulk_share_grants_access(self):
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        response = client.post("/api/share/", {"folder_ids": [self.nested.id], "emails": ["reader@example.com"]}, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(self.visible(), ({"report.pdf"}, {"Nested"}))
+
+
+class ReminderDispatchTestCase(TestCase):
+    """ Due reminders fire once, notify in-app and by email, and recurring ones move on. """
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", email="owner@example.com")
+        self.file = UploadedFile.objects.create(name="contract.pdf", owner=self.user)
+
+    def test_next_occurrence(self):
+        anchor = datetime(2026, 1, 31, 9, 0, tzinfo=dt_timezone.utc)
+        self.assertEqual(reminders.next_occurrence(anchor, "monthly", anchor), datetime(2026, 2, 28, 9, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(
+            reminders.next_occurrence(anchor, "monthly", datetime(2026, 2, 28, 9, 0, tzinfo=dt_timezone.utc)),
+            datetime(2026, 3, 31, 9, 0, tzinfo=dt_timezone.utc),
+        )
+        # Catching up after downtime skips straight past the missed days
+        self.assertEqual(
+            reminders.next_occurrence(anchor, "daily", datetime(2026, 3, 10, 12, 0, tzinfo=dt_timezone.utc)),
+            datetime(2026, 3, 11, 9, 0, tzinfo=dt_timezone.utc),
+        )
+        self.assertIsNone(reminders.next_occurrence(anchor, "none", anchor))
+
+    def test_migration_schedules_like_the_dispatcher(self):
+        migration = importlib.import_module("resource.migrations.0012_reminder_dispatch")
+        anchor = datetime(2024, 2, 29, 9, 0, tzinfo=dt_timezone.utc)
+        after = datetime(2026, 10, 18, 12, 0, tzinfo=dt_timezone.utc)
+        for repeat in ("none", "daily", "weekly", "monthly", "yearly"):
+            self.assertEqual(migration.next_occurrence(anchor, repeat, after), reminders.next_occurrence(anchor, repeat, after), repeat)
+
+    def test_due_reminders_fire_and_recur(self):
+        past = timezone.now() - timedelta(minutes=1)
+        weekly = Reminder.objects.create(user=self.user, file=self.file, note="Renew", remind_at=past, repeat="weekly")
+        once = Reminder.objects.create(user=self.user, file=self.file, remind_at=past)
+        Reminder.objects.create(user=self.user, file=self.file, remind_at=past + timedelta(days=1))
+
+        self.assertEqual(reminders.Dispatcher().run_once(), 2)
+        self.assertEqual(reminders.Dispatcher().run_once(), 0)
+
+        weekly.refresh_from_db()
+        once.refresh_from_db()
+        self.assertEqual(weekly.next_fire_at, past + timedelta(weeks=1))
+        self.assertIsNone(once.next_fire_at)
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(OutboundEmail.objects.filter(to=["owner@example.com"]).count(), 2)
+
+    def test_rescheduling_resets_the_next_fire_time(self):
+        reminder = Reminder.objects.create(user=self.user, file=self.file, remind_at=timezone.now() - timedelta(minutes=1))
+        reminders.Dispatcher().run_once()
+        reminder.refresh_from_db()
+        reminder.remind_at = timezone.now() + timedelta(days=2)
+        reminder.save()
+        self.assertEqual(reminder.next_fire_at, reminder.remind_at)
+
+
+@override_settings(EVENTS_BROKER="local")
+class EventStreamTestCase(TestCase):
+    """ Shares and file changes are pushed to the open streams of the users who can see them. """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner", email="owner@example.com")
+        self.other = User.objects.create_user("other", email="other@example.com")
+        self.file = UploadedFile.objects.create(name="plan.txt", owner=self.owner)
+
+    def share(self):
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post("/api/share/", {"emails": ["other@example.com"], "file_ids": [self.file.id]}, format="json")
+
+    def test_stream_is_not_served_over_wsgi(self):
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get("/events/").status_code, 204)
+
+    async def test_shares_reach_the_recipients_stream(self):
+        await self.async_client.aforce_login(self.other)
+        response = await self.async_client.get("/events/")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = aiter(response.streaming_content)
+        try:
+            self.assertEqual(await anext(stream), b"retry: 5000\n\n")
+            await sync_to_async(self.share)()
+            self.assertEqual(await asyncio.wait_for(anext(stream), 1), b'event: share\ndata: {"new": 1}\n\n')
+        finally:
+            await stream.aclose()
+
+    async def test_file_changes_reach_only_grantees(self):
+        owner = events.broker.subscribe([self.owner.id])
+        stranger = events.broker.subscribe([self.other.id])
+        try:
+            def rename():
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.file.name = "plan-v2.txt"
+                    self.file.save()
+            await sync_to_async(rename)()
+            message = await owner.get(1)
+            self.assertIn('"action": "updated"', message)
+            self.assertIsNone(await stranger.get(0.05))
+        finally:
+            owner.close()
+            stranger.close()
+
+
+class ShareCounterTestCase(TestCase):
+    """ The shared-with-me badge reads a maintained counter instead of counting shares. """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner", email="owner@example.com")
+        self.reader = User.objects.create_user("reader", email="reader@example.com")
+        self.files = [UploadedFile.objects.create(name=f"f{i}.txt", owner=self.owner) for i in range(3)]
+        self.client = APIClient()
+
+    def unseen(self):
+        self.client.force_authenticate(self.reader)
+        with self.assertNumQueries(1):
+            return self.client.get("/api/shared-with-me/unseen-count/").data["count"]
+
+    def test_counter_follows_shares(self):
+        self.client.force_authenticate(self.owner)
+        self.client.post("/api/share/", {"emails": ["reader@example.com"], "file_ids": [f.id for f in self.files]}, format="json")
+        self.assertEqual(self.unseen(), 3)
+
+        FileSharing.objects.get(file=self.files[0]).delete()
+        self.assertEqual(self.unseen(), 2)
+
+        self.client.post("/api/shared-with-me/mark-seen/")
+        self.assertEqual(self.unseen(), 0)
+        self.assertFalse(FileSharing.objects.filter(is_seen=False).exists())
+        # Deleting a share that was already seen leaves the counter alone
+        FileSharing.objects.get(file=self.files[1]).delete()
+        self.assertEqual(self.unseen(), 0)
+
+    def test_reconcile_fixes_drift(self):
+        FileSharing.objects.create(file=self.files[0], shared_by=self.owner, shared_to=self.reader, share_type=FileSharing.FILE)
+        ShareCounter.objects.filter(pk=self.reader.pk).update(unseen=7)
+        ShareCounter.objects.create(user=self.owner, unseen=2)
+        self.assertEqual(ShareCounter.objects.reconcile(), 2)
+        self.assertEqual(dict(ShareCounter.objects.values_list("user_id", "unseen")), {self.reader.pk: 1, self.owner.pk: 0})
+        self.assertEqual(ShareCounter.objects.reconcile(), 0)
+
+
+class ReferenceDataTestCase(TestCase):
+    """ Categories are served from the process cache until any worker changes them; tags are looked up by name. """
+
+    def setUp(self):
+        Category.objects.create(name="General")
+        Category.objects.create(name="Reports")
+        refdata.warm()
+        self.addCleanup(refdata.invalidate)
+
+    def test_categories_etag(self):
+        with self.assertNumQueries(0):
+            response = self.client.get("/get-categories/")
+            self.assertEqual(self.client.get("/get-categories/", HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        self.assertEqual([c["name"] for c in response.json()["categories"]], ["General", "Reports"])
+
+        Category.objects.create(name="Contracts")
+        refdata.warm()
+        response = self.client.get("/get-categories/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["categories"]), 3)
+
+    def test_version_stamp_reloads_other_workers(self):
+        with self.assertNumQueries(0):
+            general = refdata.default_category_id()
+        # Another worker changed something
+        cache.set(refdata.VERSION_KEY, "elsewhere")
+        with self.assertNumQueries(1):
+            self.assertEqual(refdata.snapshot().default_category_id, general)
+
+    def test_missing_tags_are_created_once(self):
+        ids = refdata.tag_ids(["alpha", " beta ", ""])
+        self.assertEqual(sorted(Tag.objects.values_list("name", flat=True)), ["alpha", "beta"])
+        Tag.objects.bulk_create(Tag(name=f"other-{i}") for i in range(50))
+        with self.assertNumQueries(1):
+            self.assertCountEqual(refdata.tag_ids(["beta", "alpha"]), ids)
+        # Creating tags leaves the categories cached
+        with self.assertNumQueries(0):
+            refdata.snapshot()
+
+
+class FacetsTestCase(TestCase):
+    """ Tag diffs touch only what changed; facet counts are one query, then cached until data changes. """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner", email="owner@example.com")
+        self.other = User.objects.create_user("other", email="other@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.pdf, self.txt = (Category.objects.create(name=name) for name in ("Pdfs", "Texts"))
+        self.tags = {name: Tag.objects.create(name=name) for name in ("red", "green", "blue")}
+        self.files = [
+            UploadedFile.objects.create(name=name, owner=owner, category=category, file_type=name.split(".")[1])
+            for name, owner, category in [
+                ("a.pdf", self.owner, self.pdf), ("b.pdf", self.owner, self.pdf),
+                ("c.txt", self.owner, self.txt), ("d.pdf", self.other, self.pdf),
+            ]
+        ]
+        self.files[0].set_tags([self.tags["red"].pk, self.tags["green"].pk])
+        self.files[1].set_tags([self.tags["red"].pk])
+
+    def test_set_tags_is_a_diff(self):
+        through = UploadedFile.meta_tags.through
+        kept = through.objects.get(uploadedfile=self.files[0], tag=self.tags["red"]).pk
+        with self.assertNumQueries(3):
+            self.files[0].set_tags([self.tags["red"].pk, self.tags["blue"].pk])
+        self.assertEqual(through.objects.get(uploadedfile=self.files[0], tag=self.tags["red"]).pk, kept)
+        self.assertCountEqual(self.files[0].meta_tags.values_list("name", flat=True), ["red", "blue"])
+
+        response = self.client.patch(f"/files-update/{self.files[0].id}/", {"name": "renamed.pdf"}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.files[0].meta_tags.count(), 2)
+
+    def test_folder_facets_are_counted_once(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/facets/")
+        self.assertEqual(
+            {facet: {entry["name"]: entry["count"] for entry in entries} for facet, entries in response.data.items()},
+            {
+                "tags": {"red": 2, "green": 1},
+                "categories": {"Pdfs": 2, "Texts": 1},
+                "file_types": {"pdf": 2, "txt": 1},
+                "owners": {"owner@example.com": 3},
+            },
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/facets/").data, response.data)
+
+        self.files[2].set_tags([self.tags["red"].pk])
+        self.assertEqual(self.client.get("/facets/").data["tags"][0], {"id": str(self.tags["red"].pk), "name": "red", "count": 3})
+
+    def test_only_relevant_saves_expire_counts(self):
+        self.client.get("/facets/")
+        self.files[0].is_starred = True
+        self.files[0].save()
+        folder = Folder.objects.create(name="Empty", owner=self.owner)
+        folder.name = "Renamed"
+        folder.save()
+        with self.assertNumQueries(0):
+            self.client.get("/facets/")
+
+        self.files[0].is_archived = True
+        self.files[0].save()
+        self.assertEqual(self.client.get("/facets/").data["categories"][0]["count"], 1)
+        self.files[1].folder = folder
+        self.files[1].save()
+        self.assertEqual(self.client.get("/facets/").data["categories"], [{"id": str(self.txt.pk), "name": "Texts", "count": 1}])
+
+    def test_search_facets(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for uploaded_file in self.files:
+                search.index_file(uploaded_file.pk)
+        response = self.client.get("/facets/", {"q": "pdf"})
+        self.assertEqual(response.data["file_types"], [{"id": "pdf", "name": "pdf", "count": 2}])
+
+
+class BatchUploadTestCase(ResourceTestCase):
+    """ A multi-file upload is checked in one query, stored in one transaction and answered with a delta. """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.folder = Folder.objects.create(name="Inbox", owner=self.owner)
+        self.upload(["report.txt"])
+
+    def upload(self, names, on_conflict=None, shared_with=None):
+        data = {"files": [SimpleUploadedFile(name, f"{name} {i}".encode()) for i, name in enumerate(names)], "folder_id": self.folder.id}
+        if on_conflict:
+            data["on_conflict"] = on_conflict
+        if shared_with:
+            data["shared_with"] = [user.id for user in shared_with]
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post("/file-upload/", data)
+
+    def names(self):
+        return sorted(UploadedFile.objects.filter(folder=self.folder).values_list("name", flat=True))
+
+    def test_conflicts_reject_the_whole_batch(self):
+        response = self.upload(["notes.txt", "report.txt"])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([r["status"] for r in response.data["results"]], ["created", "conflict"])
+        self.assertEqual(self.names(), ["report.txt"])
+
+    def test_rename_skip_and_new_version(self):
+        response = self.upload(["report.txt", "report.txt", "notes.txt"], on_conflict="rename")
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual([r["stored_as"] for r in response.data["results"]], ["report (1).txt", "report (2).txt", "notes.txt"])
+        self.assertEqual(len(response.data["uploaded_files"]), 3)
+        self.assertNotIn("files", response.data)
+
+        response = self.upload(["notes.txt", "todo.txt"], on_conflict="skip")
+        self.assertEqual([r["status"] for r in response.data["results"]], ["skipped", "created"])
+
+        response = self.upload(["report.txt"], on_conflict="new_version")
+        self.assertEqual(response.data["results"][0]["status"], "new_version")
+        report = UploadedFile.objects.get(folder=self.folder, name="report.txt")
+        self.assertEqual(report.versions.count(), 2)
+        self.assertEqual(report.file.read(), b"report.txt 0")
+        self.assertEqual(self.names(), ["notes.txt", "report (1).txt", "report (2).txt", "report.txt", "todo.txt"])
+
+    def test_new_version_of_a_shared_file_is_not_shared_again(self):
+        reader = User.objects.create_user("reader")
+        for _ in range(2):
+            response = self.upload(["report.txt"], on_conflict="new_version", shared_with=[reader])
+            self.assertEqual(response.status_code, 201, response.content)
+        report = UploadedFile.objects.get(folder=self.folder, name="report.txt")
+        self.assertEqual(FileSharing.objects.filter(file=report, shared_to=reader).count(), 1)
+        self.assertEqual(AccessGrant.objects.filter(file=report, grantee=reader.id, reason=AccessGrant.SHARED).count(), 1)
+        self.assertEqual(ShareCounter.objects.unseen(reader), 1)
+
+    def test_query_count_is_flat(self):
+        # Search indexing runs per file after the commit and is left out here
+        self.assertFlatQueries(
+            lambda size: [SimpleUploadedFile(f"batch-{size}-{i}.txt", f"batch-{size}-{i}".encode()) for i in range(size)],
+            lambda files: self.client.post("/file-upload/", {"files": files, "folder_id": self.folder.id}),
+            sizes=(2, 12),
+        )
+        self.assertEqual(AccessGrant.objects.filter(file__folder=self.folder, grantee=self.owner.pk).count(), 15)
+
+    def test_processing_sniffs_types_and_reports_progress(self):
+        data = {
+            "files": [SimpleUploadedFile("scan.txt", b"%PDF-1.7 scanned"), SimpleUploadedFile("data.bin", b'{"a": 1}')],
+            "folder_id": self.folder.id,
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/file-upload/", data)
+        self.assertEqual(response.status_code, 201, response.content)
+
+        mime_types = dict(UploadedFile.objects.filter(folder=self.folder).values_list("name", "blob__mime_type"))
+        self.assertEqual(mime_types["scan.txt"], "application/pdf")
+        self.assertEqual(mime_types["data.bin"], "application/json")
+
+        progress = self.client.get(response.data["processing_url"])
+        self.assertEqual((progress.data["total"], progress.data["done"], progress.data["failed"]), (2, 2, 0))
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user("other"))
+        self.assertEqual(other.get(response.data["processing_url"]).status_code, 404)
+
+
+@override_settings(RENDITION_CACHE_DIR=tempfile.mkdtemp())
+@override_settings(RENDITION_WORKERS=0)
+class RenditionTestCase(ResourceTestCase):
+    """ Thumbnails are rendered once, cached by content and size, and trimmed least recently used first. """
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(renditions.cache_dir(), ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        # The rendition view is a plain Django view and reads the session
+        self.client.force_login(self.owner)
+
+    def upload(self, name, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/file-upload/", {"files": [SimpleUploadedFile(name, content)]})
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.data["uploaded_files"][0]
+
+    def png(self, width, height):
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new("RGBA", (width, height), (200, 30, 30, 128)).save(buffer, "PNG")
+        return buffer.getvalue()
+
+    def test_thumbnail_is_rendered_once_and_cached(self):
+        from PIL import Image
+
+        uploaded = self.upload("photo.png", self.png(400, 200))
+        with mock.patch.object(renditions, "render", wraps=renditions.render) as render:
+            response = self.client.get(uploaded["thumbnail_url"])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "image/jpeg")
+            self.assertIn("immutable", response["Cache-Control"])
+            self.assertEqual(Image.open(io.BytesIO(b"".join(response.streaming_content))).size, (64, 32))
+            self.assertEqual(self.client.get(uploaded["thumbnail_url"]).status_code, 200)
+        self.assertEqual(render.call_count, 1)
+
+        self.assertIsNone(self.upload("notes.txt", b"plain text")["thumbnail_url"])
+        other = APIClient()
+        other.force_login(User.objects.create_user("other"))
+        self.assertEqual(other.get(uploaded["thumbnail_url"]).status_code, 404)
+
+    @override_settings(RENDITION_WORKERS=1)
+    def test_requests_queue_renders_in_the_background(self):
+        uploaded = self.upload("photo.png", self.png(300, 100))
+        self.addCleanup(setattr, renditions, "_pool", None)
+        response = self.client.get(uploaded["thumbnail_url"])
+        self.assertEqual((response.status_code, response["Retry-After"]), (404, "5"))
+        # The pool runs jobs in order: once this one ran, the render has too
+        renditions._executor().submit(lambda: None).result()
+        self.assertEqual(self.client.get(uploaded["thumbnail_url"]).status_code, 200)
+
+    def test_timeouts_are_retried_later(self):
+        uploaded = self.upload("photo.png", self.png(200, 100))
+        timeout = subprocess.TimeoutExpired("pdftoppm", renditions.RENDER_TIMEOUT)
+        with mock.patch.object(renditions, "render", side_effect=timeout) as render:
+            self.assertEqual(self.client.get(uploaded["thumbnail_url"]).status_code, 404)
+            self.assertEqual(self.client.get(uploaded["thumbnail_url"]).status_code, 404)
+        self.assertEqual(render.call_count, 1)
+
+        renditions._retry_at.clear()
+        self.assertEqual(self.client.get(uploaded["thumbnail_url"]).status_code, 200)
+
+    def test_eviction_drops_least_recently_used(self):
+        paths = []
+        for i in range(4):
+            path = renditions._path(f"{i:02d}" + "0" * 62, 64)
+            renditions._write(path, b"x" * 100)
+            os.utime(path, (1000 + i, 1000 + i))
+            paths.append(path)
+        os.utime(paths[0], (5000, 5000))  # recently served
+
+        self.assertEqual(renditions.evict(limit=300), 200)
+        self.assertEqual([os.path.exists(path) for path in paths], [True, False, False, True])
+
+
+class StorageUsageTestCase(ResourceTestCase):
+    """ Folder and user totals follow uploads, versions, moves and deletes without recounting. """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.root = Folder.objects.create(name="Projects", owner=self.owner)
+        self.child = Folder.objects.create(name="Reports", parent=self.root, owner=self.owner)
+        self.other = Folder.objects.create(name="Archive", owner=self.owner)
+
+    def upload(self, folder, name, content):
+        response = self.client.post("/file-upload/", {"files": [SimpleUploadedFile(name, content)], "folder_id": folder.id})
+        self.assertEqual(response.status_code, 201, response.content)
+        return UploadedFile.objects.get(pk=response.data["uploaded_files"][0]["id"])
+
+    def totals(self, folder):
+        folder.refresh_from_db()
+        return folder.tree_bytes, folder.tree_version_bytes, folder.tree_files
+
+    def test_totals_follow_changes(self):
+        report = self.upload(self.child, "report.txt", b"x" * 100)
+        self.upload(self.root, "notes.txt", b"y" * 10)
+        self.assertEqual(self.totals(self.child), (100, 0, 1))
+        self.assertEqual(self.totals(self.root), (110, 0, 2))
+
+        blob = store_blob(SimpleUploadedFile("report.txt", b"z" * 40))
+        report.add_version(blob, file_name="report.txt", uploaded_by=self.owner)
+        # Base version (100) and new version (40) in the history, the new content current
+        self.assertEqual(self.totals(self.root), (50, 140, 2))
+
+        self.child.parent = self.other
+        self.child.save()
+        self.assertEqual(self.totals(self.root), (10, 0, 1))
+        self.assertEqual(self.totals(self.other), (40, 140, 1))
+
+        report.delete()
+        self.assertEqual(self.totals(self.other), (0, 0, 0))
+        response = self.client.get("/storage-usage/")
+        self.assertEqual((response.data["bytes"], response.data["version_bytes"], response.data["files"]), (10, 0, 1))
+        self.assertEqual(StorageUsage.objects.drift(), ({}, {}))
+
+    def test_verify_repairs_drift_and_quota_blocks_uploads(self):
+        self.upload(self.child, "report.txt", b"x" * 100)
+        Folder.objects.filter(pk=self.root.pk).update(tree_bytes=5)
+        StorageUsage.objects.filter(pk=self.owner.pk).delete()
+
+        self.assertEqual(StorageUsage.objects.reconcile(), (1, 1))
+        self.assertEqual(self.totals(self.root), (100, 0, 1))
+        self.assertEqual(StorageUsage.objects.for_user(self.owner).used, 100)
+
+        with override_settings(STORAGE_QUOTA_BYTES=150):
+            response = self.client.post("/file-upload/", {"files": [SimpleUploadedFile("big.txt", b"b" * 60)], "folder_id": self.root.id})
+            self.assertEqual(response.status_code, 413)
+            self.upload(self.root, "small.txt", b"s" * 50)
+
+
+class ZipDownloadTestCase(ResourceTestCase):
+    """ Folder and selection downloads stream a ZIP with folder paths, storing compressed types as they are. """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.client.force_login(self.owner)
+        self.root = Folder.objects.create(name="Projects", owner=self.owner)
+        self.child = Folder.objects.create(name="Reports", parent=self.root, owner=self.owner)
+        Folder.objects.create(name="Empty", parent=self.root, owner=self.owner)
+        self.notes = self.upload(self.root, "notes.txt", b"notes " * 1000)
+        self.photo = self.upload(self.child, "photo.jpg", b"\xff\xd8\xff" + b"jpeg" * 100)
+
+    def upload(self, folder, name, content):
+        response = self.client.post("/file-upload/", {"files": [SimpleUploadedFile(name, content)], "folder_id": folder.id})
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.data["uploaded_files"][0]["id"]
+
+    def download(self, query):
+        response = self.client.get(f"/download-zip/?{query}")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+
+    def test_folder_download_keeps_paths(self):
+        archive = self.download(f"folder={self.root.id}")
+        self.assertEqual(sorted(archive.namelist()), [
+            "Projects/", "Projects/Empty/", "Projects/Reports/", "Projects/Reports/photo.jpg", "Projects/notes.txt",
+        ])
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.read("Projects/notes.txt"), b"notes " * 1000)
+        self.assertEqual(archive.getinfo("Projects/notes.txt").compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(archive.getinfo("Projects/Reports/photo.jpg").compress_type, zipfile.ZIP_STORED)
+
+    def test_selection_download_only_includes_visible_files(self):
+        other = User.objects.create_user("other")
+        hidden = UploadedFile.objects.create(name="notes.txt", file=SimpleUploadedFile("n.txt", b"secret"), owner=other)
+        archive = self.download(f"files={self.notes},{self.photo},{hidden.id}")
+        self.assertEqual(sorted(archive.namelist()), ["notes.txt", "photo.jpg"])
+        self.assertEqual(self.client.get("/download-zip/?files=abc").status_code, 400)
+
+    async def test_asgi_sends_the_archive_while_it_is_built(self):
+        opened, opened_at_first_chunk = [], []
+
+        def open_source(name, mode):
+            opened.append(name)
+            return default_storage.open(name, mode)
+
+        def on_chunk(chunk):
+            if not opened_at_first_chunk:
+                opened_at_first_chunk.append(len(opened))
+
+        cookie = f"sessionid={self.client.cookies['sessionid'].value}"
+        with mock.patch("resource.archive.default_storage", mock.Mock(open=open_source)):
+            status, body = await asgi_get(f"/download-zip/?folder={self.root.id}", cookie, on_chunk)
+        self.assertEqual(status, 200)
+        # The first bytes left before the files were read
+        self.assertEqual((opened_at_first_chunk, len(opened)), ([0], 2))
+        self.assertIn("Projects/Reports/photo.jpg", zipfile.ZipFile(io.BytesIO(body)).namelist())
+
+
+class BulkActionTestCase(ResourceTestCase):
+    """ Bulk actions touch only the user's own items, with the same queries for 2 items or 20. """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner")
+        self.reader = User.objects.create_user("reader")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.inbox = Folder.objects.create(name="Inbox", owner=self.owner)
+        self.shared = Folder.objects.create(name="Shared", owner=self.owner)
+        FileSharing.objects.create(folder=self.shared, shared_by=self.owner, shared_to=self.reader, share_type=FileSharing.FOLDER)
+        self.foreign = UploadedFile.objects.create(name="foreign.txt", owner=self.reader)
+
+    def upload(self, folder, count, prefix="file"):
+        response = self.client.post("/file-upload/", {
+            "files": [SimpleUploadedFile(f"{prefix}{i}.txt", b"x" * 10) for i in range(count)], "folder_id": folder.id,
+        })
+        self.assertEqual(response.status_code, 201, response.content)
+        return [entry["id"] for entry in response.data["uploaded_files"]]
+
+    def bulk(self, action, file_ids=(), folder_ids=(), **extra):
+        return self.client.post("/bulk-actions/", {"action": action, "file_ids": list(file_ids), "folder_ids": list(folder_ids), **extra}, format="json")
+
+    def test_star_and_archive_skip_foreign_items(self):
+        ids = self.upload(self.inbox, 2)
+        response = self.bulk("star", ids + [self.foreign.id], [self.inbox.id])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(sorted(f["id"] for f in response.data["files"] if f["is_starred"]), ids)
+        self.assertEqual(response.data["folders"], [{"id": self.inbox.id, "is_starred": True}])
+        self.assertEqual(response.data["skipped"], {"files": [self.foreign.id], "folders": []})
+        self.assertFalse(UploadedFile.objects.get(pk=self.foreign.id).is_starred)
+
+        response = self.bulk("archive", ids, [self.inbox.id])
+        self.assertEqual(UploadedFile.objects.filter(pk__in=ids, is_archived=True).count(), 2)
+        self.assertEqual(response.data["skipped"]["folders"], [self.inbox.id])
+        self.assertEqual(self.bulk("shred", ids).status_code, 400)
+        self.assertEqual(self.bulk("star").status_code, 400)
+
+    def test_move_updates_access_and_usage_in_constant_queries(self):
+        self.assertFlatQueries(
+            lambda size: self.upload(self.inbox, size, prefix=f"batch{size}-"),
+            lambda ids: self.bulk("move", ids, folder_id=self.shared.id),
+        )
+
+        self.assertEqual(UploadedFile.objects.visible_to(self.reader).filter(folder=self.shared).count(), 22)
+        self.shared.refresh_from_db()
+        self.inbox.refresh_from_db()
+        self.assertEqual((self.shared.tree_bytes, self.shared.tree_files, self.inbox.tree_files), (220, 22, 0))
+        self.assertEqual(StorageUsage.objects.drift(), ({}, {}))
+
+        # Taken names and moves into a folder's own subtree are skipped
+        clash = self.upload(self.inbox, 1, prefix="batch2-")
+        child = Folder.objects.create(name="Child", parent=self.shared, owner=self.owner)
+        response = self.bulk("move", clash, folder_id=self.shared.id)
+        self.assertEqual(response.data["skipped"]["files"], clash)
+        response = self.bulk("move", folder_ids=[self.shared.id], folder_id=child.id)
+        self.assertEqual(response.data["skipped"]["folders"], [self.shared.id])
+        self.assertEqual(self.bulk("move", clash, folder_id=self.foreign.id + 1000).status_code, 404)
+
+    def test_delete_removes_folders_files_and_charges(self):
+        loose = self.upload(self.inbox, 3)
+        nested = Folder.objects.create(name="Nested", parent=self.shared, owner=self.owner)
+        inside = self.upload(nested, 2)
+        version = store_blob(SimpleUploadedFile("file0.txt", b"v" * 5))
+        UploadedFile.objects.get(pk=inside[0]).add_version(version, file_name="file0.txt", uploaded_by=self.owner)
+
+        response = self.bulk("delete", loose[:2] + [self.foreign.id], [self.shared.id])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data["skipped"], {"files": [self.foreign.id], "folders": []})
+        self.assertEqual(set(UploadedFile.objects.values_list("id", flat=True)), {loose[2], self.foreign.id})
+        self.assertFalse(Folder.objects.filter(pk__in=[self.shared.id, nested.id]).exists())
+        self.assertEqual(StorageUsage.objects.drift(), ({}, {}))
+        self.assertEqual(StorageUsage.objects.for_user(self.owner).files, 1)
@@ -0,0 +1,74 @@
+from collections import defaultdict
+
+from django.db.models import Q
+
+from .models import Folder, UploadedFile
+from .serializers import FolderSerializer, UploadedFileSerializer
+
+
+DEFAULT_TREE_DEPTH = 1
+MAX_TREE_DEPTH = 10
+
+
+def parse_depth(value):
+    """ Read a `depth` query parameter, clamped to 1..MAX_TREE_DEPTH. """
+    try:
+        depth = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_TREE_DEPTH
+    return max(1, min(depth, MAX_TREE_DEPTH))
+
+
+def load_folder_tree(user, folder_id=None, depth=DEFAULT_TREE_DEPTH, context=None):
+    """
+    Load the folders and files under `folder_id` (root when None) down to `depth` levels.
+
+    The whole bounded subtree comes back from one indexed path-prefix query and the
+    files of every expanded folder from a second one, however wide the tree is.
+    Folders on the last level are returned with their child counts only, so the
+    client can expand them lazily with another call.
+    """
+    folders = Folder.objects.visible_to(user).select_related('owner').with_child_counts()
+    if folder_id is None:
+        last_level = depth - 1
+        folders = folders.filter(level__lte=last_level)
+    else:
+        root = Folder.objects.filter(pk=folder_id).values('path', 'level').first()
+        if root is None:
+            return {'folders': [], 'files': []}
+        last_level = root['level'] + depth
+        folders = folders.filter(path__startswith=root['path'], level__gt=root['level'], level__lte=last_level)
+
+    # Parents sort before their children, so anything under a hidden folder is dropped here
+    reachable = {folder_id}
+    kept = []
+    for folder in folders.order_by('level', '-created_at'):
+        if folder.parent_id in reachable:
+            reachable.add(folder.id)
+            kept.append(folder)
+
+    expanded = [folder_id] + [folder.id for folder in kept if folder.level < last_level]
+
+    files = UploadedFile.objects.visible_to(user).for_listing()
+    if folder_id is None:
+        files = files.filter(Q(folder__isnull=True) | Q(folder_id__in=expanded[1:]))
+    else:
+        files = files.filter(folder_id__in=expanded)
+    files = files.order_by('-uploaded_at')
+
+    files_by_folder = defaultdict(list)
+    for data in UploadedFileSerializer(files, many=True, context=context).data:
+        files_by_folder[data['folder']].append(data)
+
+    expanded_ids = set(expanded)
+    children = defaultdict(list)
+    for data in FolderSerializer(kept, many=True, context=context).data:
+        children[data['parent']].append(data)
+        if data['id'] in expanded_ids:
+            data['subfolders'] = children[data['id']]
+            data['files'] = files_by_folder.get(data['id'], [])
+
+    return {
+        'folders': children.get(folder_id, []),
+        'files': files_by_folder.get(folder_id, []),
+    }
@@ -0,0 +1,306 @@
+"""
+Resumable uploads.
+
+The session row is locked only to check and advance the offset. A chunk is written
+under a short lease (`writing_until`) that a second request for the same session can't
+take, so the body streams to the staging file without holding a row lock or a
+transaction open.
+
+The SHA-256 is updated as each chunk arrives. hashlib state can't be saved to the
+database, so each process keeps the running hash of the sessions it is receiving and
+catches up from the staged bytes when a chunk lands on a process that didn't see the
+previous one; the digest is saved with the last chunk, and finalizing only hashes the
+staging file if that never happened (an empty file, or a session from before digests
+were kept).
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .blobs import store_blob
+from .models import Blob, Folder, StorageUsage, UploadedFile, UploadSession, upload_session_expiry
+from .serializers import UploadSessionSerializer, UploadedFileSerializer
+
+
+READ_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = getattr(settings, 'UPLOAD_MAX_CHUNK_SIZE', 64 * 1024 * 1024)
+# Slowest client upload rate a chunk's write lease allows for, in bytes per second
+MIN_UPLOAD_RATE = 64 * 1024
+LEASE = 60
+
+# Running SHA-256 of the sessions this process is receiving: session id -> (hasher, bytes hashed)
+MAX_HASHERS = 256
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+class StagedFile(File):
+    """ A finished staging file; FileSystemStorage moves it into place instead of copying it. """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def _staging_path(session):
+    path = default_storage.path(session.staging_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def _session_for_update(request, session_id):
+    return get_object_or_404(UploadSession.objects.select_for_update(), id=session_id, owner=request.user)
+
+
+def _request_offset(request):
+    value = request.headers.get("Upload-Offset", request.GET.get("offset"))
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _lease_for(size):
+    """ How long writing `size` bytes may hold a session. """
+    return timedelta(seconds=LEASE + size / MIN_UPLOAD_RATE)
+
+
+def _gone():
+    return Response({"error": "This upload has expired."}, status=status.HTTP_410_GONE)
+
+
+def _hash_staged(path, length):
+    """ SHA-256 of the first `length` bytes of the staging file. """
+    sha256 = hashlib.sha256()
+    if length:
+        with open(path, "rb") as staged:
+            while length > 0:
+                data = staged.read(min(READ_SIZE, length))
+                if not data:
+                    break
+                sha256.update(data)
+                length -= len(data)
+    return sha256
+
+
+def _hasher_at(session_id, offset, path):
+    """ The session's running SHA-256 over its first `offset` bytes. """
+    with _hashers_lock:
+        entry = _hashers.pop(session_id, None)
+    if entry is not None and entry[1] == offset:
+        return entry[0]
+    # The previous chunks went to another process (or this one restarted)
+    return _hash_staged(path, offset)
+
+
+def _keep_hasher(session_id, sha256, offset):
+    with _hashers_lock:
+        _hashers[session_id] = (sha256, offset)
+        while len(_hashers) > MAX_HASHERS:
+            _hashers.popitem(last=False)
+
+
+def _drop_hasher(session_id):
+    with _hashers_lock:
+        _hashers.pop(session_id, None)
+
+
+class UploadSessionCreateView(APIView):
+    """
+    Start a resumable upload.
+
+    The client then PUTs chunks to the session at increasing offsets, can GET the
+    session to find out how much arrived after a dropped connection, and POSTs to
+    finalize/ once `received` equals `total_size`. A session that receives nothing for
+    UPLOAD_SESSION_TTL expires.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = UploadSessionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        target_file = data.get("target_file")
+        if target_file and target_file.owner_id != request.user.id:
+            return Response({"error": "You are not authorized to upload a new version of this file."}, status=status.HTTP_403_FORBIDDEN)
+        folder = data.get("folder")
+        if folder and not Folder.objects.visible_to(request.user).filter(pk=folder.pk).exists():
+            return Response({"error": "You are not authorized to upload to this folder."}, status=status.HTTP_403_FORBIDDEN)
+        if not target_file and UploadedFile.objects.filter(name=data["file_name"], folder=folder).exists():
+            return Response({"error": f"File '{data['file_name']}' already exists in this folder"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not StorageUsage.objects.allows(request.user, data["total_size"]):
+            return Response({"error": "Storage quota exceeded"}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        serializer.save(owner=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class UploadSessionView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, session_id):
+        session = get_object_or_404(UploadSession, id=session_id, owner=request.user)
+        return Response(UploadSessionSerializer(session).data)
+
+    def put(self, request, session_id):
+        """ Write the raw request body at `offset`, streaming it to the staging file. """
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+        offset = _request_offset(request)
+        if offset is None:
+            return Response({"error": "An Upload-Offset header or offset parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+        if length > MAX_CHUNK_SIZE:
+            return Response({"error": f"Chunks may be at most {MAX_CHUNK_SIZE} bytes."}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        now = timezone.now()
+        lease = now + _lease_for(length)
+        with transaction.atomic():
+            session = _session_for_update(request, session_id)
+            if session.status != UploadSession.ACTIVE:
+                return Response({"error": "This upload is already complete."}, status=status.HTTP_409_CONFLICT)
+            if session.is_expired:
+                return _gone()
+            if session.writing_until and session.writing_until > now:
+                return Response({"error": "Another chunk of this upload is still being written.", "received": session.received}, status=status.HTTP_409_CONFLICT)
+            if offset != session.received:
+                return Response({"error": "Offset does not match the bytes received so far.", "received": session.received}, status=status.HTTP_409_CONFLICT)
+            if offset + length > session.total_size:
+                return Response({"error": "Chunk runs past the declared file size."}, status=status.HTTP_400_BAD_REQUEST)
+            session.writing_until = lease
+            session.save(update_fields=["writing_until"])
+
+        path = _staging_path(session)
+        sha256 = _hasher_at(session.pk, offset, path)
+        written = 0
+        try:
+            with open(path, "r+b" if os.path.exists(path) else "wb") as staged:
+                # Drop anything past `received` left by an interrupted chunk
+                staged.seek(offset)
+                staged.truncate()
+                while written < length:
+                    data = request.stream.read(min(READ_SIZE, length - written)) if request.stream else b""
+                    if not data:
+                        break
+                    staged.write(data)
+                    sha256.update(data)
+                    written += len(data)
+        finally:
+            # Whatever reached the disk counts, so a dropped chunk resumes where it broke off
+            received = offset + written
+            fields = {"received": received, "writing_until": None, "updated_at": timezone.now(), "expires_at": upload_session_expiry()}
+            if received == session.total_size:
+                fields["sha256"] = sha256.hexdigest()
+            # Only while the lease is ours: if it ran out, another request owns the session now
+            advanced = UploadSession.objects.filter(pk=session.pk, received=offset, writing_until=lease).update(**fields)
+
+        if not advanced:
+            return Response({"error": "This upload was taken over by another request."}, status=status.HTTP_409_CONFLICT)
+        if received < session.total_size:
+            _keep_hasher(session.pk, sha256, received)
+        return Response({"received": received, "total_size": session.total_size})
+
+    def delete(self, request, session_id):
+        with transaction.atomic():
+            session = _session_for_update(request, session_id)
+            default_storage.delete(session.staging_name)
+            session.delete()
+        _drop_hasher(session_id)
+        return Response({"message": "Upload cancelled."})
+
+
+class FinalizeUploadView(APIView):
+    """
+    Turn a fully received session into a file (or a new version of `target_file`).
+    A `sha256` in the body, or the session's `expected_sha256`, must match the bytes.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, session_id):
+        now = timezone.now()
+        with transaction.atomic():
+            session = _session_for_update(request, session_id)
+            if session.status == UploadSession.COMPLETE:
+                return Response({"file": UploadedFileSerializer(session.result_file, context={"request": request}).data})
+            if session.is_expired:
+                return _gone()
+            if session.received != session.total_size:
+                return Response({"error": "The upload is incomplete.", "received": session.received}, status=status.HTTP_400_BAD_REQUEST)
+            if session.writing_until and session.writing_until > now:
+                return Response({"error": "This upload is already being finalized."}, status=status.HTTP_409_CONFLICT)
+            if not session.target_file and UploadedFile.objects.filter(name=session.file_name, folder=session.folder).exists():
+                return Response({"error": f"File '{session.file_name}' already exists in this folder"}, status=status.HTTP_400_BAD_REQUEST)
+            # Hashing and storing happen outside the lock, under the same lease chunks use
+            lease = now + _lease_for(session.total_size)
+            session.writing_until = lease
+            session.save(update_fields=["writing_until"])
+
+        path = _staging_path(session)
+        if session.total_size == 0:
+            open(path, "wb").close()
+        digest = session.sha256 or _hash_staged(path, session.total_size).hexdigest()
+        expected = str(request.data.get("sha256") or session.expected_sha256).lower()
+        if expected and expected != digest:
+            UploadSession.objects.filter(pk=session.pk, writing_until=lease).update(writing_until=None)
+            return Response({"error": "The uploaded bytes do not match the checksum.", "sha256": digest}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # An earlier attempt that failed after storing the bytes has moved the staging file
+            blob = Blob.objects.filter(sha256=digest).first()
+            if blob is None:
+                with StagedFile(open(path, "rb"), name=session.file_name) as staged:
+                    staged.sha256 = digest
+                    blob = store_blob(staged)
+
+            with transaction.atomic():
+                session = _session_for_update(request, session_id)
+                if session.writing_until != lease:
+                    return Response({"error": "This upload was taken over by another request."}, status=status.HTTP_409_CONFLICT)
+                if not session.target_file and UploadedFile.objects.filter(name=session.file_name, folder=session.folder).exists():
+                    return Response({"error": f"File '{session.file_name}' already exists in this folder"}, status=status.HTTP_400_BAD_REQUEST)
+
+                if session.target_file:
+                    uploaded_file = session.target_file
+                    uploaded_file.add_version(blob, file_name=session.file_name, uploaded_by=request.user, change_note=session.change_note)
+                else:
+                    uploaded_file = UploadedFile(
+                        name=session.file_name,
+                        folder=session.folder,
+                        category=session.category,
+                        owner=request.user,
+                        is_public=session.is_public,
+                    )
+                    uploaded_file.use_blob(blob)
+                    uploaded_file.save()
+
+                session.status = UploadSession.COMPLETE
+                session.result_file = uploaded_file
+                session.sha256 = digest
+                session.writing_until = None
+                # Kept for a while so a retried finalize gets the same answer
+                session.expires_at = upload_session_expiry()
+                session.save(update_fields=["status", "result_file", "sha256", "writing_until", "expires_at", "updated_at"])
+        finally:
+            if session.status != UploadSession.COMPLETE:
+                UploadSession.objects.filter(pk=session.pk, writing_until=lease).update(writing_until=None)
+
+        # Content that was already stored leaves the staging file behind
+        default_storage.delete(session.staging_name)
+        _drop_hasher(session.pk)
+        return Response(
+            {"file": UploadedFileSerializer(uploaded_file, context={"request": request}).data},
+            status=status.HTTP_201_CREATED,
+        )
@@ -1,7 +1,9 @@
 from django.urls import path, include
 from . import views
-from .views import HomeView, FileUploadView, CreateFolderView, FolderContentsView, ToggleStarredView, ToggleArchivedView, ToggleFolderStarredView, logout_view, FileDetailView, UploadNewVersionView, FileVersionHistoryView, RevertVersionView, DeleteUploadedFileView, ReminderViewSet, UpcomingRemindersView
-from .sharing_views import ShareItemView, SharedWithMeView, shared_unseen_count, mark_shared_as_seen, SendFileEmailView
+from .views import HomeView, FileUploadView, CreateFolderView, FolderContentsView, FolderTreeView, SearchFilesView, FacetsView, StorageUsageView, BulkActionView, UploadBatchProgressView, ToggleStarredView, ToggleArchivedView, ToggleFolderStarredView, logout_view, FileDetailView, UploadNewVersionView, FileVersionHistoryView, RevertVersionView, DeleteUploadedFileView, ReminderViewSet, UpcomingRemindersView, NotificationListView, MarkNotificationsReadView
+from .event_views import event_stream
+from .upload_views import UploadSessionCreateView, UploadSessionView, FinalizeUploadView
+from .sharing_views import ShareItemView, SharedWithMeView, shared_unseen_count, mark_shared_as_seen, SendFileEmailView, email_delivery_status
 from rest_framework.routers import DefaultRouter
 
 
@@ -17,26 +19,42 @@ urlpatterns = [
     path('file-upload/', FileUploadView.as_view(), name='file-upload'),  
     path('file-upload/<int:folder_id>/', FileUploadView.as_view(), name='folder-file-upload'),
     path('file/update/<int:file_id>/', FileUploadView.as_view(), name='file-upload-update'),
+    path('uploads/', UploadSessionCreateView.as_view(), name='upload-session-create'),
+    path('uploads/<uuid:session_id>/', UploadSessionView.as_view(), name='upload-session'),
+    path('uploads/<uuid:session_id>/finalize/', FinalizeUploadView.as_view(), name='upload-session-finalize'),
+    path('upload-batches/<uuid:batch_id>/', UploadBatchProgressView.as_view(), name='upload-batch-progress'),
+    path('storage-usage/', StorageUsageView.as_view(), name='storage-usage'),
+    path('bulk-actions/', BulkActionView.as_view(), name='bulk-actions'),
     path('folders/', CreateFolderView.as_view(), name='create_folder'),
     path('folders/<int:parent_id>/', CreateFolderView.as_view(), name='create_subfolder'),
     path('folder-contents/', FolderContentsView.as_view(), name='folder-contents'),  # Root folder contents
     path('folder-contents/<int:folder_id>/', FolderContentsView.as_view(), name='folder_contents'),
+    path('folder-tree/', FolderTreeView.as_view(), name='folder-tree'),
+    path('folder-tree/<int:folder_id>/', FolderTreeView.as_view(), name='folder_tree'),
+    path('search/', SearchFilesView.as_view(), name='search-files'),
+    path('facets/', FacetsView.as_view(), name='facets'),
     path('download-file/<int:file_id>/', views.download_file, name='download_file'),
     path('view-file/<int:file_id>/', views.view_file, name='view_file'),
+    path('download-zip/', views.download_zip, name='download_zip'),
+    path('renditions/<int:blob_id>/<int:size>/', views.rendition, name='rendition'),
     path('files/<int:file_id>/delete/', DeleteUploadedFileView.as_view(), name='delete_uploaded_file'),
     path('send-email/', SendFileEmailView.as_view(), name='send-email'),
+    path('send-email/<uuid:delivery_id>/', email_delivery_status, name='email-delivery'),
     path("files/<int:file_id>/toggle-star/", ToggleStarredView.as_view(), name="toggle-star"),
     path("folders/<int:folder_id>/toggle-star/", ToggleFolderStarredView.as_view(), name="toggle-folder-star"),
     path("files/<int:file_id>/toggle-archive/", ToggleArchivedView.as_view(), name="toggle-archive"),
     path("logout/", logout_view, name="logout"),
     path('api/share/', ShareItemView.as_view(), name='share-item'),
     path('api/shared-with-me/', SharedWithMeView.as_view(), name='shared-with-me'),
-    path("api/shared-with-me/unseen-count/", shared_unseen_count),
-    path("api/shared-with-me/mark-seen/", mark_shared_as_seen),
+    path("api/shared-with-me/unseen-count/", shared_unseen_count, name="shared-unseen-count"),
+    path("api/shared-with-me/mark-seen/", mark_shared_as_seen, name="mark-shared-seen"),
     path("files-update/<int:pk>/", FileDetailView.as_view(), name="file-detail"),
     path('files/<int:file_id>/upload-new-version/', UploadNewVersionView.as_view(), name='upload-new-version'),
     path('files/<int:file_id>/version-history/', FileVersionHistoryView.as_view(), name='version-history'),
     path('files/<int:file_id>/revert-version/<int:version_id>/', RevertVersionView.as_view(), name='revert-version'),
     path('api/', include(router.urls)),
     path("reminders/upcoming/", UpcomingRemindersView.as_view(), name="upcoming-reminders"),
+    path("notifications/", NotificationListView.as_view(), name="notifications"),
+    path("notifications/mark-read/", MarkNotificationsReadView.as_view(), name="mark-notifications-read"),
+    path("events/", event_stream, name="events"),
 ]
@@ -1,12 +1,19 @@
-from django.contrib.postgres.search import SearchVector
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from rest_framework.response import Response
 from rest_framework import status, generics, viewsets
 from rest_framework.views import APIView
 from rest_framework.generics import RetrieveUpdateAPIView
-from .models import UploadedFile, Category, Folder, FileVersion, Reminder
-from .serializers import UploadedFileSerializer, FolderSerializer, FileVersionSerializer, ReminderSerializer
-from django.http import JsonResponse, FileResponse, Http404
+from .models import AccessGrant, UploadedFile, Folder, FileSharing, FileVersion, Notification, Reminder, ShareCounter, StorageUsage
+from .serializers import UploadedFileSerializer, FolderSerializer, FileVersionSerializer, NotificationSerializer, ReminderSerializer
+from .tree import load_folder_tree, parse_depth
+from .pagination import InvalidCursor, paginate_request, parse_limit
+from .blobs import store_blob
+from .delivery import StreamedFileResponse, StreamedResponse, serve_file
+from . import archive, batch_upload, bulk_actions, events, processing, refdata, renditions
+from .search import search_files
+from .facets import facets_for
+from django.http import JsonResponse, FileResponse, Http404, HttpResponseNotFound, StreamingHttpResponse
 from rest_framework.parsers import MultiPartParser, FormParser
 from django.conf import settings
 from django.core.files.storage import default_storage
@@ -14,9 +21,13 @@ from django.core.mail import EmailMessage
 from rest_framework.permissions import IsAuthenticated
 import json
 from django.contrib.auth import logout
+from django.contrib.auth.models import User
 from urllib.parse import urlencode
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Q, prefetch_related_objects
+from django.views.decorators.http import etag
+from django.utils.http import content_disposition_header, quote_etag
 from django.views.generic import TemplateView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.utils.timezone import now
@@ -48,14 +59,15 @@ def myFiles(request, folder_id=None):
     if not request.user.is_authenticated:
         return redirect('/oidc/authenticate/') 
 
+    files = UploadedFile.objects.visible_to(request.user)
+    folders = Folder.objects.visible_to(request.user)
     if folder_id:
-        files = UploadedFile.objects.filter(folder_id=folder_id).order_by("-uploaded_at")  # Get files in the folder
-        folders = Folder.objects.filter(parent_id=folder_id).order_by("-created_at")  
-        # print("folder id exist", files, folders)
+        files = files.filter(folder_id=folder_id).order_by("-uploaded_at")  # Get files in the folder
+        folders = folders.filter(parent_id=folder_id).order_by("-created_at")
     else:
-        files = UploadedFile.objects.filter(folder__isnull=True).order_by("-uploaded_at")  # Get root-level files
-        folders = Folder.objects.filter(parent__isnull=True).order_by("-created_at")  # Get root-level folders
-        # print("folder id DOESNOT exist", files, folders)
+        files = files.filter(folder__isnull=True).order_by("-uploaded_at")  # Get root-level files
+        folders = folders.filter(parent__isnull=True).order_by("-created_at")  # Get root-level folders
+    # The page only decides whether to show the table; base.js loads the rows page by page
     files_exist = files.exists()
     folders_exist = folders.exists()
 
@@ -64,7 +76,7 @@ def myFiles(request, folder_id=None):
         "files": files,
         "folders": folders,
         "files_exist": files_exist,
-        "folders_exist": folders_exist
+        "folders_exist": folders_exist,
     })
 
 
@@ -89,45 +101,59 @@ class FileUploadView(APIView):
 
         folder_name = folder.name if folder else "Root"
 
-        category_id = request.data.get("category_id")
-        category = Category.objects.filter(id=category_id).first() if category_id else Category.get_default_category()
-
-        uploaded_files = []
-        for file_obj in files:
-            file_name = file_obj.name
-            file_type = file_obj.name.split(".")[-1].lower()
-            file_size = file_obj.size
-
-            if UploadedFile.objects.filter(name=file_name, folder=folder).exists():
-                return Response({"error": f"File '{file_name}' already exists in this folder"}, status=status.HTTP_400_BAD_REQUEST)  
-
-            uploaded_file = UploadedFile(
-                name=file_name,
-                file=file_obj,
-                file_type=file_type,
-                file_size=file_size,
-                category=category,
-                folder=folder,
-                owner=request.user, 
-                is_public=request.data.get("is_public", False),
-            )
-            uploaded_file.save()
-            uploaded_files.append(uploaded_file)
+        policy = request.data.get("on_conflict") or batch_upload.ERROR
+        if policy not in batch_upload.POLICIES:
+            return Response({"error": f"on_conflict must be one of {', '.join(batch_upload.POLICIES)}"}, status=status.HTTP_400_BAD_REQUEST)
 
-            shared_with = request.data.get("shared_with", [])
-            if shared_with:
-                uploaded_file.shared_with.set(shared_with)
+        if not StorageUsage.objects.allows(request.user, sum(f.size for f in files)):
+            return Response({"error": "Storage quota exceeded"}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
 
-        all_files = folder.files.order_by("-uploaded_at") if folder else UploadedFile.objects.filter(folder__isnull=True).order_by("-uploaded_at")
-        uploaded_files_serializer = UploadedFileSerializer(uploaded_files, many=True)
-        all_files_serializer = UploadedFileSerializer(all_files, many=True)
+        results, uploaded_files = batch_upload.upload(
+            request.user,
+            folder,
+            files,
+            policy=policy,
+            category_id=refdata.category_id(request.data.get("category_id")),
+            is_public=str(request.data.get("is_public", False)).lower() in ("true", "1", "on"),
+        )
+        conflicts = [r["name"] for r in results if r["status"] == batch_upload.CONFLICT]
+        if conflicts:
+            # Nothing was stored
+            return Response({
+                "error": f"File '{conflicts[0]}' already exists in this folder",
+                "results": results,
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Optional user ids to share the new files with
+        shared_with = request.data.getlist("shared_with") if hasattr(request.data, "getlist") else request.data.get("shared_with", [])
+        if shared_with:
+            shares = [
+                FileSharing(file=uploaded_file, shared_by=request.user, shared_to_id=user_id, share_type=FileSharing.FILE)
+                for user_id in User.objects.filter(id__in=shared_with).values_list("id", flat=True)
+                for uploaded_file in uploaded_files
+            ]
+            with transaction.atomic():
+                # A new version may go to a file that is already shared with some of them
+                created = FileSharing.objects.create_new(shares)
+                AccessGrant.objects.grant_shares(created)
+                ShareCounter.objects.add(created)
+                events.shares_created(created)
+
+        # The batch is committed; sniffing and indexing go on in the background
+        batch_id = processing.start(request.user, [uploaded_file.pk for uploaded_file in uploaded_files])
+
+        # Only what this upload changed; clients that need the whole folder list it separately
+        prefetch_related_objects(uploaded_files, "meta_tags")
+        uploaded_files_serializer = UploadedFileSerializer(uploaded_files, many=True, context={'request': request})
 
         return Response(
             {
                 "message": "Files uploaded successfully",
                 "folder_name": folder_name,
                 "uploaded_files": uploaded_files_serializer.data,
-                "files": all_files_serializer.data,
+                "results": results,
+                "processing_id": str(batch_id),
+                "processing_url": reverse("upload-batch-progress", args=[batch_id]),
             },
             status=status.HTTP_201_CREATED,
         )
@@ -142,7 +168,16 @@ class FileUploadView(APIView):
         all_files = UploadedFile.objects.order_by("-uploaded_at")
         all_folders = Folder.objects.order_by("-created_at")
 
-        search_query = request.GET.get("search", "").strip().lower()
+        search_query = request.GET.get("search", "").strip()
+        if search_query:
+            files = search_files(search_query, request.user, parse_limit(request.GET.get("limit")))
+            return Response({
+                "files": UploadedFileSerializer(files, many=True, context={"request": request}).data,
+                "folders": [],
+                "current_folder": None,
+                "next_cursor": None,
+                "next_folder_cursor": None,
+            })
 
         # file_serializer = UploadedFileSerializer(all_files, many=True)
         # folder_serializer = FolderSerializer(all_folders, many=True)
@@ -159,30 +194,41 @@ class FileUploadView(APIView):
 
 
         if is_archived:
-            files = UploadedFile.objects.filter(is_archived=True).order_by("-uploaded_at")
+            files = UploadedFile.objects.visible_to(request.user).for_listing().filter(is_archived=True)
+            try:
+                files, next_cursor = paginate_request(files, request, "uploaded_at")
+            except InvalidCursor as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
             file_serializer = UploadedFileSerializer(files, many=True)
             return Response({
                 "files": file_serializer.data,
                 "folders": [],  
-                "current_folder": None  
+                "current_folder": None,
+                "next_cursor": next_cursor,
+                "next_folder_cursor": None,
             })
 
 
         if folder_id:
-            files = UploadedFile.objects.filter(folder_id=folder_id)  
-            folders = Folder.objects.filter(parent_id=folder_id)  # Get subfolders
+            files = UploadedFile.objects.visible_to(request.user).for_listing().filter(folder_id=folder_id)
+            folders = Folder.objects.visible_to(request.user).filter(parent_id=folder_id)  # Get subfolders
             # print("For Folder Id Exist",files, folders)
         else:
-            files = UploadedFile.objects.filter(folder__isnull=True)  # Root-level files
-            folders = Folder.objects.filter(parent__isnull=True)  # Root-level folders
+            files = UploadedFile.objects.visible_to(request.user).for_listing().filter(folder__isnull=True)  # Root-level files
+            folders = Folder.objects.visible_to(request.user).filter(parent__isnull=True)  # Root-level folders
             # print("For Folder Id Doesnot Exist",files, folders)
 
         if is_starred:  
             files = files.filter(is_starred=True)
 
         
-        files = files.order_by("-uploaded_at")  
-        folders = folders.order_by("-created_at")  
+        folders = folders.select_related("owner").with_child_counts()  
+
+        try:
+            files, next_cursor = paginate_request(files, request, "uploaded_at")
+            folders, next_folder_cursor = paginate_request(folders, request, "created_at", cursor_param="folder_cursor")
+        except InvalidCursor as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         file_serializer = UploadedFileSerializer(files, many=True, context={'request': request})
         folder_serializer = FolderSerializer(folders, many=True, context={'request': request})
@@ -192,6 +238,8 @@ class FileUploadView(APIView):
             "files": file_serializer.data,
             "folders": folder_serializer.data,
             "current_folder": folder_id,
+            "next_cursor": next_cursor,
+            "next_folder_cursor": next_folder_cursor,
             "current_email": current_email,
             "current_first_name": current_first_name
         })
@@ -210,10 +258,8 @@ class FileUploadView(APIView):
             file.name = request.data.get("name", file.name)
             file.is_public = request.data.get("is_public", file.is_public)
             category_id = request.data.get("category_id")
-            if category_id:
-                category = Category.objects.filter(id=category_id).first()
-                if category:
-                    file.category = category
+            if category_id and str(category_id).isdigit() and int(category_id) in refdata.snapshot().category_ids:
+                file.category_id = int(category_id)
 
             # Update tags (assuming 'meta_tag_names' is the key sent in the request)
             tags = request.data.get("meta_tag_names", [])
@@ -237,17 +283,21 @@ class FileUploadView(APIView):
 
 
 # Fetch Categories
+@etag(lambda request: refdata.snapshot().etag)
 def get_categories(request):
-    categories = Category.objects.all()
-    categories_list = [{"id": category.id, "name": category.name} for category in categories]
-    return JsonResponse({"categories": categories_list})
+    response = JsonResponse({"categories": refdata.snapshot().categories})
+    # Cached, but revalidated against the ETag every time
+    response["Cache-Control"] = "private, no-cache"
+    return response
 
 
 class FileDetailView(RetrieveUpdateAPIView):
-    queryset = UploadedFile.objects.all()
     serializer_class = UploadedFileSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        return UploadedFile.objects.visible_to(self.request.user).for_listing()
+
 
 # Create a Folder
 class CreateFolderView(generics.CreateAPIView):
@@ -293,26 +343,29 @@ class FolderContentsView(generics.RetrieveAPIView):
             # print(current_email)
             is_starred = request.GET.get("starred") == "true"
             is_archived = request.GET.get("archived") == "true"
+            recursive = request.GET.get("recursive") == "true"
 
-            
+            breadcrumbs = []
             if folder_id:
-                # Fetch files and subfolders for the given folder
-                files = UploadedFile.objects.filter(
-                    Q(folder_id=folder_id) & (Q(owner=request.user) | Q(is_public=True))
-                ).order_by("-uploaded_at")
-
-                subfolders = Folder.objects.filter(
-                    Q(parent_id=folder_id) & (Q(owner=request.user) | Q(is_public=True))
-                ).order_by("-created_at")
+                current_folder = get_object_or_404(Folder.objects.visible_to(request.user), id=folder_id)
+                breadcrumbs = [
+                    {"id": folder.id, "name": folder.name}
+                    for folder in [*current_folder.get_ancestors(), current_folder]
+                ]
+
+                # Fetch files (optionally from the whole subtree) and subfolders for the given folder
+                if recursive:
+                    file_scope = Q(folder__path__startswith=current_folder.path)
+                else:
+                    file_scope = Q(folder_id=folder_id)
+                files = UploadedFile.objects.visible_to(request.user).for_listing().filter(file_scope).order_by("-uploaded_at")
+
+                subfolders = Folder.objects.visible_to(request.user).filter(parent_id=folder_id).order_by("-created_at")
             else:
                 # Fetch root-level files and folders
-                files = UploadedFile.objects.filter(
-                    Q(folder__isnull=True) & (Q(owner=request.user) | Q(is_public=True))
-                ).order_by("-uploaded_at")
+                files = UploadedFile.objects.visible_to(request.user).for_listing().filter(folder__isnull=True).order_by("-uploaded_at")
 
-                subfolders = Folder.objects.filter(
-                    Q(parent__isnull=True) & (Q(owner=request.user) | Q(is_public=True))
-                ).order_by("-created_at")
+                subfolders = Folder.objects.visible_to(request.user).filter(parent__isnull=True).order_by("-created_at")
 
             if is_starred:
                 files = files.filter(is_starred=True)
@@ -321,8 +374,13 @@ class FolderContentsView(generics.RetrieveAPIView):
             if is_archived is not None:  
                 files = files.filter(is_archived=is_archived)    
 
-            files = files.order_by("-uploaded_at")
-            subfolders = subfolders.order_by("-created_at")    
+            subfolders = subfolders.select_related("owner").with_child_counts()
+
+            try:
+                files, next_cursor = paginate_request(files, request, "uploaded_at")
+                subfolders, next_folder_cursor = paginate_request(subfolders, request, "created_at", cursor_param="folder_cursor")
+            except InvalidCursor as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
             files_serializer = UploadedFileSerializer(files, many=True, context={'request': request})
             folders_serializer = FolderSerializer(subfolders, many=True, context={'request': request})
@@ -331,39 +389,224 @@ class FolderContentsView(generics.RetrieveAPIView):
                 "files": files_serializer.data,
                 "folders": folders_serializer.data,
                 "current_folder": folder_id,
+                "breadcrumbs": breadcrumbs,
+                "next_cursor": next_cursor,
+                "next_folder_cursor": next_folder_cursor,
                 "current_email": current_email,
                 "current_first_name": current_first_name
             }, status=status.HTTP_200_OK)
         
+        except Http404:
+            return Response({"error": "Folder not found"}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+# Get a folder subtree, `depth` levels deep
+class FolderTreeView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, folder_id=None):
+        depth = parse_depth(request.GET.get("depth"))
+        tree = load_folder_tree(request.user, folder_id, depth, context={'request': request})
+
+        return Response({
+            "folders": tree["folders"],
+            "files": tree["files"],
+            "current_folder": folder_id,
+            "depth": depth,
+        }, status=status.HTTP_200_OK)
+
+
+class SearchFilesView(APIView):
+    """ Ranked full-text search over name, category, tags and document text. """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = request.GET.get("q", "").strip()
+        if not query:
+            return Response({"error": "A search query is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        files = search_files(query, request.user, parse_limit(request.GET.get("limit")))
+        return Response({
+            "query": query,
+            "files": UploadedFileSerializer(files, many=True, context={"request": request}).data,
+        })
+
+
+class FacetsView(APIView):
+    """
+    Counts per tag, category, file type and owner over the files in a folder
+    (`?folder=<id>`, `&recursive=true` for its subtree; root without it) or matching `?q=`.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = request.GET.get("q", "").strip()
+        folder_id = request.GET.get("folder")
+        folder = None
+        if folder_id and not query:
+            if not folder_id.isdigit():
+                return Response({"error": "Invalid folder ID"}, status=status.HTTP_400_BAD_REQUEST)
+            folder = get_object_or_404(Folder.objects.visible_to(request.user), id=folder_id)
+        recursive = request.GET.get("recursive") == "true"
+        return Response(facets_for(request.user, folder, recursive, query or None))
+
+
+class UploadBatchProgressView(APIView):
+    """ Per-file progress of the background processing started by an upload. """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, batch_id):
+        progress = processing.progress(batch_id, request.user)
+        if progress is None:
+            return Response({"error": "Unknown upload batch"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(progress)
+
+
+class StorageUsageView(APIView):
+    """ Storage used by the current user, or with `?folder=<id>` by that folder's subtree. """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        folder_id = request.GET.get("folder")
+        if folder_id:
+            if not folder_id.isdigit():
+                return Response({"error": "Invalid folder ID"}, status=status.HTTP_400_BAD_REQUEST)
+            folder = get_object_or_404(Folder.objects.visible_to(request.user), id=folder_id)
+            return Response({
+                "folder": folder.id,
+                "bytes": folder.tree_bytes,
+                "version_bytes": folder.tree_version_bytes,
+                "files": folder.tree_files,
+            })
+        usage = StorageUsage.objects.for_user(request.user)
+        return Response({
+            "bytes": usage.bytes,
+            "version_bytes": usage.version_bytes,
+            "files": usage.files,
+            "used": usage.used,
+            "quota": usage.limit,
+            "available": None if usage.limit is None else max(usage.limit - usage.used, 0),
+        })
+
+
+class BulkActionView(APIView):
+    """
+    Apply one action to many of the user's files and folders:
+    {"action": "star|unstar|archive|unarchive|move|delete", "file_ids": [...], "folder_ids": [...],
+    "folder_id": <move target, null for the root>}. Ids the user doesn't own are reported as skipped.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def _ids(self, value):
+        if value in (None, ''):
+            return []
+        if not isinstance(value, list) or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in value):
+            raise ValueError
+        return value
+
+    def post(self, request):
+        action = request.data.get("action")
+        if action not in bulk_actions.ACTIONS:
+            return Response({"error": f"action must be one of {', '.join(bulk_actions.ACTIONS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            file_ids = self._ids(request.data.get("file_ids"))
+            folder_ids = self._ids(request.data.get("folder_ids"))
+        except ValueError:
+            return Response({"error": "file_ids and folder_ids must be lists of IDs"}, status=status.HTTP_400_BAD_REQUEST)
+        if not file_ids and not folder_ids:
+            return Response({"error": "No files or folders given"}, status=status.HTTP_400_BAD_REQUEST)
+
+        target = None
+        if action == bulk_actions.MOVE:
+            folder_id = request.data.get("folder_id")
+            if folder_id is not None:
+                if not isinstance(folder_id, int) or isinstance(folder_id, bool):
+                    return Response({"error": "Invalid folder ID"}, status=status.HTTP_400_BAD_REQUEST)
+                target = Folder.objects.filter(id=folder_id, owner=request.user).first()
+                if target is None:
+                    return Response({"error": "Target folder not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response(bulk_actions.apply(request.user, action, file_ids, folder_ids, target))
+
+
 # Download  file
 def download_file(request, file_id):
-    file_instance = get_object_or_404(UploadedFile, id=file_id)
-
-    # Get the file path
-    file_path = file_instance.file.path  # Correct field reference
+    file_instance = get_object_or_404(UploadedFile.objects.visible_to(request.user).select_related("blob"), id=file_id)
 
     try:
-        response = FileResponse(open(file_path, 'rb'), as_attachment=True)
-        response["Content-Disposition"] = f'attachment; filename="{file_instance.name}"'
-        return response
+        return serve_file(request, file_instance, as_attachment=True)
     except FileNotFoundError:
         raise Http404("File not found.")
 
 
+def rendition(request, blob_id, size):
+    """
+    Thumbnail or preview of a file's content. The URL names the content, not the file,
+    so browsers keep the image until a new version changes the link.
+    """
+    if size not in renditions.SIZES:
+        raise Http404("Unknown rendition size.")
+    uploaded_file = UploadedFile.objects.visible_to(request.user).filter(blob_id=blob_id).select_related("blob").first()
+    if uploaded_file is None:
+        raise Http404("File not found.")
+    try:
+        image = renditions.open_rendition(uploaded_file.blob, size, uploaded_file.file_type)
+    except FileNotFoundError:
+        image = None
+    if image == renditions.QUEUED:
+        # Listings fall back to the type icon and pick the image up next time
+        response = HttpResponseNotFound("Preview not rendered yet.")
+        response["Retry-After"] = "5"
+        response["Cache-Control"] = "no-store"
+        return response
+    if image is None:
+        raise Http404("No preview for this file.")
+    response = StreamedFileResponse(image, content_type="image/jpeg")
+    response["ETag"] = quote_etag(f"{uploaded_file.blob.sha256}-{size}")
+    response["Cache-Control"] = "private, max-age=31536000, immutable"
+    return response
+
+
+def download_zip(request):
+    """
+    Stream a ZIP of a folder's subtree (`folder=<id>`) or of selected files (`files=1,2,3`,
+    repeated `files` form fields on POST). Only what the user can see goes in.
+    """
+    params = request.POST if request.method == "POST" else request.GET
+    folder_id = params.get("folder")
+    if folder_id:
+        if not folder_id.isdigit():
+            return JsonResponse({"error": "Invalid folder ID"}, status=400)
+        folder = get_object_or_404(Folder.objects.visible_to(request.user), id=folder_id)
+        directories, files = archive.folder_entries(request.user, folder)
+    else:
+        ids = [value for raw in params.getlist("files") for value in raw.split(",")]
+        if not ids or not all(value.strip().isdigit() for value in ids):
+            return JsonResponse({"error": "Give a folder or a list of file ids"}, status=400)
+        folder, directories = None, []
+        files = archive.selection_entries(request.user, [int(value) for value in ids])
+        if not files:
+            raise Http404("File not found.")
+
+    response = StreamedResponse(archive.stream(directories, files), content_type="application/zip")
+    response["Content-Disposition"] = content_disposition_header(True, archive.archive_name(folder))
+    # Let the first bytes through proxies as soon as they are produced
+    response["X-Accel-Buffering"] = "no"
+    response["Cache-Control"] = "private, no-store"
+    return response
+
+
 def view_file(request, file_id):
     # Retrieve the file instance from the database
-    file_instance = get_object_or_404(UploadedFile, id=file_id)
-    
-    # Get the file path
-    file_path = file_instance.file.path  # Assuming 'file' is the FileField in the model
-    
-    # Open and serve the file directly to the user
-    response = FileResponse(open(file_path, 'rb'))
-    return response
+    file_instance = get_object_or_404(UploadedFile.objects.visible_to(request.user).select_related("blob"), id=file_id)
+
+    # Serve the file inline; supports Range requests so media can seek without re-downloading
+    try:
+        return serve_file(request, file_instance)
+    except FileNotFoundError:
+        raise Http404("File not found.")
 
 
 # def send_email(request):
@@ -519,50 +762,16 @@ class UploadNewVersionView(APIView):
 
             new_file = request.FILES['new_version']
             file_name = new_file.name.split('/')[-1]
-            file_type = file_name.split('.')[-1].lower()
-            file_size = new_file.size
-
-            # If no versions exist, this is the base version
-            if not FileVersion.objects.filter(uploaded_file=uploaded_file).exists():
-                FileVersion.objects.create(
-                    uploaded_file=uploaded_file,
-                    version_number=0,
-                    file=uploaded_file.file,
-                    file_name=uploaded_file.file.name.split("/")[-1],
-                    file_size=uploaded_file.file_size,
-                    file_type=uploaded_file.file_type,
-                    uploaded_by=uploaded_file.owner,
-                    change_note="Base version",
-                    is_current=False  # Base version is not current anymore
-                )
-                version_number = 1
-            else:
-                latest_version = FileVersion.objects.filter(uploaded_file=uploaded_file).order_by('-version_number').first()
-                version_number = latest_version.version_number + 1 if latest_version else 1
+            if not StorageUsage.objects.allows(request.user, new_file.size):
+                return Response({"error": "Storage quota exceeded"}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
 
-            # Set all previous versions to not current
-            FileVersion.objects.filter(uploaded_file=uploaded_file).update(is_current=False)
-
-            # Create new version as current
-            FileVersion.objects.create(
-                uploaded_file=uploaded_file,
-                version_number=version_number,
-                file=new_file,
+            uploaded_file.add_version(
+                store_blob(new_file),
                 file_name=file_name,
-                file_size=file_size,
-                file_type=file_type,
                 uploaded_by=request.user,
                 change_note=request.data.get('change_note', ''),
-                is_current=True  # ✅ This is the current version now
             )
 
-            # Update current file in UploadedFile
-            uploaded_file.file = new_file
-            uploaded_file.name = file_name
-            uploaded_file.file_size = file_size
-            uploaded_file.file_type = file_type
-            uploaded_file.save()
-
             return Response({'message': 'New version uploaded'})
 
         except UploadedFile.DoesNotExist:
@@ -582,7 +791,8 @@ class FileVersionHistoryView(APIView):
                     uploaded_file=uploaded_file,
                     version_number=0,
                     file=uploaded_file.file,
-                    file_name=uploaded_file.file.name.split("/")[-1],
+                    blob_id=uploaded_file.blob_id,
+                    file_name=uploaded_file.name,
                     file_size=uploaded_file.file_size,
                     file_type=uploaded_file.file_type,
                     uploaded_by=uploaded_file.owner,
@@ -602,7 +812,7 @@ class FileVersionHistoryView(APIView):
                 version_history.append({
                     "id": version.id,
                     "version_number": version.version_number,
-                    "file_name": version.file.name.split("/")[-1],
+                    "file_name": version.file_name or version.file.name.split("/")[-1],
                     "uploaded_by_name": version.uploaded_by.get_full_name() if version.uploaded_by else "Unknown",
                     "uploaded_at": version.uploaded_at.isoformat(),
                     "change_note": version.change_note or "",
@@ -630,7 +840,8 @@ class RevertVersionView(APIView):
 
             # Update uploaded_file to match selected version
             uploaded_file.file = version.file
-            uploaded_file.name = version.file.name.split("/")[-1]
+            uploaded_file.blob_id = version.blob_id
+            uploaded_file.name = version.file_name or version.file.name.split("/")[-1]
             uploaded_file.file_size = version.file_size
             uploaded_file.file_type = version.file_type
             uploaded_file.save()
@@ -670,10 +881,34 @@ class UpcomingRemindersView(APIView):
         start = now - timedelta(minutes=10)
         end = now + timedelta(hours=1)
 
-        reminders = Reminder.objects.filter(
-            user=request.user,
-            remind_at__range=(start, end)
-        ).order_by("remind_at")
+        # Due within the hour, or fired in the last ten minutes; recurring ones by their next occurrence
+        reminders = Reminder.objects.filter(user=request.user).filter(
+            Q(next_fire_at__range=(start, end)) | Q(last_fired_at__gte=start)
+        ).order_by("next_fire_at")
 
         serializer = ReminderSerializer(reminders, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+
+class NotificationListView(APIView):
+    """ Unread in-app notifications, newest first. """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        notifications = (
+            Notification.objects.filter(user=request.user, read_at__isnull=True)
+            .select_related("file")
+            .order_by("-created_at")[:50]
+        )
+        return Response(NotificationSerializer(notifications, many=True).data)
+
+
+class MarkNotificationsReadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        notifications = Notification.objects.filter(user=request.user, read_at__isnull=True)
+        ids = request.data.get("ids")
+        if ids:
+            notifications = notifications.filter(id__in=ids)
+        return Response({"marked_read": notifications.update(read_at=timezone.now())})
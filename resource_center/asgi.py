@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'resource_center.settings')
 
 application = get_asgi_application()
+
+# Load categories before the first request needs them; tags are looked up by name
+from resource import refdata  # noqa: E402
+refdata.warm()
@@ -0,0 +1,156 @@
+"""
+Opt-in per-request SQL and timing instrumentation.
+
+Enable with REQUEST_METRICS_ENABLED=True. When disabled the middleware raises
+MiddlewareNotUsed at startup, so Django drops it from the chain and requests pay
+nothing for it.
+"""
+import json
+import logging
+import threading
+from contextlib import ExitStack
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+logger = logging.getLogger("resource_center.requests")
+
+_current = ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    __slots__ = ("query_count", "db_time", "serializer_time", "in_serializer")
+
+    def __init__(self):
+        self.query_count = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.in_serializer = False
+
+    def record_query(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - start
+            self.query_count += 1
+
+
+class _Aggregates:
+    """ Running per-URL-name totals for this worker process. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_name = {}
+
+    def add(self, url_name, total, metrics, size):
+        with self._lock:
+            entry = self._by_name.setdefault(url_name, {
+                "requests": 0, "queries": 0, "db_ms": 0.0, "serializer_ms": 0.0,
+                "total_ms": 0.0, "max_total_ms": 0.0, "bytes": 0,
+            })
+            entry["requests"] += 1
+            entry["queries"] += metrics.query_count
+            entry["db_ms"] += metrics.db_time * 1000
+            entry["serializer_ms"] += metrics.serializer_time * 1000
+            entry["total_ms"] += total * 1000
+            entry["max_total_ms"] = max(entry["max_total_ms"], total * 1000)
+            entry["bytes"] += size or 0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {
+                    **entry,
+                    "avg_queries": entry["queries"] / entry["requests"],
+                    "avg_total_ms": entry["total_ms"] / entry["requests"],
+                }
+                for name, entry in self._by_name.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._by_name.clear()
+
+
+aggregates = _Aggregates()
+
+
+def _instrument_serializers():
+    """ Time top-level DRF serializer `.data` calls made while a request is being measured. """
+    from rest_framework.serializers import BaseSerializer
+
+    if getattr(BaseSerializer, "_request_metrics_timed", False):
+        return
+    original = BaseSerializer.data.fget
+
+    def data(self):
+        metrics = _current.get()
+        if metrics is None or metrics.in_serializer:
+            return original(self)
+        metrics.in_serializer = True
+        start = perf_counter()
+        try:
+            return original(self)
+        finally:
+            metrics.serializer_time += perf_counter() - start
+            metrics.in_serializer = False
+
+    BaseSerializer.data = property(data)
+    BaseSerializer._request_metrics_timed = True
+
+
+def _response_size(response):
+    if not getattr(response, "streaming", False):
+        return len(response.content)
+    length = response.get("Content-Length")
+    return int(length) if length else None
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, "REQUEST_METRICS_ENABLED", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        _instrument_serializers()
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics.record_query))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = perf_counter() - start
+
+        size = _response_size(response)
+        match = getattr(request, "resolver_match", None)
+        url_name = (match.view_name if match else None) or "<unresolved>"
+
+        response["Server-Timing"] = ", ".join([
+            f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.query_count} queries"',
+            f"serialize;dur={metrics.serializer_time * 1000:.1f}",
+            f"total;dur={total * 1000:.1f}",
+        ])
+        aggregates.add(url_name, total, metrics, size)
+        logger.info(json.dumps({
+            "event": "request",
+            "method": request.method,
+            "path": request.path,
+            "url_name": url_name,
+            "status": response.status_code,
+            "queries": metrics.query_count,
+            "db_ms": round(metrics.db_time * 1000, 2),
+            "serializer_ms": round(metrics.serializer_time * 1000, 2),
+            "total_ms": round(total * 1000, 2),
+            "bytes": size,
+        }))
+        return response
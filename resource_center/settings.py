@@ -1,5 +1,7 @@
 import os
+import tempfile
 import dj_database_url
+from datetime import timedelta
 from pathlib import Path
 from dotenv import load_dotenv
 from decouple import config
@@ -62,6 +64,7 @@ LOGIN_REDIRECT_URL = config("OIDC_LOGIN_REDIRECT_URL")
 
 
 MIDDLEWARE = [
+    'resource_center.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,6 +76,20 @@ MIDDLEWARE = [
     'allauth.account.middleware.AccountMiddleware',
 ]
 
+# Per-request query count / DB time / serializer time, as Server-Timing headers and log lines
+REQUEST_METRICS_ENABLED = config("REQUEST_METRICS_ENABLED", default=False, cast=bool)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'resource_center.requests': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 ROOT_URLCONF = 'resource_center.urls'
 
 TEMPLATES = [
@@ -159,6 +176,52 @@ WHITENOISE_KEEP_ONLY_HASHED_FILES = True
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# How download_file/view_file send bytes: "direct" (Django streams them), "x-accel-redirect"
+# (nginx, via an internal location at FILE_DELIVERY_INTERNAL_PREFIX) or "x-sendfile"
+FILE_DELIVERY_MODE = config("FILE_DELIVERY_MODE", default="direct")
+FILE_DELIVERY_INTERNAL_PREFIX = config("FILE_DELIVERY_INTERNAL_PREFIX", default="/protected-media/")
+
+# Hash uploads while they stream in, for the content-addressed blob store
+FILE_UPLOAD_HANDLERS = [
+    'resource.blobs.HashingMemoryFileUploadHandler',
+    'resource.blobs.HashingTemporaryFileUploadHandler',
+]
+
+# Defaults for `manage.py extract_text` (document text for search and previews)
+EXTRACTION_WORKERS = config("EXTRACTION_WORKERS", default=2, cast=int)
+EXTRACTION_TIMEOUT = config("EXTRACTION_TIMEOUT", default=60, cast=int)
+EXTRACTION_MEMORY_MB = config("EXTRACTION_MEMORY_MB", default=1024, cast=int)
+
+# Shared by the workers on a host: carries the reference-data version stamp (resource/refdata.py).
+# Point it at memcached or redis when workers run on several hosts.
+CACHES = {
+    'default': {
+        'BACKEND': config("CACHE_BACKEND", default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config("CACHE_LOCATION", default=os.path.join(tempfile.gettempdir(), 'resource_center_cache')),
+    }
+}
+
+# Server-push events (/events/, ASGI only). "postgres" fans events out over LISTEN/NOTIFY so
+# other processes such as run_reminders reach the browsers; unset picks it on PostgreSQL
+EVENTS_BROKER = config("EVENTS_BROKER", default="") or None
+EVENTS_HEARTBEAT = config("EVENTS_HEARTBEAT", default=25, cast=int)
+
+# Threads per worker process for post-upload sniffing and indexing; 0 runs it in the request
+POST_UPLOAD_WORKERS = config("POST_UPLOAD_WORKERS", default=4, cast=int)
+
+# Resumable uploads (/uploads/) expire this long after their last chunk
+UPLOAD_SESSION_TTL = timedelta(hours=config("UPLOAD_SESSION_TTL_HOURS", default=24, cast=int))
+
+# Thumbnails and previews (resource/renditions.py): a local directory per host, trimmed
+# least recently used first past the size limit
+RENDITION_CACHE_DIR = config("RENDITION_CACHE_DIR", default=os.path.join(tempfile.gettempdir(), 'resource_center_renditions'))
+RENDITION_CACHE_MAX_BYTES = config("RENDITION_CACHE_MAX_BYTES", default=512 * 1024 * 1024, cast=int)
+# Background render threads per worker process; 0 renders in the request
+RENDITION_WORKERS = config("RENDITION_WORKERS", default=2, cast=int)
+
+# Bytes each user may store, versions included; 0 is unlimited. StorageUsage.quota overrides it per user
+STORAGE_QUOTA_BYTES = config("STORAGE_QUOTA_BYTES", default=0, cast=int)
+
 # REST_FRAMEWORK = {
 #     'DEFAULT_PERMISSION_CLASSES': [
 #         'rest_framework.permissions.AllowAny',  # Allow anyone to use the API
@@ -180,7 +243,7 @@ REST_FRAMEWORK = {
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = config("EMAIL_BACKEND", default='django.core.mail.backends.smtp.EmailBackend')
 # EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 EMAIL_HOST = 'smtp.gmail.com'  
@@ -190,6 +253,11 @@ EMAIL_HOST_USER = config("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = config("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Queued email, sent by `manage.py send_queued_mail`
+MAIL_SEND_RATE = config("MAIL_SEND_RATE", default=5, cast=float)
+MAIL_MESSAGES_PER_CONNECTION = config("MAIL_MESSAGES_PER_CONNECTION", default=100, cast=int)
+MAIL_MAX_ATTEMPTS = config("MAIL_MAX_ATTEMPTS", default=6, cast=int)
+
 
 
 
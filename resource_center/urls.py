@@ -3,12 +3,16 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .views import request_metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('resource.urls')),
     path("oidc/", include("mozilla_django_oidc.urls")),
 ]
 
+if settings.REQUEST_METRICS_ENABLED:
+    urlpatterns.append(path('metrics/requests/', request_metrics, name='request-metrics'))
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -0,0 +1,10 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+
+from .middleware import aggregates
+
+
+@staff_member_required
+def request_metrics(request):
+    """ Per-URL-name request metrics collected by this worker since it started. """
+    return JsonResponse(aggregates.snapshot())
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'resource_center.settings')
 
 application = get_wsgi_application()
+
+# Load categories before the first request needs them; tags are looked up by name
+from resource import refdata  # noqa: E402
+refdata.warm()
@@ -2,6 +2,20 @@ import { performAction } from "./actionHandler.js";
 
 let currentFolder = { id: null, name: "", parent: null };
 
+// The listing on screen and where its next pages start ("Load more")
+const listing = {
+  folderId: null,
+  starred: false,
+  archived: false,
+  files: [],
+  folders: [],
+  nextCursor: null,
+  nextFolderCursor: null,
+};
+const sharedListing = { entries: [], nextCursor: null };
+// Rows picked for the action bar, keyed "file:<id>" / "folder:<id>"
+const selection = new Map();
+
 let uploadedFile = null;
 let dropzone = null; // Declare Dropzone globally
 let categoryModalShown = false;
@@ -337,11 +351,13 @@ function fetchFolders() {
     .catch((error) => console.error("Error fetching folders:", error));
 }
 
-// Fetch files and folders, and display them sorted by latest added
+// Fetch files and folders, and display them sorted by latest added.
+// With loadMore, fetch the next page of the current listing and add it to what is shown.
 function fetchFilesAndFolders(
   folderId = null,
   starred = false,
-  archived = false
+  archived = false,
+  loadMore = false
 ) {
   // console.log(folderId);
   let url = folderId ? `/folder-contents/${folderId}/` : "/folder-contents/"; // Default URL for all folders
@@ -361,6 +377,16 @@ function fetchFilesAndFolders(
     url += url.includes("?") ? "&archived=true" : "?archived=true"; // Add query param without overwriting
   }
 
+  // Only the lists that have more pages move on; the other would start over
+  const moreFiles = !loadMore || listing.nextCursor;
+  const moreFolders = !loadMore || listing.nextFolderCursor;
+  if (loadMore) {
+    const params = new URLSearchParams();
+    if (listing.nextCursor) params.set("cursor", listing.nextCursor);
+    if (listing.nextFolderCursor) params.set("folder_cursor", listing.nextFolderCursor);
+    url += (url.includes("?") ? "&" : "?") + params.toString();
+  }
+
   console.log("Fetching from URL:", url);
   fetch(url)
     .then((response) => response.json())
@@ -371,17 +397,33 @@ function fetchFilesAndFolders(
         return;
       }
 
+      if (!loadMore) {
+        Object.assign(listing, { folderId, starred, archived, files: [], folders: [] });
+      }
+      if (moreFiles) {
+        listing.files = listing.files.concat(data.files);
+        listing.nextCursor = data.next_cursor;
+      }
+      if (moreFolders) {
+        listing.folders = listing.folders.concat(data.folders);
+        listing.nextFolderCursor = data.next_folder_cursor;
+      }
+
       currentFolder.id = data.current_folder ? data.current_folder : null;
       const currentEmail = data.current_email;
       const current_first_name = data.current_first_name;
       console.log(currentEmail, current_first_name);
       document.getElementById("user-name").innerText = current_first_name;
       renderFilesAndFolders({
-        files: data.files,
-        folders: data.folders,
+        files: listing.files,
+        folders: listing.folders,
         currentEmail: currentEmail,
       });
-      document.getElementById("myFilesCount").innerText = data.files.length;
+      // "100+" until the last page is loaded
+      document.getElementById("myFilesCount").innerText =
+        listing.files.length + (listing.nextCursor ? "+" : "");
+      document.getElementById("load-more").style.display =
+        listing.nextCursor || listing.nextFolderCursor ? "block" : "none";
     })
     .catch((error) => {
       console.error("Error fetching files and folders:", error);
@@ -389,6 +431,15 @@ function fetchFilesAndFolders(
     });
 }
 
+function loadMoreFilesAndFolders() {
+  fetchFilesAndFolders(listing.folderId, listing.starred, listing.archived, true);
+}
+
+document.addEventListener("DOMContentLoaded", function () {
+  document.getElementById("load-more-btn").addEventListener("click", loadMoreFilesAndFolders);
+  document.getElementById("load-more-shared-btn").addEventListener("click", () => loadSharedWithMe(true));
+});
+
 function renderFilesAndFolders({ folders = [], files = [], currentEmail }) {
   const combinedData = [...folders, ...files];
 
@@ -447,6 +498,16 @@ function getFileIcon(fileType) {
   return fileIcons[fileType] || fileIcons["default"];
 }
 
+// Preview image for files the server can render, falling back to the type icon
+function fileIconMarkup(file, iconClass) {
+  if (!file.thumbnail_url) {
+    return `<i class="${iconClass} file-icon"></i>`;
+  }
+  return `<img src="${file.thumbnail_url}" class="file-icon file-thumbnail" alt="" loading="lazy"
+    width="32" height="32" style="object-fit: cover"
+    onerror="this.outerHTML = '<i class=&quot;${iconClass} file-icon&quot;></i>'">`;
+}
+
 function generateActionButton(fileId, fileName, isOwner) {
   let ownerOptions = "";
 
@@ -539,9 +600,10 @@ function updateTable(files, currentEmail) {
       file.owner_email === currentEmail ? "me" : file.owner_email;
     // console.log(file.owner_email);
 
-    let row = `<tr class="${isFolder ? "folder-row" : "file-row"}">
+    let row = `<tr class="${isFolder ? "folder-row" : "file-row"}"
+      data-id="${file.id}" data-type="${isFolder ? "folder" : "file"}">
     <td class="name-col">
-  <i class="${itemIconClass} file-icon"></i> 
+  ${isFolder ? `<i class="${itemIconClass} file-icon"></i>` : fileIconMarkup(file, itemIconClass)} 
   <span class="text-muted" 
         onclick="${
           isFolder
@@ -570,7 +632,8 @@ function updateTable(files, currentEmail) {
             ? `<i class="fas fa-undo text-primary" title="Unarchive this file"
                onclick="archiveFile(${file.id}, '${file.name}')"></i>`
             : generateActionButton(file.id, file.name, file.is_owner)
-          : ""
+          : `<i class="fas fa-download text-primary" title="Download as ZIP"
+               onclick="downloadFolder(${file.id})"></i>`
       }
       </td>
 
@@ -578,54 +641,164 @@ function updateTable(files, currentEmail) {
 
     tableBody.innerHTML += row;
   });
+
+  // Keep the selection on rows that are still listed (e.g. after "Load more")
+  const listed = new Set();
+  tableBody.querySelectorAll("tr[data-id]").forEach((row) => {
+    const key = selectionKey(row);
+    listed.add(key);
+    if (selection.has(key)) row.classList.add("selected");
+  });
+  [...selection.keys()].forEach((key) => {
+    if (!listed.has(key)) selection.delete(key);
+  });
+  updateActionBar();
+}
+
+function selectionKey(row) {
+  return `${row.dataset.type}:${row.dataset.id}`;
+}
+
+function selectedItem(row) {
+  const id = Number(row.dataset.id);
+  const items = row.dataset.type === "folder" ? listing.folders : listing.files;
+  const item = items.find((entry) => entry.id === id) || {};
+  return {
+    id: id,
+    type: row.dataset.type,
+    name: item.name,
+    isStarred: Boolean(item.is_starred),
+  };
+}
+
+function updateActionBar() {
+  const actionBar = document.getElementById("actionBar");
+  if (!actionBar) return;
+  if (selection.size > 0) {
+    actionBar.style.cssText = "display: flex !important;";
+    document.getElementById("selected-count").textContent = `${selection.size} selected`;
+  } else {
+    actionBar.style.display = "none";
+  }
+}
+
+function clearSelection() {
+  document
+    .querySelectorAll("#file-table-section tbody tr.selected")
+    .forEach((el) => {
+      el.classList.remove("selected");
+    });
+  selection.clear();
+  updateActionBar();
+}
+
+const BULK_NOTIFICATIONS = {
+  star: "starred",
+  unstar: "unstarred",
+  archive: "archived",
+  unarchive: "unarchived",
+  delete: "deleted",
+};
+
+// Star, archive or delete everything selected in one request
+function bulkAction(action) {
+  const items = [...selection.values()];
+  if (!items.length) return;
+  if (action === "star" && items.every((item) => item.isStarred)) {
+    action = "unstar";
+  } else if (action === "archive" && listing.archived) {
+    action = "unarchive";
+  }
+  if (
+    action === "delete" &&
+    !confirm(`Delete ${items.length} selected item${items.length > 1 ? "s" : ""}?`)
+  ) {
+    return;
+  }
+
+  fetch("/bulk-actions/", {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+      "X-CSRFToken": getCSRFToken(),
+    },
+    body: JSON.stringify({
+      action: action,
+      file_ids: items.filter((item) => item.type === "file").map((item) => item.id),
+      folder_ids: items.filter((item) => item.type === "folder").map((item) => item.id),
+    }),
+  })
+    .then((response) =>
+      response.json().then((data) => ({ ok: response.ok, data: data }))
+    )
+    .then(({ ok, data }) => {
+      if (!ok) {
+        alert(data.error || "The action could not be applied.");
+        return;
+      }
+      const done = new Set([
+        ...data.files.map((entry) => `file:${entry.id}`),
+        ...data.folders.map((entry) => `folder:${entry.id}`),
+      ]);
+      const names = items
+        .filter((item) => done.has(`${item.type}:${item.id}`))
+        .map((item) => item.name);
+      clearSelection();
+      fetchFilesAndFolders(listing.folderId, listing.starred, listing.archived);
+      if (names.length) {
+        showNotification(names, BULK_NOTIFICATIONS[action]);
+      }
+    })
+    .catch((error) => console.error("Error:", error));
 }
+window.bulkAction = bulkAction;
+
+// The selected files as one ZIP, or a lone selected folder as its own
+function downloadSelection() {
+  const items = [...selection.values()];
+  const fileIds = items.filter((item) => item.type === "file").map((item) => item.id);
+  if (fileIds.length) {
+    const a = document.createElement("a");
+    a.href = `/download-zip/?files=${fileIds.join(",")}`;
+    a.setAttribute("download", "");
+    document.body.appendChild(a);
+    a.click();
+    document.body.removeChild(a);
+  } else if (items.length === 1) {
+    downloadFolder(items[0].id);
+  }
+}
+window.downloadSelection = downloadSelection;
 
 document.addEventListener("DOMContentLoaded", function () {
   const tableBody = document.querySelector("#file-table-section tbody");
-  const actionBar = document.getElementById("actionBar");
-  const selectedCount = document.getElementById("selected-count");
   const clearSelectionBtn = document.querySelector(".clear-selection");
 
-  let selectedRows = new Set(); // Track selected rows
-
-  // Handle row click for selection (excluding folders)
+  // Handle row click for selection
   tableBody.addEventListener("click", function (event) {
-    const row = event.target.closest("tr"); // Get the clicked row
-    if (!row || row.classList.contains("folder-row")) return; // Ignore folder rows
+    const row = event.target.closest("tr[data-id]"); // Get the clicked row
+    // Clicks on a name, star or action button do their own thing
+    if (!row || event.target.closest("[onclick], .dropdown")) return;
 
-    const rowIndex = row.dataset.index; // Use a data attribute for row index
+    const key = selectionKey(row);
 
     if (event.ctrlKey || event.metaKey) {
       // Multi-select (Ctrl or Cmd)
-      if (selectedRows.has(rowIndex)) {
+      if (selection.has(key)) {
         row.classList.remove("selected");
-        selectedRows.delete(rowIndex);
+        selection.delete(key);
       } else {
         row.classList.add("selected");
-        selectedRows.add(rowIndex);
+        selection.set(key, selectedItem(row));
       }
     } else {
       // Single select (deselect others)
-      document
-        .querySelectorAll("#file-table-section tbody tr.selected")
-        .forEach((el) => {
-          el.classList.remove("selected");
-        });
-      selectedRows.clear();
-
+      clearSelection();
       row.classList.add("selected");
-      selectedRows.add(rowIndex);
-    }
-
-    // Show or hide action bar
-    if (selectedRows.size > 0) {
-      console.log("size:", selectedRows.size);
-      actionBar.style.cssText = "display: flex !important;";
-      selectedCount.textContent = `${selectedRows.size} selected`;
-    } else {
-      actionBar.style.display = "none";
+      selection.set(key, selectedItem(row));
     }
 
+    updateActionBar();
     event.stopPropagation(); // Prevent bubbling
   });
 
@@ -637,21 +810,13 @@ document.addEventListener("DOMContentLoaded", function () {
   //       .forEach((el) => {
   //         el.classList.remove("selected");
   //       });
-  //     selectedRows.clear();
+  //     selection.clear();
   //     actionBar.style.display = "none";
   //   }
   // });
 
   // Clear selection button
-  clearSelectionBtn.addEventListener("click", function () {
-    document
-      .querySelectorAll("#file-table-section tbody tr.selected")
-      .forEach((el) => {
-        el.classList.remove("selected");
-      });
-    selectedRows.clear();
-    actionBar.style.display = "none";
-  });
+  clearSelectionBtn.addEventListener("click", clearSelection);
 });
 
 // Function to format file size into KB, MB, etc.
@@ -715,6 +880,8 @@ function showNotification(itemNames, action) {
       message = `${itemNames.join(", ")} archived successfully.`;
     } else if (action === "unarchived") {
       message = `${itemNames.join(", ")} unarchived successfully.`;
+    } else if (action === "deleted") {
+      message = `${itemNames.join(", ")} deleted successfully.`;
     } else if (action === "shared") {
       message = `Shared successfully!`;
     } else if (action === "email") {
@@ -864,6 +1031,17 @@ function downloadFile(fileId) {
 }
 window.downloadFile = downloadFile;
 
+function downloadFolder(folderId) {
+  // Streams as it is built, so the browser's download starts right away
+  const a = document.createElement("a");
+  a.href = `/download-zip/?folder=${folderId}`;
+  a.setAttribute("download", "");
+  document.body.appendChild(a);
+  a.click();
+  document.body.removeChild(a);
+}
+window.downloadFolder = downloadFolder;
+
 function viewFile(fileId) {
   // Create the URL to the file (using Django view to serve the file)
   const viewUrl = `/view-file/${fileId}/`; // The URL to download or open the file
@@ -929,6 +1107,9 @@ function toggleStar(objectId, objectType, starIcon, itemName) {
     .then((response) => response.json())
     .then((data) => {
       if (data.is_starred !== undefined) {
+        const items = objectType === "file" ? listing.files : listing.folders;
+        const item = items.find((entry) => entry.id === objectId);
+        if (item) item.is_starred = data.is_starred;
         // Toggle the star class based on the new starred status
         if (data.is_starred) {
           starIcon.classList.remove("far");
@@ -1155,11 +1336,17 @@ document
     loadSharedWithMe(); // Load and display shared files
   });
 
-function loadSharedWithMe() {
-  fetch("/api/shared-with-me/")
+function loadSharedWithMe(loadMore = false) {
+  let url = "/api/shared-with-me/";
+  if (loadMore && sharedListing.nextCursor) {
+    url += `?cursor=${encodeURIComponent(sharedListing.nextCursor)}`;
+  }
+  fetch(url)
     .then((res) => res.json())
     .then((data) => {
-      updateSharedTable(data.files); // This fills the shared-with-me table
+      sharedListing.entries = (loadMore ? sharedListing.entries : []).concat(data.files);
+      sharedListing.nextCursor = data.next_cursor;
+      updateSharedTable(sharedListing.entries); // This fills the shared-with-me table
 
       // Show the shared-with-me section and hide the rest
       document.getElementById("shared-with-me-section").style.display = "block";
@@ -1167,8 +1354,12 @@ function loadSharedWithMe() {
 
       // Update the badge count
       document.getElementById("sharedWithMeCount").innerText =
-        data.files.length;
-      markSharedFilesAsSeen();
+        sharedListing.entries.length + (sharedListing.nextCursor ? "+" : "");
+      document.getElementById("load-more-shared").style.display =
+        sharedListing.nextCursor ? "block" : "none";
+      if (!loadMore) {
+        markSharedFilesAsSeen();
+      }
     })
     .catch((err) => console.error("Failed to load shared files:", err));
 }
@@ -1186,7 +1377,7 @@ function updateSharedTable(sharedFiles) {
     const row = `
       <tr>
       <td class="name-col">
-  <i class="${fileIcon} file-icon"></i>
+  ${fileIconMarkup(file, fileIcon)}
   <span class="text-muted" 
         onclick="viewFile(${file.id})" style="cursor:pointer">${file.name}
   </span>
@@ -1219,6 +1410,48 @@ function updateSharedNotificationCount() {
 }
 window.updateSharedNotificationCount = updateSharedNotificationCount;
 document.addEventListener("DOMContentLoaded", updateSharedNotificationCount);
+
+// Server-push updates; polls only where the event stream isn't available
+const EVENT_POLL_INTERVAL = 60000;
+let eventPollTimer = null;
+let folderRefreshTimer = null;
+
+function refreshEverything() {
+  updateSharedNotificationCount();
+  fetchUpcomingReminders();
+  fetchFilesAndFolders(currentFolder.id);
+}
+
+function startEventPolling() {
+  if (eventPollTimer) return;
+  eventPollTimer = setInterval(() => {
+    updateSharedNotificationCount();
+    fetchUpcomingReminders();
+  }, EVENT_POLL_INTERVAL);
+}
+
+function connectEventStream() {
+  if (!window.EventSource) {
+    startEventPolling();
+    return;
+  }
+  const source = new EventSource("/events/");
+  source.addEventListener("share", () => updateSharedNotificationCount());
+  source.addEventListener("reminder", () => fetchUpcomingReminders());
+  source.addEventListener("file", (event) => {
+    const data = JSON.parse(event.data);
+    if ((data.folder || null) !== (currentFolder.id || null)) return;
+    // Coalesce bursts (bulk uploads, moves) into one reload
+    clearTimeout(folderRefreshTimer);
+    folderRefreshTimer = setTimeout(() => fetchFilesAndFolders(currentFolder.id), 500);
+  });
+  source.addEventListener("resync", refreshEverything);
+  source.onerror = () => {
+    // CLOSED means the server refused the stream (e.g. not served over ASGI)
+    if (source.readyState === EventSource.CLOSED) startEventPolling();
+  };
+}
+document.addEventListener("DOMContentLoaded", connectEventStream);
 function markSharedFilesAsSeen() {
   fetch("/api/shared-with-me/mark-seen/", {
     method: "POST",
@@ -1458,7 +1691,7 @@ document
         message: message,
         file_id: selected_FileId,
       },
-      successMessage: "Email sent successfully!",
+      successMessage: "Email queued for sending.",
       errorMessage: "Failed to send email.",
     }).then(() => {
       document.getElementById("emailShareForm").reset();
@@ -1842,8 +2075,15 @@ function fetchUpcomingReminders() {
       const tenMinutesAgo = new Date(now.getTime() - 10 * 60 * 1000);
       const oneHourLater = new Date(now.getTime() + 60 * 60 * 1000);
 
+      // Recurring reminders come back with their next (or just fired) occurrence
+      const reminderTime = (r) => {
+        const fired = r.last_fired_at && new Date(r.last_fired_at);
+        if (fired && fired >= tenMinutesAgo) return fired;
+        return new Date(r.next_fire_at || r.remind_at);
+      };
+
       const upcomingOrMissed = reminders.filter((r) => {
-        const remindTime = new Date(r.remind_at);
+        const remindTime = reminderTime(r);
         return remindTime >= tenMinutesAgo && remindTime <= oneHourLater;
       });
 
@@ -1870,7 +2110,7 @@ function fetchUpcomingReminders() {
 
       // Display up to 2 reminders in the dropdown
       upcomingOrMissed.slice(0, 2).forEach((reminder) => {
-        const remindTime = new Date(reminder.remind_at);
+        const remindTime = reminderTime(reminder);
         const html = `
             <a href="#" class="d-flex px-3 py-2 align-items-start text-decoration-none border-bottom">
               <div class="notif-icon notif-info me-3">
@@ -1888,7 +2128,7 @@ function fetchUpcomingReminders() {
 
       // Display all reminders in the modal
       upcomingOrMissed.forEach((reminder) => {
-        const remindTime = new Date(reminder.remind_at);
+        const remindTime = reminderTime(reminder);
         const html = `
             <div class="d-flex px-3 py-2 align-items-start border-bottom">
               <div class="notif-icon notif-info me-3">